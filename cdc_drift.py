@@ -0,0 +1,123 @@
+import json
+from db_connection import DBConnection
+from logger import _logger
+
+# Schema drift of CDC capture instances.
+# A capture instance keeps the column list of its source table from when it was created, columns
+# added to the table later are not captured (Fivetran reports "New Columns found in CDC
+# Instance"). Two catalog queries per database read the captured columns of every capture
+# instance and the live columns of every tracked table, the per-table column sets are compared
+# by hash first and diffed only when they differ. Only drifted tables get their capture instance
+# recreated, each drift is reported with the columns added, removed and (with compare_types)
+# retyped.
+
+# the cdc tables only exist once CDC is enabled, without them the batch answers no result set
+CAPTURED_COLUMNS_QUERY = """
+    SET NOCOUNT ON;
+    IF OBJECT_ID('cdc.change_tables') IS NOT NULL
+        EXEC('
+            SELECT s.name AS table_schema, t.name AS table_name, ct.capture_instance, cc.column_name, cc.column_type
+            FROM cdc.change_tables ct
+            JOIN sys.tables t ON t.object_id = ct.source_object_id
+            JOIN sys.schemas s ON s.schema_id = t.schema_id
+            JOIN cdc.captured_columns cc ON cc.object_id = ct.object_id
+        ');
+"""
+
+LIVE_COLUMNS_QUERY = """
+    SELECT s.name AS table_schema, t.name AS table_name, c.name AS column_name, TYPE_NAME(c.system_type_id) AS column_type
+    FROM sys.tables t
+    JOIN sys.schemas s ON s.schema_id = t.schema_id
+    JOIN sys.columns c ON c.object_id = t.object_id
+    WHERE t.is_tracked_by_cdc = 1
+"""
+
+class TableDrift:
+    def __init__(self, table_schema, table_name, capture_instances, added, removed, retyped):
+        self.table_schema = table_schema
+        self.table_name = table_name
+        self.capture_instances = capture_instances
+        self.added = added
+        self.removed = removed
+        self.retyped = retyped
+
+    def to_json(self):
+        return {'table': f'{self.table_schema}.{self.table_name}', 'capture_instances': self.capture_instances,
+                'added': self.added, 'removed': self.removed, 'retyped': self.retyped}
+
+    def __repr__(self):
+        return f"TableDrift({self.table_schema}.{self.table_name}, added={self.added}, removed={self.removed})"
+
+def _columns(rows, compare_types):
+    # (schema, table[, capture instance]) -> {column: type}
+    columns = {}
+    for *key, column_name, column_type in rows:
+        columns.setdefault(tuple(key), {})[column_name] = column_type if compare_types else None
+    return columns
+
+def detect_drift(dbconnxn: DBConnection, compare_types=False):
+    """Drifted tables of a database: tables none of whose capture instances captures exactly the
+    live columns. A database without CDC has no drift."""
+    captured = _columns(dbconnxn.iter_query(CAPTURED_COLUMNS_QUERY, mode='tuple', batch_size=5000), compare_types)
+    if not captured:
+        return []
+    live = _columns(dbconnxn.iter_query(LIVE_COLUMNS_QUERY, mode='tuple', batch_size=5000), compare_types)
+    instances = {}
+    for (table_schema, table_name, capture_instance), columns in captured.items():
+        instances.setdefault((table_schema, table_name), {})[capture_instance] = columns
+    drifted = []
+    for table, by_instance in instances.items():
+        current = live.get(table)
+        if current is None:
+            continue
+        fingerprint = hash(frozenset(current.items()))
+        if any(hash(frozenset(columns.items())) == fingerprint and columns == current for columns in by_instance.values()):
+            continue
+        # report against the instance closest to the live table
+        columns = max(by_instance.values(), key=lambda columns: len(columns.keys() & current.keys()))
+        drifted.append(TableDrift(table[0], table[1], sorted(by_instance),
+                                  sorted(current.keys() - columns.keys()), sorted(columns.keys() - current.keys()),
+                                  sorted(name for name in current.keys() & columns.keys() if current[name] != columns[name])))
+    return drifted
+
+class DriftRepair:
+    def __init__(self, helper, role_name='role_name', compare_types=False, dry_run=False, chunk_size=200):
+        # helper is a facilities_helper, its disable/enable functions do the DDL
+        self.helper = helper
+        self.role_name = role_name
+        self.compare_types = compare_types
+        self.dry_run = dry_run
+        self.chunk_size = chunk_size
+        self.logger = _logger('DEBUG', 'DriftRepair')
+
+    def repair(self, dbconnxn: DBConnection, dbname):
+        """Recreates the capture instances of the drifted tables of one database and returns the
+        drift report; usable as the work of a cdc_runner.DatabaseRunner."""
+        drifted = detect_drift(dbconnxn, self.compare_types)
+        details = {'drifted': len(drifted), 'tables': [drift.to_json() for drift in drifted]}
+        if self.dry_run or not drifted:
+            return details
+        for drift in drifted:
+            self.logger.info('Capture instance drift in %s.%s.%s: added %s, removed %s, retyped %s', dbname,
+                             drift.table_schema, drift.table_name, drift.added, drift.removed, drift.retyped)
+            for capture_instance in drift.capture_instances:
+                self.helper.disable_cdc_on_table(dbconnxn, drift.table_schema, drift.table_name, capture_instance)
+        tables = [(drift.table_schema, drift.table_name) for drift in drifted]
+        status = self.helper.enable_cdc_on_tables(dbconnxn, tables, self.role_name, self.chunk_size)
+        failed = [f'{schema}.{table}' for (schema, table), value in status.items() if value != 'enabled']
+        details['recreated'] = len(tables) - len(failed)
+        if failed:
+            raise RuntimeError(f"Capture instances not recreated for {len(failed)} tables of {dbname}: {', '.join(failed[:10])}")
+        return details
+
+def write_report(results, path):
+    """Json report of a drift run, {dbname: {'status': ..., 'drifted': n, 'tables': [...]}} for
+    the databases with drift or errors."""
+    report = {}
+    for result in results:
+        details = result.details or {}
+        if result.status == 'failed' or details.get('drifted'):
+            report[result.dbname] = {'status': result.status, 'error': result.error, **details}
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    return report
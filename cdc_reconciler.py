@@ -0,0 +1,136 @@
+from db_connection import DBConnection
+from logger import _logger
+
+# Idempotent CDC reconciliation of a facility database.
+# One catalog query reads the whole CDC state of a database: whether CDC is enabled, every user
+# table with is_tracked_by_cdc and its capture instances from cdc.change_tables. The state is
+# compared with the desired tables (get_latest_base_tables_for_cdc of the latest deployment) and
+# only what differs is changed: CDC enabled on the database when it is off, tables not tracked
+# enabled in one batch, stale tables (tracked without a capture instance, or gated by another
+# role when enforce_role is set) get their capture instances recreated. Tables that are already
+# right are not touched, so a run over databases that are in the desired state issues no DDL and
+# Fivetran keeps its capture instances.
+
+# one row per user table (a single row of NULL tables when there are none) with the database
+# flag repeated; cdc.change_tables only exists once CDC is enabled, so it is read dynamically
+SNAPSHOT_QUERY = """
+    SET NOCOUNT ON;
+    DECLARE @instances TABLE (object_id int, capture_instance sysname, role_name sysname NULL);
+    IF OBJECT_ID('cdc.change_tables') IS NOT NULL
+        INSERT INTO @instances EXEC('SELECT source_object_id, capture_instance, role_name FROM cdc.change_tables');
+    SELECT d.is_cdc_enabled, x.table_schema, x.table_name, x.is_tracked_by_cdc, x.capture_instance, x.role_name
+    FROM sys.databases d
+    LEFT JOIN (
+        SELECT s.name AS table_schema, t.name AS table_name, t.is_tracked_by_cdc, i.capture_instance, i.role_name
+        FROM sys.tables t
+        JOIN sys.schemas s ON s.schema_id = t.schema_id
+        LEFT JOIN @instances i ON i.object_id = t.object_id
+        WHERE t.is_ms_shipped = 0 AND s.name NOT IN ('cdc', 'sys')
+    ) x ON 1 = 1
+    WHERE d.database_id = DB_ID();
+"""
+
+class CDCSnapshot:
+    """CDC state of one database: tables maps (schema, table) to its capture instances,
+    [(capture_instance, role_name), ...], empty when the table is not tracked."""
+    def __init__(self, dbname, cdc_enabled=False, tables=None, tracked=None):
+        self.dbname = dbname
+        self.cdc_enabled = cdc_enabled
+        self.tables = tables or {}
+        self.tracked = tracked or set()
+
+    @classmethod
+    def from_rows(cls, dbname, rows):
+        snapshot = cls(dbname)
+        for is_cdc_enabled, table_schema, table_name, tracked, capture_instance, role_name in rows:
+            snapshot.cdc_enabled = bool(is_cdc_enabled)
+            if table_name is None:
+                continue
+            instances = snapshot.tables.setdefault((table_schema, table_name), [])
+            if tracked:
+                snapshot.tracked.add((table_schema, table_name))
+            if capture_instance is not None:
+                instances.append((capture_instance, role_name))
+        return snapshot
+
+def read_snapshot(dbconnxn: DBConnection, dbname):
+    return CDCSnapshot.from_rows(dbname, dbconnxn.iter_query(SNAPSHOT_QUERY, mode='tuple', batch_size=5000))
+
+class ReconcilePlan:
+    def __init__(self, dbname):
+        self.dbname = dbname
+        self.enable_database = False
+        self.enable = []
+        # (table, [capture instance names]) to disable and enable again, no names for a table
+        # tracked without a capture instance (disabled at the table level)
+        self.recreate = []
+        self.ok = []
+        self.missing = []
+        self.extra = []
+
+    @property
+    def changes(self):
+        return int(self.enable_database) + len(self.enable) + len(self.recreate)
+
+    def summary(self):
+        return {'enable_database': self.enable_database, 'enable': len(self.enable), 'recreate': len(self.recreate),
+                'ok': len(self.ok), 'missing': len(self.missing), 'extra': len(self.extra)}
+
+def plan(snapshot, desired, role_name=None, enforce_role=False):
+    """What reconciling a snapshot towards the desired (schema, table) list takes."""
+    result = ReconcilePlan(snapshot.dbname)
+    result.enable_database = not snapshot.cdc_enabled
+    desired = dict.fromkeys(desired)
+    for table in desired:
+        if table not in snapshot.tables:
+            # not deployed in this database yet, nothing to capture
+            result.missing.append(table)
+            continue
+        instances = snapshot.tables[table]
+        if table not in snapshot.tracked:
+            result.enable.append(table)
+        elif not instances or (enforce_role and all(role != role_name for _, role in instances)):
+            result.recreate.append((table, [name for name, _ in instances]))
+        else:
+            result.ok.append(table)
+    result.extra = [table for table in snapshot.tracked if table not in desired]
+    return result
+
+class CDCReconciler:
+    def __init__(self, helper, desired, role_name='role_name', enforce_role=False, dry_run=False, chunk_size=200):
+        # helper is a facilities_helper, its enable/disable functions do the DDL
+        self.helper = helper
+        self.desired = list(desired)
+        self.role_name = role_name
+        self.enforce_role = enforce_role
+        self.dry_run = dry_run
+        self.chunk_size = chunk_size
+        self.logger = _logger('DEBUG', 'CDCReconciler')
+
+    def reconcile(self, dbconnxn: DBConnection, dbname):
+        """Brings one database to the desired state and returns the plan summary; usable as the
+        work of a cdc_runner.DatabaseRunner. Raises when a change did not take."""
+        snapshot = read_snapshot(dbconnxn, dbname)
+        todo = plan(snapshot, self.desired, self.role_name, self.enforce_role)
+        details = todo.summary()
+        if self.dry_run or not todo.changes:
+            return details
+        self.logger.info('Reconciling CDC of %s: %s', dbname, details)
+        if todo.enable_database:
+            self.helper.enable_cdc_on_database(dbconnxn, dbname)
+        for (table_schema, table_name), capture_instances in todo.recreate:
+            # a table tracked without a capture instance is disabled as a whole ('all' instances)
+            # so it is untracked before the batch enables it again
+            for capture_instance in capture_instances or ['all']:
+                self.helper.disable_cdc_on_table(dbconnxn, table_schema, table_name, capture_instance)
+        recreate = [table for table, _ in todo.recreate]
+        tables = todo.enable + recreate
+        if tables:
+            status = self.helper.enable_cdc_on_tables(dbconnxn, tables, self.role_name, self.chunk_size)
+            # unchanged means a table to recreate was still tracked, i.e. its disable did not take
+            failed = [f'{schema}.{table}' for (schema, table), value in status.items()
+                      if value != 'enabled' and (value != 'unchanged' or (schema, table) in recreate)]
+            details['failed'] = len(failed)
+            if failed:
+                raise RuntimeError(f"CDC not enabled on {len(failed)} tables of {dbname}: {', '.join(failed[:10])}")
+        return details
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from config_helper import config
+from db_connection import DBConnection
+from logger import _logger
+
+# Runs one piece of work per facility database in parallel.
+# Every database gets a worker thread with its own DBConnection (pyodbc releases the GIL while it
+# waits on the server), at most max_workers at a time so the elastic pool is not saturated.
+# Each database ends in a DatabaseResult. With a journal every result is appended as one json
+# line as soon as it is known, tagged with the run key (a hash of the job and its inputs, see
+# run_key). A rerun with resume and the same journal and run key skips the databases that already
+# succeeded, so an interrupted rollout picks up where it stopped. Entries of other run keys are
+# ignored, and the journal is deleted once every database of a run has succeeded, so a later run
+# starts from scratch.
+
+class DatabaseResult:
+    """Outcome for one database: status is succeeded, failed or skipped (done in an earlier run)."""
+    def __init__(self, dbname, status='pending', seconds=0.0, details=None, error=None, finished_at=None):
+        self.dbname = dbname
+        self.status = status
+        self.seconds = seconds
+        self.details = details
+        self.error = error
+        self.finished_at = finished_at
+
+    def to_json(self):
+        return {'dbname': self.dbname, 'status': self.status, 'seconds': round(self.seconds, 3),
+                'details': self.details, 'error': self.error, 'finished_at': self.finished_at}
+
+    @classmethod
+    def from_json(cls, entry):
+        return cls(entry['dbname'], entry['status'], entry.get('seconds', 0.0), entry.get('details'),
+                   entry.get('error'), entry.get('finished_at'))
+
+    def __repr__(self):
+        return f"DatabaseResult({self.dbname!r}, {self.status!r}, seconds={self.seconds:.1f})"
+
+def run_key(*parts):
+    """Short hash identifying a run, e.g. run_key('reconcile', desired_tables)."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+class RunJournal:
+    """Append-only json lines file of DatabaseResults of one run key, the latest line per
+    database wins."""
+    def __init__(self, path, run_key=None):
+        self.path = path
+        self.run_key = run_key
+        self.results = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                        result = DatabaseResult.from_json(entry)
+                    except (ValueError, KeyError):
+                        # a line cut short by a crash
+                        continue
+                    if entry.get('run') == run_key:
+                        self.results[result.dbname] = result
+
+    def succeeded(self, dbname):
+        result = self.results.get(dbname)
+        return result is not None and result.status == 'succeeded'
+
+    def record(self, result):
+        line = json.dumps({**result.to_json(), 'run': self.run_key}, default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.results[result.dbname] = result
+
+    def remove(self):
+        with self._lock:
+            self.results.clear()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+class DatabaseRunner:
+    def __init__(self, work, max_workers=4, journal=None, config_file='configuration.json', pool=None, name='CDC',
+                 run_key=None):
+        # work(dbconnxn, dbname) does the job for one database and returns details for its result,
+        # an exception marks the database failed
+        self.work = work
+        self.max_workers = max_workers
+        # journal is a file name (entries scoped to run_key) or a RunJournal, None keeps no journal
+        self.journal = RunJournal(journal, run_key) if isinstance(journal, str) else journal
+        self.config_file = config_file
+        self.pool = pool
+        self.name = name
+        self.logger = _logger('DEBUG', 'DatabaseRunner')
+
+    def _run(self, dbname):
+        result = DatabaseResult(dbname)
+        start = time.perf_counter()
+        try:
+            with DBConnection(config(self.config_file, database=dbname), pool=self.pool) as dbconnxn:
+                if not dbconnxn.connection:
+                    raise ConnectionError(f'Failed to establish connection to {dbname}')
+                result.details = self.work(dbconnxn, dbname)
+            result.status = 'succeeded'
+        except Exception as e:
+            result.status, result.error = 'failed', str(e)
+        result.seconds = time.perf_counter() - start
+        result.finished_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        if self.journal is not None:
+            self.journal.record(result)
+        return result
+
+    def run(self, databases, resume=False):
+        """DatabaseResults for the databases in the given order. With resume, databases the
+        journal has as succeeded in this run are skipped and reported as skipped. The journal is
+        removed when every database succeeded."""
+        results, todo = {}, []
+        for dbname in dict.fromkeys(databases):
+            if resume and self.journal is not None and self.journal.succeeded(dbname):
+                results[dbname] = DatabaseResult(dbname, 'skipped', details=self.journal.results[dbname].details)
+            else:
+                todo.append(dbname)
+        self.logger.info('%s run on %s databases, %s done in an earlier run, %s workers',
+                         self.name, len(todo), len(results), self.max_workers)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='db') as executor:
+            futures = [executor.submit(self._run, dbname) for dbname in todo]
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                results[result.dbname] = result
+                if result.status == 'failed':
+                    self.logger.error('%s/%s %s %s failed after %.1fs: %s', done, len(todo), self.name, result.dbname,
+                                      result.seconds, result.error)
+                else:
+                    self.logger.info('%s/%s %s %s done in %.1fs: %s', done, len(todo), self.name, result.dbname,
+                                     result.seconds, result.details)
+        ordered = [results[dbname] for dbname in dict.fromkeys(databases)]
+        self.logger.info('%s run finished in %.1fs: %s', self.name, time.perf_counter() - start, summary(ordered))
+        if self.journal is not None and all(result.status != 'failed' for result in ordered):
+            self.logger.info('%s run complete, removing journal %s', self.name, self.journal.path)
+            self.journal.remove()
+        return ordered
+
+def summary(results):
+    counts = {'succeeded': 0, 'failed': 0, 'skipped': 0}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    counts['failed_databases'] = [result.dbname for result in results if result.status == 'failed']
+    return counts
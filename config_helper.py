@@ -1,32 +1,116 @@
 import json
 import os
+import threading
+
+# Layered json configuration with a process-wide cache.
+# A configuration is the file in the home directory, overlaid by the file of the same name in the
+# working directory, overlaid by environment variables named after the file and key, e.g.
+# CONFIGURATION__PASSWORD for the password of configuration.json. Each file is parsed once and
+# parsed again only when its modification time or size changes, the environment is read along
+# with the files (call clear() after changing os.environ at run time). The merged dict is built
+# once per (re)load and shared; config(...).config is a plain dict copy of its top level with the
+# per-call overrides applied, e.g. config('configuration.json', database=dbname), so assignments
+# never change the shared values. Nested values are shared and must be treated as read-only.
 
 def file_exists(file_path):
     return os.path.exists(file_path)
 
+_lock = threading.Lock()
+# path -> (mtime_ns, size, parsed dict) of every file layer read so far
+_files = {}
+# (filename, home file, working directory file) -> (layer signature, merged dict, source)
+_merged = {}
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def _read_layer(path):
+    """Parsed file, from the cache unless it changed on disk. None when it does not exist."""
+    signature = _stat(path)
+    if signature is None:
+        _files.pop(path, None)
+        return None, None
+    cached = _files.get(path)
+    if cached is not None and cached[:2] == signature:
+        return cached[2], signature
+    with open(path) as f:
+        parsed = json.load(f)
+    _files[path] = (*signature, parsed)
+    return parsed, signature
+
+def env_prefix(filename):
+    """Prefix of the environment variables overriding a file, configuration.json -> CONFIGURATION__."""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return ''.join(c if c.isalnum() else '_' for c in stem).upper() + '__'
+
+def _env_layer(filename):
+    prefix = env_prefix(filename)
+    return tuple(sorted((name[len(prefix):], value) for name, value in os.environ.items()
+                        if name.startswith(prefix) and len(name) > len(prefix)))
+
+def _apply_env(merged, env):
+    keys = {key.lower(): key for key in merged}
+    for name, value in env:
+        key = keys.get(name.lower(), name.lower())
+        current = merged.get(key)
+        if current is not None and not isinstance(current, str):
+            # numbers, booleans and nested values are given as json
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        merged[key] = value
+
+def load(filename):
+    """(merged dict, source description) of a configuration file, shared and cached."""
+    home_config_file = os.path.join(os.path.expanduser("~"), filename)
+    cur_config_file = os.path.join(os.getcwd(), filename)
+    layers = [home_config_file]
+    if cur_config_file != home_config_file:
+        layers.append(cur_config_file)
+    key = (filename, *layers)
+    with _lock:
+        parsed = [(path, *_read_layer(path)) for path in layers]
+        signature = tuple(sig for _, _, sig in parsed)
+        cached = _merged.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1], cached[2]
+        # scanning os.environ costs more than the stat calls, it is read along with the files
+        env = _env_layer(filename)
+        merged, sources = {}, []
+        for path, values, _ in parsed:
+            if values is not None:
+                # top level keys of a later layer replace the earlier ones
+                merged.update(values)
+                sources.append(path)
+        if env:
+            _apply_env(merged, env)
+            sources.append('env:' + env_prefix(filename))
+        source = ':'.join(sources) or None
+        _merged[key] = (signature, merged, source)
+        return merged, source
+
+def clear():
+    """Forgets every cached file, the next config() reads from disk."""
+    with _lock:
+        _files.clear()
+        _merged.clear()
+
 class config():
-    def __init__(self, filename, type='json'):
-        if type == 'json':
-            home_dir   = os.path.expanduser("~")
-            cur_dir    = os.getcwd()
-
-            config = {}
-        
-            # Create initial configuration from the script_dir
-            home_config_file = os.path.join(home_dir, filename)
-            cur_config_file = os.path.join(cur_dir, filename)
-        
-            if (file_exists(home_config_file)):
-                config = json.loads(open(str(home_config_file)).read())
-                self.filename = home_config_file
-                if (file_exists(cur_config_file) and cur_config_file != home_config_file):
-                    # don't overwrite
-                    tmp_config = json.loads(open(str(cur_config_file)).read())
-                    self.filename = self.filename + ':' + cur_config_file
-                    for config_key in tmp_config:
-                        config[config_key] = tmp_config[config_key]
-            elif (file_exists(cur_config_file) and cur_config_file != home_config_file):
-                config = json.loads(open(str(cur_config_file)).read())
-                self.filename = cur_config_file
-            self.config = config
- 
\ No newline at end of file
+    def __init__(self, filename, type='json', **overrides):
+        if type != 'json':
+            raise ValueError(f'Unsupported configuration type {type}')
+        base, self.filename = load(filename)
+        # a top level copy, the cached base stays untouched
+        self.config = {**base, **overrides}
+
+    def override(self, **values):
+        """Another config with more overrides, sharing this one's nested values."""
+        other = object.__new__(config)
+        other.filename = self.filename
+        other.config = {**self.config, **values}
+        return other
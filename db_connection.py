@@ -1,16 +1,39 @@
 import json
+from collections import namedtuple
+from functools import lru_cache
 import pyodbc
 from config_helper import config
+from db_pool import connection_string, default_pool
 import colorama
 from colorama import Fore, Back, Style
 from logger import _logger
 
+ROW_MODES = ('namedtuple', 'tuple', 'dict')
+
+@lru_cache(maxsize=256)
+def _row_type(columns):
+    # one row class per distinct header, invalid field names are renamed _0, _1, ...
+    return namedtuple('Row', columns, rename=True)
+
+def _row_maker(mode, columns):
+    if mode == 'namedtuple':
+        return _row_type(columns)._make
+    if mode == 'dict':
+        return lambda row: dict(zip(columns, row))
+    return tuple
+
 class DBConnection:
     logger = _logger('DEBUG', 'DBConnection')
-    def __init__(self, cnfg: config):
+    def __init__(self, cnfg: config, pool=None):
         self.connection = None
         self.cursor = None
         self.config = cnfg.config
+        # connections come from the shared pool (db_pool.default_pool()) unless another pool is
+        # given, pool=False opens a connection of its own and closes it on exit
+        self.pool = default_pool() if pool is None else pool
+        self._pooled = None
+        # column names of the last query run through iter_query / query_columns
+        self.columns = ()
         
 
     def __enter__(self):
@@ -18,49 +41,106 @@ class DBConnection:
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.cleanup_connection()
+        # a connection that failed mid-use is not handed out again
+        self.cleanup_connection(discard=isinstance(exc_value, pyodbc.Error))
 
     def setup_connection(self):
         #cfg = config('configuration.json')
         
-        server = self.config['server']
         database = self.config['database']
-        username = self.config['user']
-        password = self.config['password']
         
         try:
-            connection_string = f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={username};PWD={password}'
-            self.connection = pyodbc.connect(connection_string)
+            if self.pool:
+                self._pooled = self.pool.acquire(self.config)
+                self.connection = self._pooled.connection
+            else:
+                self.connection = pyodbc.connect(connection_string(self.config))
             self.cursor = self.connection.cursor()
-            DBConnection.logger.info(f"Connection established successfully to database: {database}")
-        except pyodbc.Error as e:
-            DBConnection.logger.error(f"Error connecting to database: {e}")
+            DBConnection.logger.info("Connection established successfully to database: %s", database)
+        except (pyodbc.Error, TimeoutError) as e:
+            DBConnection.logger.error("Error connecting to database: %s", e)
+            if self._pooled is not None:
+                self.pool.release(self._pooled, discard=True)
+                self._pooled = None
             self.connection = None
             self.cursor = None
 
-    def cleanup_connection(self):
+    def cleanup_connection(self, discard=False):
         if self.cursor:
             self.cursor.close()
+            self.cursor = None
             DBConnection.logger.info("Cursor closed successfully.")
-        if self.connection:
+        if self._pooled is not None:
+            self.pool.release(self._pooled, discard)
+            self._pooled = None
+            self.connection = None
+            DBConnection.logger.debug("Connection returned to the pool.")
+        elif self.connection:
             self.connection.close()
+            self.connection = None
             DBConnection.logger.info("Connection closed successfully.")
 
+    def _fetch(self, query, params, batch_size):
+        # batches of rows from fetchmany on a cursor of its own, the header goes to self.columns
+        cursor = self.connection.cursor()
+        try:
+            if params is None:
+                cursor.execute(query)
+            else:
+                cursor.execute(query, params)
+            # a batch (SET NOCOUNT ON; ...; SELECT ...) may answer with its result set after others
+            while cursor.description is None and hasattr(cursor, 'nextset') and cursor.nextset():
+                pass
+            if cursor.description is None:
+                self.columns = ()
+                return
+            self.columns = tuple(column[0] for column in cursor.description)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def iter_query(self, query, params=None, mode='namedtuple', batch_size=1000):
+        """Streams the rows of a query, fetched batch_size at a time.
+        mode is 'namedtuple' (row.table_name), 'tuple' (plain tuples, the header is in
+        self.columns) or 'dict'. The query runs on the first next(), statements without a result
+        set yield nothing and pyodbc.Error is raised to the caller."""
+        if mode not in ROW_MODES:
+            raise ValueError(f"Unknown row mode {mode}, use one of {', '.join(ROW_MODES)}")
+        if self.connection is None:
+            DBConnection.logger.error("Unable to establish connection to database.")
+            return
+        make = None
+        for rows in self._fetch(query, params, batch_size):
+            if make is None:
+                make = _row_maker(mode, self.columns)
+            yield from map(make, rows)
+
+    def query_columns(self, query, params=None, batch_size=10000):
+        """The result of a query as one list per column, {'table_name': [...], ...}."""
+        if self.connection is None:
+            DBConnection.logger.error("Unable to establish connection to database.")
+            return {}
+        columns = None
+        for rows in self._fetch(query, params, batch_size):
+            if columns is None:
+                columns = [[] for _ in self.columns]
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+        if columns is None:
+            columns = [[] for _ in self.columns]
+        return dict(zip(self.columns, columns))
+
     def execute_query(self, query):
         if self.connection is None or self.cursor is None:
             DBConnection.logger.error("Unable to establish connection to database.")
             return []
 
         try:
-            self.cursor.execute(query)
-            if self.cursor.description is None:
-                return []
-            columns = [column[0] for column in self.cursor.description]
-            results = []
-            for row in self.cursor.fetchall():
-                result = {columns[i]: row[i] for i in range(len(columns))}
-                results.append(result)
-            return results
+            return list(self.iter_query(query, mode='dict'))
         except pyodbc.Error as e:
             if "is already enabled" in str(e):
                 DBConnection.logger.info("CDC is already enabled on this database.")
@@ -74,15 +154,7 @@ class DBConnection:
             return []
 
         try:
-            self.cursor.execute(query, params)
-            if self.cursor.description is None:
-                return []
-            columns = [column[0] for column in self.cursor.description]
-            results = []
-            for row in self.cursor.fetchall():
-                result = {columns[i]: row[i] for i in range(len(columns))}
-                results.append(result)
-            return results
+            return list(self.iter_query(query, params, mode='dict'))
         except pyodbc.Error as e:
             DBConnection.logger.error(f"Error executing query: {e}")
             return []
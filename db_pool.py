@@ -0,0 +1,224 @@
+import atexit
+import hashlib
+import threading
+import time
+from logger import _logger
+
+# Connection pool for the Azure SQL (elastic pool) databases.
+# Opening a connection to Azure SQL costs a TLS and authentication handshake, so connections are
+# kept after use and handed out again to the next DBConnection for the same server, credentials
+# and database. Each key holds at most max_size connections and the whole pool at most max_total;
+# at the global cap the longest idle connection of another key is closed to make room, callers
+# beyond that wait for a return. Connections idle longer than max_idle are closed, a connection
+# idle for check_after seconds or more is probed with health_query before it is handed out and
+# replaced when the probe fails. With share_server=True one server connection is switched between
+# databases with USE, for servers that allow it (SQL Server, Managed Instance; Azure SQL Database
+# does not).
+
+def connection_string(cfg, driver='ODBC Driver 17 for SQL Server'):
+    return (f"DRIVER={{{driver}}};SERVER={cfg['server']};DATABASE={cfg['database']};"
+            f"UID={cfg['user']};PWD={cfg['password']}")
+
+def _odbc_connect(cfg):
+    import pyodbc
+    return pyodbc.connect(connection_string(cfg))
+
+class _pooled():
+    __slots__ = ('connection', 'key', 'database', 'created', 'returned')
+
+    def __init__(self, connection, key, database):
+        self.connection = connection
+        self.key = key
+        self.database = database
+        self.created = self.returned = time.monotonic()
+
+class ConnectionPool:
+    def __init__(self, connect=_odbc_connect, max_size=8, max_idle=300.0, check_after=5.0,
+                 health_query='SELECT 1', share_server=False, timeout=60.0, max_total=32):
+        # connect(cfg) opens a DB-API connection from a config mapping (server, database, user, password)
+        self.connect = connect
+        self.max_size = max_size
+        self.max_total = max_total
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.health_query = health_query
+        self.share_server = share_server
+        self.timeout = timeout
+        self.logger = _logger('DEBUG', 'ConnectionPool')
+        self._idle = {}
+        self._open = {}
+        # waiters block on different keys, every change wakes all of them (notify_all)
+        self._cond = threading.Condition()
+        self._closed = False
+        self.stats = {'created': 0, 'reused': 0, 'evicted': 0, 'unhealthy': 0, 'discarded': 0, 'waited': 0}
+
+    def key(self, cfg):
+        # the password is part of the key, only its hash is kept
+        secret = hashlib.sha1(str(cfg.get('password')).encode('utf-8')).hexdigest()
+        database = None if self.share_server else cfg.get('database')
+        return (cfg.get('server'), cfg.get('user'), secret, database)
+
+    def _healthy(self, pooled):
+        try:
+            cursor = pooled.connection.cursor()
+            try:
+                cursor.execute(self.health_query)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception as e:
+            self.logger.warning('Pooled connection to %s failed its health check: %s', pooled.database, e)
+            return False
+
+    def _close(self, pooled):
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+
+    def _evict(self, now):
+        """Closes connections idle longer than max_idle, the caller holds the lock."""
+        evicted = []
+        for key, idle in self._idle.items():
+            while idle and now - idle[0].returned > self.max_idle:
+                evicted.append(idle.pop(0))
+                self._open[key] -= 1
+        for pooled in evicted:
+            self._close(pooled)
+        self.stats['evicted'] += len(evicted)
+        if evicted:
+            self._cond.notify_all()
+
+    def acquire(self, cfg):
+        """A connection for cfg, reused from the pool when one is idle."""
+        key = self.key(cfg)
+        database = cfg.get('database')
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Connection pool is closed')
+            self._evict(time.monotonic())
+            victim = None
+            while True:
+                idle = self._idle.get(key)
+                if idle:
+                    # most recently returned first, the others age out
+                    pooled = idle.pop()
+                    break
+                if self._open.get(key, 0) < self.max_size:
+                    if sum(self._open.values()) >= self.max_total:
+                        victim = self._steal_idle()
+                    if victim is not None or sum(self._open.values()) < self.max_total:
+                        self._open[key] = self._open.get(key, 0) + 1
+                        pooled = None
+                        break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'No connection to {database} free within {self.timeout}s')
+                self.stats['waited'] += 1
+                self._cond.wait(remaining)
+        if victim is not None:
+            self._close(victim)
+        if pooled is not None:
+            if time.monotonic() - pooled.returned < self.check_after or self._healthy(pooled):
+                if self._use(pooled, database):
+                    with self._cond:
+                        self.stats['reused'] += 1
+                    return pooled
+            with self._cond:
+                self.stats['unhealthy'] += 1
+            self._close(pooled)
+        try:
+            pooled = _pooled(self.connect(cfg), key, database)
+        except BaseException:
+            with self._cond:
+                self._open[key] -= 1
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self.stats['created'] += 1
+        return pooled
+
+    def _steal_idle(self):
+        """Takes the longest idle connection of any key out of the pool to make room under
+        max_total and returns it for closing, None when nothing is idle. The caller holds the lock."""
+        oldest = None
+        for idle in self._idle.values():
+            if idle and (oldest is None or idle[0].returned < oldest.returned):
+                oldest = idle[0]
+        if oldest is None:
+            return None
+        self._idle[oldest.key].pop(0)
+        self._open[oldest.key] -= 1
+        self.stats['evicted'] += 1
+        # waiters of the other key may be below max_size again
+        self._cond.notify_all()
+        return oldest
+
+    def _use(self, pooled, database):
+        if pooled.database == database or not database:
+            return True
+        try:
+            cursor = pooled.connection.cursor()
+            cursor.execute(f'USE [{database}]')
+            cursor.close()
+            pooled.database = database
+            return True
+        except Exception as e:
+            self.logger.warning('Switching a pooled connection to %s failed: %s', database, e)
+            return False
+
+    def release(self, pooled, discard=False):
+        """Returns a connection, or closes it when discard is set or its transaction cannot be rolled back."""
+        if not discard:
+            try:
+                # leave nothing uncommitted for the next user
+                pooled.connection.rollback()
+            except Exception as e:
+                self.logger.warning('Discarding pooled connection to %s: %s', pooled.database, e)
+                discard = True
+        with self._cond:
+            if discard or self._closed:
+                self._open[pooled.key] -= 1
+                if discard:
+                    self.stats['discarded'] += 1
+            else:
+                pooled.returned = time.monotonic()
+                self._idle.setdefault(pooled.key, []).append(pooled)
+            self._cond.notify_all()
+        if discard or self._closed:
+            self._close(pooled)
+
+    def evict_idle(self):
+        with self._cond:
+            self._evict(time.monotonic())
+
+    @property
+    def size(self):
+        with self._cond:
+            return sum(self._open.values())
+
+    def close(self):
+        """Closes the idle connections, connections still checked out are closed on return."""
+        with self._cond:
+            self._closed = True
+            idle = [pooled for connections in self._idle.values() for pooled in connections]
+            for pooled in idle:
+                self._open[pooled.key] -= 1
+            self._idle.clear()
+            self._cond.notify_all()
+        for pooled in idle:
+            self._close(pooled)
+
+_default = None
+_default_lock = threading.Lock()
+
+def default_pool():
+    """The process-wide pool DBConnection uses unless given another one."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ConnectionPool()
+            atexit.register(_default.close)
+        return _default
@@ -1,12 +1,49 @@
 import pyodbc
 from config_helper import config
 from db_connection import DBConnection
+from cdc_runner import DatabaseRunner, run_key
+from cdc_reconciler import CDCReconciler
+from cdc_drift import DriftRepair, write_report
 import colorama
 from colorama import Fore, Back, Style
 from logger import _logger
 
 global active_facilities
 
+# CDC state of every user table, schema qualified
+TRACKED_TABLES_QUERY = """
+    SELECT s.name AS table_schema, t.name AS table_name, t.is_tracked_by_cdc
+    FROM sys.tables t
+    JOIN sys.schemas s ON s.schema_id = t.schema_id
+    WHERE t.is_ms_shipped = 0
+"""
+
+# sp_cdc_enable_table for every (schema, table) of the VALUES list, the last parameter is the
+# role name; returns the tables that failed with their error message
+ENABLE_TABLES_BATCH = """
+    SET NOCOUNT ON;
+    DECLARE @tables TABLE (table_schema sysname, table_name sysname);
+    DECLARE @errors TABLE (table_schema sysname, table_name sysname, message nvarchar(4000));
+    INSERT INTO @tables (table_schema, table_name) VALUES {values};
+    DECLARE @role_name sysname = ?, @schema sysname, @table sysname;
+    DECLARE tables_cursor CURSOR LOCAL FAST_FORWARD FOR SELECT table_schema, table_name FROM @tables;
+    OPEN tables_cursor;
+    FETCH NEXT FROM tables_cursor INTO @schema, @table;
+    WHILE @@FETCH_STATUS = 0
+    BEGIN
+        BEGIN TRY
+            EXEC sys.sp_cdc_enable_table @source_schema = @schema, @source_name = @table, @role_name = @role_name;
+        END TRY
+        BEGIN CATCH
+            INSERT INTO @errors VALUES (@schema, @table, ERROR_MESSAGE());
+        END CATCH
+        FETCH NEXT FROM tables_cursor INTO @schema, @table;
+    END
+    CLOSE tables_cursor;
+    DEALLOCATE tables_cursor;
+    SELECT table_schema, table_name, message FROM @errors;
+"""
+
 class facilities_helper:
     def __init__(self):
         self.logger = _logger('DEBUG', 'facilities_helper')
@@ -60,58 +97,95 @@ class facilities_helper:
             
             
         
-    def enable_cdc_on_all_cip_db_tables(self):
+    def enable_cdc_on_all_cip_db_tables(self, max_workers=4, journal=None, resume=False, databases=None, batched=True,
+                                        reset=False, dry_run=False):
         """
         CDC enablement on database and tables for CIP Azure Elastic Pool database.
         The function is a wrapper for CIP Azure Elastic Pool database.
         The function iterates through the active facilities and enables CDC on each one with the role_name.        
-        Disables existing CDC on the database, if any, and enables CDC on the database.
         The list of tables on which CDC needs to be enabled is fetched from the latest database.
-        The function is designed to be used with caution, as it will remove all CDC tracking information.
-        Ensure to use this only if you are sure that there is only one capture instance for the database.        
+        By default each database is reconciled (cdc_reconciler.CDCReconciler): its CDC state is
+        read in one catalog query and only a disabled database, tables not tracked yet and stale
+        capture instances are changed, a database already in the desired state gets no DDL.
+        dry_run only reports what a reconciliation would change.
+        With reset=True, disables existing CDC on the database, if any, and enables CDC on the database.
+        Reset is designed to be used with caution, as it will remove all CDC tracking information.
+        Ensure to use reset only if you are sure that there is only one capture instance for the database.        
+        Databases are processed in parallel, max_workers at a time, each with its own connection.
+        With a journal file every database's result is appended to it, a rerun of the same mode
+        and tables with resume=True skips the databases that already succeeded; the journal is
+        removed once all databases succeeded. databases limits the run to the given database names.
+        Tables are enabled in batches (enable_cdc_on_tables), batched=False enables them one by one.
+        Returns:
+            list of cdc_runner.DatabaseResult, one per database
         """       
-        global active_facilities
-        if not active_facilities:
-            self.logger.info('No Active Facilities Found in Database: ')
-            return
+        if databases is None:
+            # set by the __main__ block of this module, or assigned by the importing script
+            active_facilities = globals().get('active_facilities')
+            if not active_facilities:
+                self.logger.info('No Active Facilities Found in Database: ')
+                return []
+            databases = []
+            for key, facility in active_facilities.items():
+                if not facility.get('dbname'):
+                    self.logger.info(f"Skipping facility {key}. No database name found.")
+                    continue
+                databases.append(facility['dbname'])
         
         # get the latest base tables for cdc from the latest database, identified from the deployment database
         # new databases may not necessarily be enabled for the user, if tables are not visible for the latest db,
         # choose the one where you are able to see the tables in the database
         dbname = '0000001610_System'
-        cfg = config('configuration.json')
-        cfg.config["database"] = dbname
+        latest_tables = []
+        cfg = config('configuration.json', database=dbname)
         with DBConnection(cfg) as dbconnxn:
             if dbconnxn.connection:
                 self.logger.info(f"Connection to Latest deployment {dbname} established successfully to fetch tables for CDC Enablement.")
                 latest_tables = self.get_latest_base_tables_for_cdc(dbconnxn)
                 self.logger.info(f"Found {len(latest_tables)} tables for CDC enablement in database {dbname}.")
-        
-        for key, facility in active_facilities.items():
-            dbname = facility.get('dbname')
-            if not dbname:
-                self.logger.info(f"Skipping database {dbname}. No database name found for facility {key}. Skipping.")
-                continue
-            if dbname != '0000000075_System':
-                self.logger.info(f"Skipping database {dbname}.")
-                continue
+        if not latest_tables:
+            self.logger.error(f"No tables for CDC enablement found in {dbname}.")
+            return []
 
-            cfg = config('configuration.json')
-            cfg.config["database"] = dbname
+        if not reset:
+            reconciler = CDCReconciler(self, latest_tables, dry_run=dry_run)
+            name = 'CDC reconciliation (dry run)' if dry_run else 'CDC reconciliation'
+            runner = DatabaseRunner(reconciler.reconcile, max_workers=max_workers, journal=None if dry_run else journal, name=name,
+                                    run_key=run_key('reconcile', latest_tables))
+            return runner.run(databases, resume)
 
-            with DBConnection(cfg) as dbconnxn:
-                if dbconnxn.connection:
-                    self.logger.info(f"Connection to {dbname} established successfully.")
-                    # disable CDC on database, if CDC already exists, else errors out 
-                    # when enabling CDC when it is already enabled
-                    self.disable_cdc_on_database(dbconnxn, dbname)
-                    # enable CDC on database  
-                    self.enable_cdc_on_database(dbconnxn, dbname)
-                    # iterate through the latest tables and enable CDC on each one with the role_name
-                    for table_schema, table_name in latest_tables:                    
-                        self.enable_cdc_on_table(dbconnxn, table_schema, table_name)
-                else:
-                    self.logger.error(f"Failed to establish connection to {dbname}.")
+        def enable(dbconnxn, dbname):
+            # disable CDC on database, if CDC already exists, else errors out 
+            # when enabling CDC when it is already enabled
+            self.disable_cdc_on_database(dbconnxn, dbname)
+            # enable CDC on database  
+            self.enable_cdc_on_database(dbconnxn, dbname)
+            if not batched:
+                # iterate through the latest tables and enable CDC on each one with the role_name
+                for table_schema, table_name in latest_tables:                    
+                    self.enable_cdc_on_table(dbconnxn, table_schema, table_name)
+                return self.cdc_status(dbconnxn, dbname, len(latest_tables))
+            status = self.enable_cdc_on_tables(dbconnxn, latest_tables)
+            details = self.cdc_status(dbconnxn, dbname, len(latest_tables))
+            for value in status.values():
+                details[value] = details.get(value, 0) + 1
+            if details.get('failed'):
+                raise RuntimeError(f"CDC enablement failed for {details['failed']} tables: {details}")
+            return details
+
+        runner = DatabaseRunner(enable, max_workers=max_workers, journal=journal, name='CDC enablement',
+                                run_key=run_key('reset', batched, latest_tables))
+        return runner.run(databases, resume)
+
+    def cdc_status(self, dbconnxn: DBConnection, dbname, expected_tables):
+        """Tables tracked by CDC after an enablement, raises when the database is not enabled
+        so the database is recorded as failed."""
+        rows = dbconnxn.execute_query_with_params(
+            "SELECT (SELECT is_cdc_enabled FROM sys.databases WHERE name = ?) AS is_cdc_enabled, "
+            "(SELECT COUNT(*) FROM sys.tables WHERE is_tracked_by_cdc = 1) AS tracked_tables", [dbname])
+        if not rows or rows[0]['is_cdc_enabled'] != 1:
+            raise RuntimeError(f"CDC is not enabled on database {dbname}")
+        return {'tables': expected_tables, 'tracked': rows[0]['tracked_tables']}
 
         
     def enable_cdc_on_database(self, dbconnxn: DBConnection, dbname):
@@ -163,8 +237,7 @@ class facilities_helper:
             dbname (str): The name of the database to enable CDC on.
         """
         try:                       
-            cfg = config('configuration.json')
-            cfg.config["database"] = dbname
+            cfg = config('configuration.json', database=dbname)
 
             with DBConnection(cfg) as dbconnxn:
                 if dbconnxn.connection:
@@ -191,26 +264,75 @@ class facilities_helper:
         results = dbconnxn.execute_query(query)
         return [(row['table_schema'], row['table_name']) for row in results]
 
-    # def enable_cdc_on_tables(self, dbconnxn: DBConnection, dbname, tables):
-    #     try:
-    #         for table_schema, table_name in tables:
-    #             # Enable CDC on the table
-    #             query = f"EXEC sys.sp_cdc_enable_table @source_schema = '{table_schema}' , @source_name  = '{table_name}' , @role_name   = role_name;"
-    #             dbconnxn.execute_query(query)
-                
-    #             # Commit the transaction if necessary
-    #             dbconnxn.connection.commit()
-    #             self.logger.info("{query} executed successfully CDC enabled on {dbname}.{table_schema}.{table_name}, but no results to fetch.")
-                
-    #             # Verify if CDC is enabled on the table
-    #             verify_query = "SELECT name, is_tracked_by_cdc FROM sys.tables WHERE name = ?"
-    #             results = dbconnxn.execute_query_with_params(verify_query, [table_name])
-    #             if results and results[0]['is_tracked_by_cdc'] == 1:
-    #                 self.logger.info(f"CDC is successfully enabled for table {table_name}.")
-    #             else:
-    #                 self.logger.error(f"Failed to enable CDC for table {table_name}.")
-    #     except pyodbc.Error as e:
-    #         self.logger.error(f"Error enabling CDC for table: {table_name} in database {dbname}: {e}")
+    def cdc_tracked_tables(self, dbconnxn: DBConnection):
+        """Schema qualified CDC state of every user table in one catalog query,
+        {(schema, table): is_tracked_by_cdc}."""
+        rows = dbconnxn.iter_query(TRACKED_TABLES_QUERY, mode='tuple', batch_size=5000)
+        return {(table_schema, table_name): bool(tracked) for table_schema, table_name, tracked in rows}
+
+    def enable_cdc_on_tables(self, dbconnxn: DBConnection, tables, role_name='role_name', chunk_size=200):
+        """
+        Batched CDC enablement of many tables of one database.
+        The tables not tracked yet are enabled by one parameterized T-SQL batch per chunk_size
+        tables (sp_cdc_enable_table per table inside TRY/CATCH, errors collected and returned
+        by the batch), and the outcome is verified with one schema qualified catalog query,
+        instead of an enable, a commit and a verification round trip per table.
+        Args:
+            dbconnxn (DBConnection): connection to the database
+            tables: (table_schema, table_name) pairs, e.g. from get_latest_base_tables_for_cdc
+            role_name: gating role of the capture instances, None for no gating role
+        Returns:
+            {(table_schema, table_name): status}, status is enabled, unchanged (already
+            tracked), missing (no such table in this database) or failed
+        """
+        before = self.cdc_tracked_tables(dbconnxn)
+        status, todo = dict.fromkeys(tables), []
+        for table in status:
+            if table not in before:
+                status[table] = 'missing'
+            elif before[table]:
+                status[table] = 'unchanged'
+            else:
+                todo.append(table)
+        errors = {}
+        chunk_size = max(1, min(chunk_size, 1000))
+        if todo:
+            autocommit = dbconnxn.connection.autocommit
+            # every sp_cdc_enable_table commits on its own, one failure does not doom the rest of the batch
+            dbconnxn.connection.autocommit = True
+            try:
+                for i in range(0, len(todo), chunk_size):
+                    errors.update(self._enable_cdc_batch(dbconnxn, todo[i:i + chunk_size], role_name))
+            finally:
+                dbconnxn.connection.autocommit = autocommit
+            after = self.cdc_tracked_tables(dbconnxn)
+            for table in todo:
+                status[table] = 'enabled' if after.get(table) else 'failed'
+                if status[table] == 'failed':
+                    self.logger.error(f"Failed to enable CDC for table {table[0]}.{table[1]} with role_name {role_name}: {errors.get(table, 'not tracked after the batch')}")
+        counts = {}
+        for value in status.values():
+            counts[value] = counts.get(value, 0) + 1
+        self.logger.info(f"CDC enablement of {len(status)} tables in {(len(todo) + chunk_size - 1) // chunk_size} batches: {counts}")
+        return status
+
+    def _enable_cdc_batch(self, dbconnxn: DBConnection, tables, role_name):
+        # one round trip for the chunk, the VALUES list holds at most 1000 rows and 2100 parameters
+        values = ', '.join(['(?, ?)'] * len(tables))
+        params = [value for table in tables for value in table] + [role_name]
+        cursor = dbconnxn.connection.cursor()
+        try:
+            cursor.execute(ENABLE_TABLES_BATCH.format(values=values), params)
+            # skip anything the procedures returned before the error list
+            while cursor.description is None and cursor.nextset():
+                pass
+            rows = cursor.fetchall() if cursor.description is not None else []
+        except pyodbc.Error as e:
+            self.logger.error(f"Error in CDC enablement batch of {len(tables)} tables: {e}")
+            return {table: str(e) for table in tables}
+        finally:
+            cursor.close()
+        return {(table_schema, table_name): message for table_schema, table_name, message in rows}
     
     def enable_cdc_on_table(self, dbconnxn: DBConnection, table_schema, table_name, role_name='role_name'):
         try:
@@ -244,8 +366,7 @@ class facilities_helper:
             table (_type_): naem of the table
         """        
         try:
-            cfg = config('configuration.json')
-            cfg.config["database"] = dbname
+            cfg = config('configuration.json', database=dbname)
 
             with DBConnection(cfg) as dbconnxn:
                 if dbconnxn.connection:
@@ -299,8 +420,7 @@ class facilities_helper:
             dbname (_type_): the databasename name where CDC is to be disabled
         """        
         try:                          
-            cfg = config('configuration.json')
-            cfg.config["database"] = dbname
+            cfg = config('configuration.json', database=dbname)
 
             with DBConnection(cfg) as dbconnxn:
                 if dbconnxn.connection:
@@ -353,8 +473,7 @@ class facilities_helper:
             table (_type_): naem of the table
         """        
         try:
-            cfg = config('configuration.json')
-            cfg.config["database"] = dbname
+            cfg = config('configuration.json', database=dbname)
 
             with DBConnection(cfg) as dbconnxn:
                 if dbconnxn.connection:
@@ -367,70 +486,49 @@ class facilities_helper:
             
     
     
-    def modify_existing_capture_instance_on_all_cip_tables(self):
-        """_summary_ TODO: drive from capture instance, rather than latest base tables
-        Existing capture instance modified 
+    def modify_existing_capture_instance_on_all_cip_tables(self, max_workers=4, journal=None, resume=False,
+                                                           databases=None, dry_run=False, compare_types=False,
+                                                           report='cdc_drift_report.json'):
+        """_summary_
+        Existing capture instance modified, driven from the capture instances
         Scenario: when new coluns have been added to tables on an existing capture instance
-        Select capture instance (i.e. column capture_instance) name for schema and table for the role name (i.e., Fivetran user) provided: 
-        EXEC sys.sp_cdc_help_change_data_capture @source_schema = '<schema>', @source_name = 'test_table';
+        The captured columns of every capture instance (cdc.captured_columns) are compared with the
+        live columns of the source tables, two catalog queries per database, and only the tables
+        whose capture instance drifted are recreated:
         Query to disable current CDC instance: 
         EXEC sys.sp_cdc_disable_table
             @source_schema = [<schema>],
             @source_name   = [<table>],
             @capture_instance   = [<capture_instance>];
-        Query to create a new CDC instance: 
+        Query to create a new CDC instance (batched, see enable_cdc_on_tables): 
          EXEC sys.sp_cdc_enable_table
             @source_schema = [<schema>],
             @source_name   = [<table>],
-            @role_name     = [<username>],
-            @supports_net_changes = 0;
+            @role_name     = [<username>];
+        Databases are processed in parallel like enable_cdc_on_all_cip_db_tables.
         Args:
-            dbname (_type_): name of the database
-            schema (_type_): name of the schema 
-            table (_type_): naem of the table
+            dry_run: only detect and report the drift
+            compare_types: a changed column type counts as drift too
+            report: json file listing per database which columns changed on which tables
+        Returns:
+            list of cdc_runner.DatabaseResult, details hold the drift of each database
         """        
-        try:
-            global active_facilities
+        if databases is None:
+            active_facilities = globals().get('active_facilities')
             if not active_facilities:
                 self.logger.info('No Active Facilities Found in Database: ')
-                return
-        
-            # get the latest base tables for cdc from the latest database, identified from the deployment database
-            # new databases may not necessarily be enabled for the user, if tables are not visible for the latest db,
-            # choose the one where you are able to see the tables in the database
-            dbname = '0000000039_system'
-            cfg = config('configuration.json')
-            cfg.config["database"] = dbname
-            with DBConnection(cfg) as dbconnxn:
-                if dbconnxn.connection:
-                    self.logger.info(f"Connection to Latest deployment {dbname} established successfully to fetch tables for CDC Enablement.")
-                    latest_tables = self.get_latest_base_tables_for_cdc(dbconnxn)
-                    self.logger.info(f"Found {len(latest_tables)} tables for CDC enablement in database {dbname}.")
-            
-            for key, facility in active_facilities.items():
-                dbname = facility.get('dbname')
-                if not dbname:
-                    self.logger.info(f"Skipping database {dbname}. No database name found for facility {key}. Skipping.")
-                    continue
-                if dbname != '0000000039_system':
-                    self.logger.info(f"Skipping database {dbname}.")
-                    continue
-
-                cfg = config('configuration.json')
-                cfg.config["database"] = dbname
-
-                with DBConnection(cfg) as dbconnxn:
-                    if dbconnxn.connection:
-                        self.logger.info(f"Connection to {dbname} established successfully.")                      
-                        # iterate through the latest tables and enable CDC on each one with the role_name
-                        for table_schema, table_name in latest_tables:                    
-                            self.disable_cdc_on_table(dbconnxn, table_schema, table_name)
-                            self.enable_cdc_on_table(dbconnxn, table_schema, table_name)
-                    else:
-                        self.logger.error(f"Failed to establish connection to {dbname}.")
+                return []
+            databases = [facility['dbname'] for facility in active_facilities.values() if facility.get('dbname')]
 
-        except Exception as e:
-            self.logger.error(f"Error disabling CDC on all tables in database {dbname}: {e}")
+        repair = DriftRepair(self, compare_types=compare_types, dry_run=dry_run)
+        name = 'CDC drift check' if dry_run else 'CDC drift repair'
+        runner = DatabaseRunner(repair.repair, max_workers=max_workers, journal=None if dry_run else journal, name=name,
+                                run_key=run_key('drift', compare_types))
+        results = runner.run(databases, resume)
+        if report:
+            drifted = write_report(results, report)
+            self.logger.info(f"Drift report {report}: {sum(entry.get('drifted', 0) for entry in drifted.values())} drifted tables in {len(drifted)} databases.")
+        return results
         
     
 
@@ -0,0 +1,559 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import requests
+from requests.auth import HTTPBasicAuth
+import fivetranapi
+from fivetran_stub_server import stub_server, subprocess_stub_server, synthetic_connection
+from fivetran_throttle import AdaptiveThrottler
+import logger as logging_setup
+from config_helper import config
+from fivetran_templates import BLOB_FIELDS, PayloadTemplate
+
+# Benchmarks of the fivetranapi client against the local stub server.
+# Run all:      python fivetran_benchmark.py
+# Run some:     python fivetran_benchmark.py --only listing create --latency 0.01
+# Regressions:  python fivetran_benchmark.py --output after.json --compare before.json
+# Results are written as json with the commit, python version and parameters of the run, and
+# --compare exits non-zero when a timing got worse than --tolerance against the baseline.
+
+def _unthrottled():
+    # benchmarks measure the client, not the request budget
+    return AdaptiveThrottler(rate=1e6, max_rate=1e6)
+
+def _summary(name, latencies):
+    latencies = sorted(latencies)
+    return {
+        'name': name,
+        'requests': len(latencies),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+    }
+
+def bench_session(requests_count=500):
+    """Per-request latency of a fresh connection per call (module-level requests.get, the old
+    behaviour of call_api) against the pooled keep-alive session owned by connect."""
+    results = []
+    with stub_server() as server:
+        url = f'{server.base_url}/account/info'
+        auth = HTTPBasicAuth('key', 'secret')
+        latencies = []
+        for _ in range(requests_count):
+            start = time.perf_counter()
+            requests.get(url, headers={'Accept': 'application/json'}, auth=auth, timeout=(5, 60)).json()
+            latencies.append(time.perf_counter() - start)
+        results.append(_summary('unpooled requests.get', latencies))
+
+        with fivetranapi.connect('key', 'secret', base_url=server.base_url, throttler=_unthrottled()) as ft:
+            ft.logger.logger.setLevel(logging.WARNING)
+            latencies = []
+            for _ in range(requests_count):
+                start = time.perf_counter()
+                ft.call_api('GET', 'account/info')
+                latencies.append(time.perf_counter() - start)
+        results.append(_summary('pooled connect.session', latencies))
+    return results
+
+class _eager_connection():
+    # the connection model as it was before the slotted models: every field copied (and
+    # config, setup_tests, status details stringified) into the instance __dict__ at construction
+    def __init__(self, json):
+        self._json = json
+        decoded = fivetranapi.connection(json)
+        for name in fivetranapi.connection._fields:
+            setattr(self, name, getattr(decoded, name))
+
+def bench_models(connections_count=20000, accessed=('id', 'group_id', 'service', 'status', 'schedule_type')):
+    """Memory held by connection models for a synthetic account, the eager pre-slots models against
+    the lazily decoded slotted models with a typical handful of fields read."""
+    results = []
+    for name, model in (('eager connection', _eager_connection), ('slotted connection', fivetranapi.connection)):
+        items = [synthetic_connection(i) for i in range(connections_count)]
+        tracemalloc.start()
+        start = time.perf_counter()
+        models = [model(item) for item in items]
+        for m in models:
+            for field in accessed:
+                getattr(m, field)
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append({'name': name, 'models': len(models), 'model_mb': round(current / 2**20, 2),
+                        'peak_mb': round(peak / 2**20, 2), 'seconds': round(elapsed, 3)})
+        del models, items
+    return results
+
+def bench_streaming(connections_count=5000, page_size=1000):
+    """Peak memory while listing connections page by page against streaming them item by item,
+    touching each model as it arrives and keeping none of them."""
+    results = []
+    with stub_server(connections_count=connections_count) as server:
+        with fivetranapi.connect('key', 'secret', base_url=server.base_url, throttler=_unthrottled()) as ft:
+            ft.logger.logger.setLevel(logging.WARNING)
+            for name, stream in (('paged', False), ('streamed', True)):
+                tracemalloc.start()
+                start = time.perf_counter()
+                count = 0
+                for c in ft.iter_connections(limit=page_size, stream=stream):
+                    c.id
+                    count += 1
+                elapsed = time.perf_counter() - start
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results.append({'name': name, 'connections': count, 'page_size': page_size,
+                                'peak_mb': round(peak / 2**20, 2), 'seconds': round(elapsed, 3)})
+    return results
+
+def _server(subprocess=False, **kwargs):
+    # the subprocess server keeps its own request handling off the GIL of the measured client
+    return subprocess_stub_server(**kwargs) if subprocess else stub_server(**kwargs)
+
+def _client(base_url, pool_maxsize=16):
+    ft = fivetranapi.connect('key', 'secret', base_url=base_url, pool_maxsize=pool_maxsize, throttler=_unthrottled())
+    ft.logger.logger.setLevel(logging.WARNING)
+    return ft
+
+def _throughput(name, count, elapsed, **extra):
+    return {'name': name, 'count': count, 'seconds': round(elapsed, 3),
+            'per_second': round(count / elapsed, 1) if elapsed else None, **extra}
+
+def bench_listing(connections_count=10000, page_size=1000, latency=0.0, subprocess=False):
+    """Connections listed per second page by page, with the next page prefetched, and streamed."""
+    results = []
+    with _server(subprocess, connections_count=connections_count, latency=latency) as server:
+        with _client(server.base_url) as ft:
+            for name, prefetch, stream in (('paged', False, False), ('prefetch', True, False), ('streamed', False, True)):
+                start = time.perf_counter()
+                count = sum(1 for c in ft.iter_connections(limit=page_size, prefetch=prefetch, stream=stream))
+                results.append(_throughput(name, count, time.perf_counter() - start, page_size=page_size))
+    return results
+
+def _create_payload(i):
+    return {'service': 'azure_sql_db', 'group_id': 'group_00000', 'paused': True, 'run_setup_tests': False,
+            'config': {'database': f'bench_{i:07d}', 'schema_prefix': f'bench_{i:07d}'}}
+
+def bench_create(count=500, workers=16, latency=0.005, subprocess=False):
+    """Connectors created per second one after the other, from a thread pool and through AsyncConnect."""
+    results = []
+    with _server(subprocess, latency=latency) as server:
+        with _client(server.base_url) as ft:
+            start = time.perf_counter()
+            errors = sum(ft.create_connector(_create_payload(i)) is None for i in range(count))
+            results.append(_throughput('sequential', count, time.perf_counter() - start, errors=errors))
+
+        with _client(server.base_url, pool_maxsize=workers) as ft:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                responses = list(executor.map(ft.create_connector, map(_create_payload, range(count, 2 * count))))
+            results.append(_throughput('threaded', count, time.perf_counter() - start,
+                                       workers=workers, errors=responses.count(None)))
+
+        async def create_all():
+            async with fivetranapi.AsyncConnect('key', 'secret', base_url=server.base_url, max_concurrency=workers,
+                                                throttler=_unthrottled()) as aft:
+                aft.logger.logger.setLevel(logging.WARNING)
+                return await asyncio.gather(*(aft.create_connector(_create_payload(i)) for i in range(2 * count, 3 * count)))
+        start = time.perf_counter()
+        responses = asyncio.run(create_all())
+        results.append(_throughput('async', count, time.perf_counter() - start,
+                                   workers=workers, errors=responses.count(None)))
+    return results
+
+def _bulk(action, connections_count, workers, latency, subprocess):
+    try:
+        # FivetranUtils pulls in pyodbc and the azure sdk, only needed by the bulk benchmarks
+        from fivetran_utils import FivetranUtils
+    except ImportError as e:
+        return [{'name': action, 'skipped': f'fivetran_utils not importable: {e}'}]
+    results = []
+    for name, max_workers in (('sequential', 1), ('concurrent', workers)):
+        # a fresh account per run, both runs act on every connector
+        with _server(subprocess, connections_count=connections_count, latency=latency) as server:
+            with _client(server.base_url, pool_maxsize=max_workers) as ft:
+                utils = FivetranUtils(ft)
+                utils.logger.logger.setLevel(logging.WARNING)
+                report = utils.bulk_apply(action, max_workers=max_workers, group_id='group_00000')
+                summary = report.summary()
+                results.append(_throughput(name, summary['total'], report.elapsed, workers=max_workers,
+                                           failed=summary['failed'], latency_p95=summary['latency_p95']))
+    return results
+
+def bench_pause(connections_count=500, workers=16, latency=0.005, subprocess=False):
+    """Connectors paused per second by FivetranUtils.bulk_apply, one worker against a pool."""
+    return _bulk('pause', connections_count, workers, latency, subprocess)
+
+def bench_delete(connections_count=500, workers=16, latency=0.005, subprocess=False):
+    """Connectors deleted per second by FivetranUtils.bulk_apply, one worker against a pool."""
+    return _bulk('delete', connections_count, workers, latency, subprocess)
+
+def bench_export(connections_count=50000, page_size=1000, columns=('id', 'group_id', 'status.sync_state', 'succeeded_at')):
+    """Time to export a synthetic account, whole items and projected, to every available format,
+    with the stub server in its own process. Peak traced memory is taken from a second export of a
+    fifth of the account (tracemalloc slows decoding down several times), it stays flat with size."""
+    import tempfile
+    from fivetran_export import InventoryExporter, pyarrow
+    cases = [('ndjson.gz', None), ('ndjson.gz', columns), ('csv.gz', None), ('csv.gz', columns)]
+    if pyarrow is not None:
+        cases += [('parquet', None), ('parquet', columns)]
+    traced_count = connections_count // 5
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        with subprocess_stub_server(connections_count=connections_count) as server, _client(server.base_url) as ft:
+            exporter = InventoryExporter(ft, limit=page_size)
+            for suffix, projection in cases:
+                path = os.path.join(directory, f'connections.{suffix}')
+                result = exporter.export('connections', path, columns=projection)
+                results.append({'name': f'{suffix} {"projected" if projection else "all columns"}', 'rows': result['rows'],
+                                'seconds': result['seconds'], 'file_mb': round(os.path.getsize(path) / 2**20, 2)})
+        with subprocess_stub_server(connections_count=traced_count) as server, _client(server.base_url) as ft:
+            exporter = InventoryExporter(ft, limit=page_size)
+            for result, (suffix, projection) in zip(results, cases):
+                tracemalloc.start()
+                exporter.export('connections', os.path.join(directory, f'traced.{suffix}'), columns=projection)
+                result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+                result['traced_rows'] = traced_count
+                tracemalloc.stop()
+    return results
+
+class _legacy_logger():
+    # the _logger as it was before the shared queue: a StreamHandler added per instance and
+    # written synchronously by the calling thread
+    def __init__(self, level, name, stream):
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(getattr(logging, level))
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+        self.logger.addHandler(handler)
+
+    def info(self, message):
+        self.logger.info(message)
+
+def bench_logging(messages=20000, instances=3):
+    """Cost per message in the calling thread of the old logger (one handler per instance,
+    eagerly concatenated print_connections line) against the queued logger with lazy arguments,
+    with INFO enabled and disabled. Output goes to os.devnull."""
+    c = fivetranapi.connection(synthetic_connection(0))
+    fields = [str(getattr(c, name)) for name in ('id', 'group_id', 'service', 'schema', 'connected_by', 'created_at', 'succeeded_at', 'failed_at', 'paused')]
+    results = []
+    with open(os.devnull, 'w') as devnull:
+        logging_setup.configure(stream=devnull)
+        try:
+            for enabled in (True, False):
+                level = 'INFO' if enabled else 'WARNING'
+                name = f'bench_legacy_{level}'
+                legacy = [_legacy_logger(level, name, devnull) for _ in range(instances)][-1]
+                start = time.perf_counter()
+                for _ in range(messages):
+                    legacy.info('Connection Id: ' + fields[0] + ' Group Id: ' + fields[1] + ' Service: ' + fields[2] + ' Schema: ' + fields[3] + ' Connected By: ' + fields[4] + ' Created At: ' + fields[5] + ' Succeeded At: ' + fields[6] + ' Failed At: ' + fields[7] + ' Paused: ' + fields[8])
+                elapsed = time.perf_counter() - start
+                results.append({'name': f'legacy {instances} handlers {"enabled" if enabled else "disabled"}', 'messages': messages,
+                                'us_per_message': round(elapsed / messages * 1e6, 3), 'seconds': round(elapsed, 3)})
+                logging.getLogger(name).handlers.clear()
+
+                queued = [logging_setup._logger(level, f'bench_queued_{level}') for _ in range(instances)][-1]
+                start = time.perf_counter()
+                for _ in range(messages):
+                    queued.info('Connection Id: %s Group Id: %s Service: %s Schema: %s Connected By: %s Created At: %s Succeeded At: %s Failed At: %s Paused: %s', *fields)
+                elapsed = time.perf_counter() - start
+                logging_setup.flush()
+                drained = time.perf_counter() - start
+                results.append({'name': f'queued lazy {"enabled" if enabled else "disabled"}', 'messages': messages,
+                                'us_per_message': round(elapsed / messages * 1e6, 3), 'seconds': round(elapsed, 3),
+                                'drained_seconds': round(drained, 3)})
+        finally:
+            logging_setup.configure(stream=sys.stderr)
+    return results
+
+def _legacy_config(filename):
+    # config_helper.config before the cache: every layer read and parsed on each call
+    merged = {}
+    for directory in (os.path.expanduser('~'), os.getcwd()):
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            with open(path) as f:
+                merged.update(json.load(f))
+    return merged
+
+def bench_config(count=400):
+    """A configuration.json loaded once per database of a CDC run (count databases): parsed on
+    every call as before, from the cache with a database override, and a cache miss after the
+    file changed."""
+    import tempfile
+    import config_helper
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'configuration.json'), 'w') as f:
+            json.dump({'server': 'bench.database.windows.net', 'database': 'master', 'user': 'bench', 'password': 'pwd',
+                       'options': {f'option_{i}': i for i in range(200)}}, f)
+        os.chdir(directory)
+        try:
+            start = time.perf_counter()
+            for i in range(count):
+                cfg = _legacy_config('configuration.json')
+                cfg['database'] = f'{i:010d}_System'
+            elapsed = time.perf_counter() - start
+            results.append({'name': 'parse per database', 'loads': count, 'seconds': round(elapsed, 4),
+                            'per_second': round(count / elapsed, 1)})
+            config_helper.clear()
+            start = time.perf_counter()
+            for i in range(count):
+                cfg = config('configuration.json', database=f'{i:010d}_System')
+            elapsed = time.perf_counter() - start
+            results.append({'name': 'cached load per database', 'loads': count, 'seconds': round(elapsed, 4),
+                            'per_second': round(count / elapsed, 1)})
+            start = time.perf_counter()
+            for i in range(count):
+                os.utime('configuration.json', ns=(i, i))
+                cfg = config('configuration.json', database=f'{i:010d}_System')
+            elapsed = time.perf_counter() - start
+            results.append({'name': 'reload after change', 'loads': count, 'seconds': round(elapsed, 4),
+                            'per_second': round(count / elapsed, 1)})
+        finally:
+            os.chdir(cwd)
+            config_helper.clear()
+    return results
+
+def bench_db_pool(calls=200, databases=10, connect_latency=0.02, workers=8):
+    """Helper calls spread over databases, each opening a DBConnection and running a query, with a
+    fresh connection per call as before against the connection pool. SQLite in-memory databases
+    stand in for Azure SQL, connect_latency for its TLS and authentication handshake."""
+    import sqlite3
+    try:
+        from db_connection import DBConnection
+        from db_pool import ConnectionPool
+    except ImportError as e:
+        print(f'db_pool benchmark skipped: {e}')
+        return []
+    def connect(cfg):
+        time.sleep(connect_latency)
+        return sqlite3.connect(f"file:{cfg['database']}?mode=memory&cache=shared", uri=True, check_same_thread=False)
+    base = {'server': 'bench', 'user': 'bench', 'password': 'pwd'}
+    # DBConnection only reads .config
+    configs = [SimpleNamespace(config={**base, 'database': f'{i:010d}_System'}) for i in range(databases)]
+    query = "SELECT 'table_schema', 'table_name'"
+    results = []
+
+    def fresh(i):
+        start = time.perf_counter()
+        connection = connect(configs[i % databases].config)
+        cursor = connection.cursor()
+        cursor.execute(query)
+        cursor.fetchall()
+        cursor.close()
+        connection.close()
+        return time.perf_counter() - start
+
+    pool = ConnectionPool(connect, max_size=workers)
+    def pooled(i):
+        start = time.perf_counter()
+        with DBConnection(configs[i % databases], pool=pool) as db:
+            db.execute_query(query)
+        return time.perf_counter() - start
+
+    logging.getLogger('DBConnection').setLevel(logging.WARNING)
+    for name, call in (('fresh connection', fresh), ('pooled', pooled)):
+        for threads in (1, workers):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                latencies = list(executor.map(call, range(calls)))
+            elapsed = time.perf_counter() - start
+            result = _summary(f'{name} {threads} threads', latencies)
+            result.update({'seconds': round(elapsed, 3), 'per_second': round(calls / elapsed, 1)})
+            if name == 'pooled':
+                result['connections'] = pool.stats['created']
+            results.append(result)
+    pool.close()
+    return results
+
+def bench_query(rows_count=100000, batch_size=1000):
+    """A catalog-sized result (rows_count rows of schema, table, column, type, position) read the
+    old way (fetchall, then a dict per row) against the dict wrapper, iter_query rows consumed
+    one at a time and query_columns. SQLite stands in for SQL Server. Time is measured
+    untraced, peak memory in a second traced run."""
+    import sqlite3
+    try:
+        from db_connection import DBConnection
+        from db_pool import ConnectionPool
+    except ImportError as e:
+        print(f'query benchmark skipped: {e}')
+        return []
+    uri = 'file:bench_catalog?mode=memory&cache=shared'
+    keep = sqlite3.connect(uri, uri=True)
+    keep.execute('CREATE TABLE columns (table_schema TEXT, table_name TEXT, column_name TEXT, data_type TEXT, ordinal_position INTEGER)')
+    keep.executemany('INSERT INTO columns VALUES (?, ?, ?, ?, ?)',
+                     ((f'schema_{i % 20}', f'table_{i // 50}', f'column_{i % 50}', 'nvarchar', i % 50) for i in range(rows_count)))
+    keep.commit()
+    pool = ConnectionPool(lambda cfg: sqlite3.connect(uri, uri=True, check_same_thread=False))
+    query = 'SELECT table_schema, table_name, column_name, data_type, ordinal_position FROM columns'
+
+    def legacy(db):
+        db.cursor.execute(query)
+        columns = [column[0] for column in db.cursor.description]
+        results = []
+        for row in db.cursor.fetchall():
+            results.append({columns[i]: row[i] for i in range(len(columns))})
+        return sum(row['ordinal_position'] for row in results)
+
+    def streamed(mode):
+        def run(db):
+            if mode == 'dict':
+                return sum(row['ordinal_position'] for row in db.iter_query(query, mode='dict', batch_size=batch_size))
+            if mode == 'tuple':
+                return sum(row[4] for row in db.iter_query(query, mode='tuple', batch_size=batch_size))
+            return sum(row.ordinal_position for row in db.iter_query(query, batch_size=batch_size))
+        return run
+
+    cases = (('fetchall dicts', legacy),
+             ('execute_query dicts', lambda db: sum(row['ordinal_position'] for row in db.execute_query(query))),
+             ('iter_query dict', streamed('dict')),
+             ('iter_query namedtuple', streamed('namedtuple')),
+             ('iter_query tuple', streamed('tuple')),
+             ('query_columns', lambda db: sum(db.query_columns(query)['ordinal_position'])))
+    logging.getLogger('DBConnection').setLevel(logging.WARNING)
+    results = []
+    cfg = SimpleNamespace(config={'server': 'bench', 'user': 'bench', 'password': 'pwd', 'database': 'bench_catalog'})
+    with DBConnection(cfg, pool=pool) as db:
+        for name, run in cases:
+            start = time.perf_counter()
+            run(db)
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            run(db)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append({'name': name, 'rows': rows_count, 'seconds': round(elapsed, 3),
+                            'per_second': round(rows_count / elapsed, 1), 'peak_mb': round(peak / 1e6, 2)})
+    pool.close()
+    keep.close()
+    return results
+
+def bench_templates(count=10000, config_file='config_fivetran_blob_payload.json'):
+    """Blob connector payloads built the old way (the payload file re-read and parsed for every
+    connector) against a template parsed once, rendered one by one and in a batch.
+    Reads the payload file of the repository directory."""
+    rows = [{'table': f'sys_sys_table_{i:06d}', 'pattern': f'FL_X_SYS_SYS_FILE_TABLE_{i:06d}.tsv'} for i in range(count)]
+    results = []
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        start = time.perf_counter()
+        for values in rows:
+            payload = _legacy_config(config_file)
+            payload['config']['table'] = values['table']
+            payload['config']['pattern'] = values['pattern']
+        elapsed = time.perf_counter() - start
+        results.append({'name': 'config per payload', 'payloads': count, 'seconds': round(elapsed, 3),
+                        'per_second': round(count / elapsed, 1)})
+        template = PayloadTemplate(config(config_file).config, BLOB_FIELDS, config_file)
+        start = time.perf_counter()
+        for values in rows:
+            template.render(**values)
+        elapsed = time.perf_counter() - start
+        results.append({'name': 'template render', 'payloads': count, 'seconds': round(elapsed, 3),
+                        'per_second': round(count / elapsed, 1)})
+        start = time.perf_counter()
+        for _ in template.render_many(rows):
+            pass
+        elapsed = time.perf_counter() - start
+        results.append({'name': 'template render_many', 'payloads': count, 'seconds': round(elapsed, 3),
+                        'per_second': round(count / elapsed, 1)})
+    finally:
+        os.chdir(cwd)
+    return results
+
+BENCHMARKS = {
+    'session': lambda args: bench_session(int(500 * args.scale)),
+    'models': lambda args: bench_models(int(20000 * args.scale)),
+    'export': lambda args: bench_export(int(50000 * args.scale)),
+    'logging': lambda args: bench_logging(int(20000 * args.scale)),
+    'templates': lambda args: bench_templates(int(10000 * args.scale)),
+    'config': lambda args: bench_config(int(400 * args.scale)),
+    'query': lambda args: bench_query(int(100000 * args.scale)),
+    'db_pool': lambda args: bench_db_pool(int(200 * args.scale), workers=args.workers // 2),
+    'streaming': lambda args: bench_streaming(int(5000 * args.scale)),
+    'listing': lambda args: bench_listing(int(10000 * args.scale), latency=args.latency, subprocess=args.subprocess),
+    'create': lambda args: bench_create(int(500 * args.scale), args.workers, args.latency, args.subprocess),
+    'pause': lambda args: bench_pause(int(500 * args.scale), args.workers, args.latency, args.subprocess),
+    'delete': lambda args: bench_delete(int(500 * args.scale), args.workers, args.latency, args.subprocess),
+}
+
+# measurements where a higher value is better, every other compared measurement is a timing or a size
+_HIGHER_IS_BETTER = ('per_second',)
+_COMPARED = ('seconds', 'per_second', 'mean_ms', 'p50_ms', 'p95_ms', 'peak_mb', 'model_mb', 'us_per_message')
+
+def _metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {'commit': commit or None, 'python': platform.python_version(), 'platform': platform.platform(),
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'parameters': {'scale': args.scale, 'latency': args.latency, 'workers': args.workers,
+                           'subprocess': args.subprocess}}
+
+def compare(baseline, current, tolerance=0.10):
+    """Relative change of every measurement found in both runs, and the ones that regressed."""
+    rows = []
+    for bench, results in current['benchmarks'].items():
+        before = {result['name']: result for result in baseline.get('benchmarks', {}).get(bench, [])}
+        for result in results:
+            old = before.get(result['name'])
+            if old is None:
+                continue
+            for key in _COMPARED:
+                if not old.get(key) or result.get(key) is None:
+                    continue
+                change = (result[key] - old[key]) / old[key]
+                worse = -change if key in _HIGHER_IS_BETTER else change
+                rows.append({'benchmark': bench, 'name': result['name'], 'measure': key, 'baseline': old[key],
+                             'current': result[key], 'change': round(change, 3), 'regressed': worse > tolerance})
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the fivetranapi client against the local stub server')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='benchmarks to run, default all')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the item and request counts')
+    parser.add_argument('--latency', type=float, default=0.005, help='stub server latency for the throughput benchmarks')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--subprocess', action='store_true', help='run the stub server in a separate process')
+    parser.add_argument('--output', help='write the results as json to this file')
+    parser.add_argument('--compare', help='baseline json written by an earlier --output')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='relative change counted as a regression')
+    args = parser.parse_args(argv)
+
+    run = {'metadata': _metadata(args), 'benchmarks': {}}
+    for name in args.only or BENCHMARKS:
+        run['benchmarks'][name] = BENCHMARKS[name](args)
+        for result in run['benchmarks'][name]:
+            print(name, result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared against {baseline['metadata'].get('commit')} ({baseline['metadata'].get('started_at')})")
+        rows = compare(baseline, run, args.tolerance)
+        for row in rows:
+            flag = 'REGRESSED' if row['regressed'] else ''
+            print(f"{row['benchmark']:>10} {row['name']:<22} {row['measure']:<10} {row['baseline']:>10} -> "
+                  f"{row['current']:>10} {row['change']:+.1%} {flag}")
+        if any(row['regressed'] for row in rows):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
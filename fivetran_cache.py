@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Response cache for GET calls of the Fivetran API client.
+# Only endpoints with a configured TTL are cached, matched by the longest endpoint prefix
+# (by default the metadata endpoints, which return large payloads that rarely change).
+# Entries live in an in-memory LRU and optionally in a directory on disk so they survive script
+# runs. Expired entries that carry an ETag are revalidated with If-None-Match instead of being
+# re-downloaded, and any POST/PATCH/DELETE invalidates cached entries of the same resource.
+# Cached responses are shared between callers and must be treated as read-only. Keys include a
+# scope, the base url and a hash of the credentials of the client (see scope()), so clients of
+# different accounts or API hosts sharing a cache or its directory never see each other's entries.
+
+DEFAULT_TTLS = {
+    'metadata/': 24 * 60 * 60,
+}
+
+# the API exposes connections under both names
+_RESOURCE_ALIASES = {
+    'connectors': ('connectors', 'connections'),
+    'connections': ('connectors', 'connections'),
+}
+
+class _entry():
+    __slots__ = ('endpoint', 'data', 'etag', 'expires')
+
+    def __init__(self, endpoint, data, etag, expires):
+        self.endpoint = endpoint
+        self.data = data
+        self.etag = etag
+        self.expires = expires
+
+class ResponseCache:
+    def __init__(self, ttls=None, max_entries=256, directory=None):
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def ttl(self, endpoint):
+        matches = [prefix for prefix in self.ttls if endpoint.startswith(prefix)]
+        if not matches:
+            return None
+        return self.ttls[max(matches, key=len)]
+
+    @staticmethod
+    def scope(base_url, api_key, api_secret):
+        """Cache scope of a client, the credentials only as a hash."""
+        secret = hashlib.sha256(f'{api_key}:{api_secret}'.encode('utf-8')).hexdigest()
+        return f'{base_url.rstrip("/")}#{secret}'
+
+    def key(self, endpoint, params=None, scope=''):
+        params = json.dumps(params, sort_keys=True) if params else ''
+        return hashlib.sha256(f'{scope}\n{endpoint}?{params}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                raw = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return _entry(raw['endpoint'], raw['data'], raw['etag'], raw['expires'])
+
+    def _save(self, key, entry):
+        if self.directory is None:
+            return
+        tmp = self._path(key) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'endpoint': entry.endpoint, 'data': entry.data, 'etag': entry.etag, 'expires': entry.expires}, f)
+        os.replace(tmp, self._path(key))
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def lookup(self, endpoint, params=None, scope=''):
+        """Returns (key, entry, fresh). key is None when the endpoint is not cacheable."""
+        if self.ttl(endpoint) is None:
+            return None, None, False
+        key = self.key(endpoint, params, scope)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._load(key)
+                if entry is not None:
+                    self._remember(key, entry)
+            else:
+                self._entries.move_to_end(key)
+            fresh = entry is not None and entry.expires > time.time()
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return key, entry, fresh
+
+    def store(self, key, endpoint, data, etag=None):
+        entry = _entry(endpoint, data, etag, time.time() + self.ttl(endpoint))
+        with self._lock:
+            self._remember(key, entry)
+            self._save(key, entry)
+
+    def revalidated(self, key, entry):
+        """The API answered 304 Not Modified, extends the life of the entry."""
+        entry.expires = time.time() + self.ttl(entry.endpoint)
+        with self._lock:
+            self.revalidations += 1
+            self._remember(key, entry)
+            self._save(key, entry)
+
+    def invalidate(self, endpoint=None):
+        """Drops entries of the resource an endpoint belongs to, everything when endpoint is None."""
+        resources = None
+        if endpoint is not None:
+            resource = endpoint.split('/', 1)[0]
+            resources = _RESOURCE_ALIASES.get(resource, (resource,))
+            if not any(prefix.split('/', 1)[0] in resources for prefix in self.ttls):
+                # nothing of this resource is ever cached, keeps mutating calls free
+                return
+        with self._lock:
+            keys = [key for key, entry in self._entries.items()
+                    if resources is None or entry.endpoint.split('/', 1)[0] in resources]
+            for key in keys:
+                del self._entries[key]
+            if self.directory is not None:
+                for name in os.listdir(self.directory):
+                    if not name.endswith('.json'):
+                        continue
+                    key = name[:-len('.json')]
+                    if resources is not None and key not in keys:
+                        entry = self._load(key)
+                        if entry is None or entry.endpoint.split('/', 1)[0] not in resources:
+                            continue
+                    try:
+                        os.remove(self._path(key))
+                    except OSError:
+                        pass
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations}
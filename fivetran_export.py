@@ -0,0 +1,246 @@
+import csv
+import gzip
+import json
+import time
+import fivetranapi
+
+# Streaming inventory exports of a Fivetran account, the file counterpart of the print_* methods.
+# Items come one at a time from connect.iter_stream (or page by page from iter_pages) and are
+# written straight out as NDJSON or CSV, or in columnar batches of batch_size rows as Parquet or
+# Arrow when pyarrow is installed, so memory stays bounded by a page or a batch whatever the size
+# of the account. columns projects the output, nested fields are addressed with dots
+# ('status.sync_state'). Text formats are gzipped when compress is set or the path ends in .gz,
+# Parquet uses its own gzip codec.
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# resource -> (endpoint, model whose fields are the default columns)
+RESOURCES = {
+    'connections': ('connections', fivetranapi.connection),
+    'destinations': ('destinations', fivetranapi.destination),
+    'groups': ('groups', fivetranapi.group),
+    'users': ('users', fivetranapi.user),
+    'private_links': ('private-links', fivetranapi.privatelink),
+    'hybrid_deployment_agents': ('hybrid-deployment-agents', fivetranapi.hybrid_deployment_agent),
+}
+
+FORMATS = ('ndjson', 'csv', 'parquet', 'arrow')
+
+_SUFFIXES = {'.ndjson': 'ndjson', '.jsonl': 'ndjson', '.json': 'ndjson', '.csv': 'csv',
+             '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+
+def detect_format(path):
+    """(format, gzipped) from a file name such as connections.csv.gz."""
+    name = path.lower()
+    gzipped = name.endswith('.gz')
+    if gzipped:
+        name = name[:-3]
+    for suffix, format in _SUFFIXES.items():
+        if name.endswith(suffix):
+            return format, gzipped
+    raise ValueError(f'Cannot tell the export format of {path}, use one of {", ".join(FORMATS)}')
+
+def _getter(column):
+    keys = column.split('.')
+    if len(keys) == 1:
+        return lambda item: item.get(column)
+    def get(item):
+        for key in keys:
+            if not isinstance(item, dict):
+                return None
+            item = item.get(key)
+        return item
+    return get
+
+def project(items, columns):
+    """Yields each item reduced to the given (possibly dotted) columns, in column order."""
+    getters = [(column, _getter(column)) for column in columns]
+    for item in items:
+        yield {column: get(item) for column, get in getters}
+
+_encode = json.JSONEncoder(separators=(',', ':'), default=str).encode
+
+def _cell(value):
+    # flat text for csv and string columns: nested values as compact json, None stays None
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return _encode(value)
+    return str(value)
+
+class _text_writer():
+    def __init__(self, path, gzipped, compresslevel=6):
+        if gzipped:
+            self.f = gzip.open(path, 'wt', encoding='utf-8', newline='', compresslevel=compresslevel)
+        else:
+            self.f = open(path, 'w', encoding='utf-8', newline='')
+
+    def close(self):
+        self.f.close()
+
+class _ndjson_writer(_text_writer):
+    def __init__(self, path, columns, gzipped):
+        super().__init__(path, gzipped)
+        self.columns = columns
+
+    def write(self, items):
+        if self.columns is not None:
+            items = project(items, self.columns)
+        self.f.write(''.join(_encode(item) + '\n' for item in items))
+
+class _csv_writer(_text_writer):
+    def __init__(self, path, columns, gzipped):
+        super().__init__(path, gzipped)
+        self.getters = [_getter(column) for column in columns]
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(columns)
+
+    def write(self, items):
+        getters = self.getters
+        self.writer.writerows([_cell(get(item)) for get in getters] for item in items)
+
+class _arrow_writer():
+    """Parquet or Arrow IPC file written in record batches. Column types are taken from the first
+    batch (bool, int, float, everything else string with nested values as json); a later value
+    that does not fit its column is written as null and counted in coerced."""
+    def __init__(self, path, columns, gzipped, format):
+        if pyarrow is None:
+            raise ImportError(f'Exporting {format} needs pyarrow, install it or export ndjson/csv')
+        self.path = path
+        self.columns = columns
+        self.getters = [_getter(column) for column in columns]
+        self.compression = 'gzip' if gzipped else 'snappy'
+        self.format = format
+        self.schema = None
+        self.converters = None
+        self.writer = None
+        self.coerced = 0
+
+    def _open(self, columns):
+        fields, converters = [], []
+        for name, values in zip(self.columns, columns):
+            sample = next((value for value in values if value is not None), None)
+            if isinstance(sample, bool):
+                fields.append(pyarrow.field(name, pyarrow.bool_()))
+                converters.append(self._typed(bool))
+            elif isinstance(sample, int):
+                fields.append(pyarrow.field(name, pyarrow.int64()))
+                converters.append(self._typed(int))
+            elif isinstance(sample, float):
+                fields.append(pyarrow.field(name, pyarrow.float64()))
+                converters.append(self._typed((int, float)))
+            else:
+                fields.append(pyarrow.field(name, pyarrow.string()))
+                converters.append(_cell)
+        self.schema = pyarrow.schema(fields)
+        self.converters = converters
+        if self.format == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression=self.compression)
+        else:
+            self.sink = pyarrow.OSFile(self.path, 'wb')
+            self.writer = pyarrow.ipc.new_file(self.sink, self.schema)
+
+    def _typed(self, types):
+        def convert(value):
+            if value is None or (isinstance(value, types) and not (types is int and isinstance(value, bool))):
+                return value
+            self.coerced += 1
+            return None
+        return convert
+
+    def write(self, items):
+        if not items:
+            return
+        # transpose the batch into one list per column
+        columns = [[get(item) for item in items] for get in self.getters]
+        if self.writer is None:
+            self._open(columns)
+        arrays = [pyarrow.array([convert(value) for value in values], type=field.type)
+                  for values, convert, field in zip(columns, self.converters, self.schema)]
+        self.writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self.writer is None:
+            # nothing was exported, still leave a valid file with string columns
+            self._open([[] for _ in self.columns])
+        self.writer.close()
+        if self.format == 'arrow':
+            self.sink.close()
+
+class InventoryExporter:
+    def __init__(self, ft, limit=1000, stream=True, batch_size=5000):
+        self.ft = ft
+        self.limit = limit
+        self.stream = stream
+        self.batch_size = batch_size
+
+    def items(self, resource, group_id=None):
+        """Raw items of a resource (connections of one group when group_id is given)."""
+        endpoint = RESOURCES[resource][0]
+        if group_id is not None:
+            if resource != 'connections':
+                raise ValueError('group_id only applies to connections')
+            endpoint = f'groups/{group_id}/connections'
+        if self.stream:
+            return self.ft.iter_stream(endpoint, self.limit)
+        return (item for page in self.ft.iter_pages(endpoint, self.limit, prefetch=True) for item in page)
+
+    def export(self, resource, path, format=None, columns=None, compress=None, group_id=None, items=None):
+        """Writes a resource to path and returns {'rows', 'seconds', ...}. format and compress
+        default to what the file name says, columns to every field of the resource model
+        (NDJSON keeps whole items unless columns is given). items replaces the API listing with
+        raw dicts or models, e.g. ConnectionInventory.find(...) or FivetranMirror.find(...)."""
+        detected, gzipped = detect_format(path) if format is None else (format, path.lower().endswith('.gz'))
+        format = detected
+        if format not in FORMATS:
+            raise ValueError(f'Unknown export format {format}, use one of {", ".join(FORMATS)}')
+        if compress is not None:
+            gzipped = compress
+        if columns is not None and isinstance(columns, str):
+            columns = [column.strip() for column in columns.split(',') if column.strip()]
+        if columns is None and format != 'ndjson':
+            columns = list(RESOURCES[resource][1]._fields)
+        if format == 'ndjson':
+            writer = _ndjson_writer(path, columns, gzipped)
+        elif format == 'csv':
+            writer = _csv_writer(path, columns, gzipped)
+        else:
+            writer = _arrow_writer(path, columns, gzipped, format)
+        start = time.perf_counter()
+        rows = 0
+        if items is None:
+            source = self.items(resource, group_id)
+        else:
+            source = (item if isinstance(item, dict) else item._json for item in items)
+        # columnar formats need whole batches, text is written every few hundred items
+        flush_at = self.batch_size if isinstance(writer, _arrow_writer) else min(self.batch_size, 500)
+        try:
+            batch = []
+            for item in source:
+                batch.append(item)
+                if len(batch) >= flush_at:
+                    writer.write(batch)
+                    rows += len(batch)
+                    batch = []
+            writer.write(batch)
+            rows += len(batch)
+        finally:
+            writer.close()
+        result = {'resource': resource, 'path': path, 'format': format, 'gzip': gzipped, 'rows': rows,
+                  'seconds': round(time.perf_counter() - start, 3)}
+        if isinstance(writer, _arrow_writer):
+            result['coerced'] = writer.coerced
+        return result
+
+    def export_all(self, directory, format='ndjson', compress=True, resources=None):
+        """One file per resource in directory, e.g. connections.ndjson.gz."""
+        suffix = {'ndjson': '.ndjson', 'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}[format]
+        if compress and format in ('ndjson', 'csv'):
+            suffix += '.gz'
+        return [self.export(resource, f'{directory}/{resource}{suffix}', format, compress=compress)
+                for resource in resources or RESOURCES]
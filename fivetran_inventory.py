@@ -0,0 +1,126 @@
+import threading
+from collections import defaultdict
+
+# In-memory inventory of the connections of an account with hash indexes on the fields scripts
+# filter on, so repeated lookups are dictionary hits instead of linear scans or API re-listings.
+
+def _sync_state(conn):
+    status = conn.status
+    return status.get('sync_state') if isinstance(status, dict) else status
+
+def _setup_state(conn):
+    status = conn.status
+    return status.get('setup_state') if isinstance(status, dict) else None
+
+class ConnectionInventory:
+    # index name -> function returning the key of a connection for that index
+    INDEXES = {
+        'group_id': lambda conn: conn.group_id,
+        'schema': lambda conn: conn.schema,
+        'service': lambda conn: conn.service,
+        'connected_by': lambda conn: conn.connected_by,
+        'status': _sync_state,
+        'setup_state': _setup_state,
+        'paused': lambda conn: conn.paused,
+        'schedule_type': lambda conn: conn.schedule_type,
+    }
+
+    def __init__(self, connections=()):
+        self._by_id = {}
+        self._indexes = {name: defaultdict(set) for name in self.INDEXES}
+        self._lock = threading.RLock()
+        for conn in connections:
+            self.upsert(conn)
+
+    @classmethod
+    def from_api(cls, ft, limit=1000, prefetch=True, stream=False):
+        """Builds the inventory from fivetranapi.connect.iter_connections."""
+        return cls(ft.iter_connections(limit=limit, prefetch=prefetch, stream=stream))
+
+    @staticmethod
+    def _normalize(name, value):
+        # the paused attribute is exposed as 'True'/'False' strings, accept booleans in queries
+        if name == 'paused' and isinstance(value, bool):
+            return str(value)
+        return value
+
+    def upsert(self, conn):
+        with self._lock:
+            self._unindex(conn.id)
+            self._by_id[conn.id] = conn
+            for name, key in self.INDEXES.items():
+                self._indexes[name][key(conn)].add(conn.id)
+
+    def remove(self, connection_id):
+        with self._lock:
+            conn = self._unindex(connection_id)
+            if conn is not None:
+                del self._by_id[connection_id]
+            return conn
+
+    def _unindex(self, connection_id):
+        conn = self._by_id.get(connection_id)
+        if conn is None:
+            return None
+        for name, key in self.INDEXES.items():
+            index = self._indexes[name]
+            value = key(conn)
+            ids = index.get(value)
+            if ids is not None:
+                ids.discard(connection_id)
+                if not ids:
+                    del index[value]
+        return conn
+
+    def get(self, connection_id):
+        return self._by_id.get(connection_id)
+
+    def ids(self, **criteria):
+        """Ids of the connections matching every criterion. A criterion value may be a list, tuple
+        or set to match any of its values, e.g. ids(group_id='g1', status=('paused', 'rescheduled'))."""
+        with self._lock:
+            candidates = []
+            for name, value in criteria.items():
+                if name not in self._indexes:
+                    raise ValueError(f'No index on {name}, available: {", ".join(self.INDEXES)}')
+                index = self._indexes[name]
+                if isinstance(value, (list, tuple, set, frozenset)):
+                    ids = set()
+                    for v in value:
+                        ids |= index.get(self._normalize(name, v), set())
+                else:
+                    ids = index.get(self._normalize(name, value), set())
+                if not ids:
+                    return set()
+                candidates.append(ids)
+            if not candidates:
+                return set(self._by_id)
+            # intersect starting from the most selective index
+            candidates.sort(key=len)
+            return set(candidates[0]).intersection(*candidates[1:])
+
+    def find(self, predicate=None, **criteria):
+        """Connections matching the indexed criteria and, if given, an arbitrary predicate."""
+        with self._lock:
+            conns = [self._by_id[connection_id] for connection_id in self.ids(**criteria)]
+        if predicate is not None:
+            conns = [conn for conn in conns if predicate(conn)]
+        return conns
+
+    def count(self, **criteria):
+        return len(self.ids(**criteria))
+
+    def keys(self, name):
+        """Distinct values of an indexed field, e.g. keys('group_id')."""
+        with self._lock:
+            return list(self._indexes[name])
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, connection_id):
+        return connection_id in self._by_id
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._by_id.values()))
@@ -0,0 +1,158 @@
+import codecs
+import json
+
+# JSON decoding for the Fivetran API client.
+# loads uses orjson when it is installed. item_stream decodes the data.items array of a list
+# response incrementally from a stream of byte chunks and yields one item at a time, so the full
+# page is never held as raw bytes and as a parsed tree at once. It uses ijson when installed and
+# otherwise a small incremental parser around json.JSONDecoder.raw_decode.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class _reader():
+    """Text buffer over byte chunks that only ever keeps the undecoded tail in memory."""
+    _whitespace = ' \t\n\r'
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        # drop what has been consumed before growing the buffer
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.buf += self.decoder.decode(chunk)
+                return True
+        self.buf += self.decoder.decode(b'', final=True)
+        self.eof = True
+        return False
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self._whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON stream')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'Expected {char!r} at stream offset, got {self.buf[self.pos]!r}')
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buf, self.pos)
+                # a value touching the end of the buffer may be a truncated number or literal
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+class item_stream():
+    """Iterates the data.items of a list response, next_cursor is set once iteration has finished."""
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.next_cursor = None
+
+    def __iter__(self):
+        if ijson is not None:
+            return self._iter_ijson()
+        return self._iter_raw()
+
+    def _iter_ijson(self):
+        builder = None
+        for prefix, event, value in ijson.parse(_chunk_file(self.chunks)):
+            if builder is not None:
+                if prefix == 'data.items.item' and event in ('end_map', 'end_array'):
+                    builder.event(event, value)
+                    yield builder.value
+                    builder = None
+                else:
+                    builder.event(event, value)
+            elif prefix == 'data.items.item':
+                if event in ('start_map', 'start_array'):
+                    builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                else:
+                    yield value
+            elif prefix == 'data.next_cursor':
+                self.next_cursor = value
+
+    def _iter_raw(self):
+        reader = _reader(self.chunks)
+        yield from self._object(reader, top=True)
+
+    def _object(self, reader, top):
+        # top is the response envelope, otherwise the data object holding items and next_cursor
+        reader.expect('{')
+        if reader.peek() == '}':
+            reader.pos += 1
+            return
+        while True:
+            key = reader.value()
+            reader.expect(':')
+            if top and key == 'data':
+                yield from self._object(reader, top=False)
+            elif not top and key == 'items':
+                reader.expect('[')
+                if reader.peek() == ']':
+                    reader.pos += 1
+                else:
+                    while True:
+                        yield reader.value()
+                        if reader.peek() == ',':
+                            reader.pos += 1
+                            continue
+                        reader.expect(']')
+                        break
+            else:
+                value = reader.value()
+                if not top and key == 'next_cursor':
+                    self.next_cursor = value
+            if reader.peek() == ',':
+                reader.pos += 1
+                continue
+            reader.expect('}')
+            return
+
+class _chunk_file():
+    # minimal file object over byte chunks for ijson
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+
+    def read(self, size=-1):
+        if size == 0:
+            # ijson probes with read(0) to tell bytes from str
+            return b''
+        for chunk in self.chunks:
+            if chunk:
+                return chunk
+        return b''
@@ -0,0 +1,173 @@
+import bisect
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+
+# Per-endpoint request metrics for the Fivetran API client.
+# Requests are keyed by method and endpoint template (connections/{id}, not the raw url) and
+# counted into status buckets and a fixed latency histogram, from which p50/p95/p99 are
+# estimated. Recording is a dictionary lookup and a few integer increments under one lock.
+# Time spent waiting on the throttler and in retry backoff is tracked separately so a slow run
+# can be attributed to the API, the network or our own pacing.
+
+# literal path segments of the API, everything else is an identifier
+_LITERALS = frozenset((
+    'account', 'info', 'connections', 'connectors', 'groups', 'destinations', 'users', 'private-links',
+    'hybrid-deployment-agents', 'metadata', 'connector-types', 'resync', 'sync', 'schemas', 'tables',
+    'columns', 'test', 'setup-tests', 'state', 'certificates', 'fingerprints', 'webhooks', 'roles', 'teams',
+))
+
+# latency bucket upper bounds in seconds, the last bucket is unbounded
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+@lru_cache(maxsize=4096)
+def endpoint_template(endpoint):
+    return '/'.join(part if part in _LITERALS else '{id}' for part in endpoint.split('?', 1)[0].split('/'))
+
+def status_bucket(status_code):
+    if status_code is None:
+        return 'error'
+    if status_code == 429:
+        return '429'
+    return f'{status_code // 100}xx'
+
+class _series():
+    __slots__ = ('count', 'statuses', 'buckets', 'latency_sum', 'bytes_in', 'bytes_out', 'retries')
+
+    def __init__(self):
+        self.count = 0
+        self.statuses = {}
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.retries = 0
+
+    def percentile(self, p):
+        """Estimated from the histogram by linear interpolation inside the bucket holding the rank."""
+        if self.count == 0:
+            return None
+        rank = p * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                low = BUCKETS[i - 1] if i > 0 else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+class ApiMetrics:
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.throttle_wait = 0.0
+        self.backoff_wait = 0.0
+
+    def _get(self, method, endpoint):
+        key = (method, endpoint_template(endpoint))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _series()
+        return series
+
+    def observe(self, method, endpoint, status_code, latency, bytes_in=0, bytes_out=0):
+        bucket = status_bucket(status_code)
+        index = bisect.bisect_left(BUCKETS, latency)
+        with self._lock:
+            series = self._get(method, endpoint)
+            series.count += 1
+            series.statuses[bucket] = series.statuses.get(bucket, 0) + 1
+            series.buckets[index] += 1
+            series.latency_sum += latency
+            series.bytes_in += bytes_in
+            series.bytes_out += bytes_out
+
+    def retry(self, method, endpoint, backoff=0.0):
+        with self._lock:
+            self._get(method, endpoint).retries += 1
+            self.backoff_wait += backoff
+
+    def throttled(self, seconds):
+        with self._lock:
+            self.throttle_wait += seconds
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+            self.started = time.time()
+            self.throttle_wait = 0.0
+            self.backoff_wait = 0.0
+
+    def snapshot(self):
+        with self._lock:
+            items = [(key, series.count, dict(series.statuses), list(series.buckets), series.latency_sum,
+                      series.bytes_in, series.bytes_out, series.retries, series.percentile(0.5),
+                      series.percentile(0.95), series.percentile(0.99))
+                     for key, series in sorted(self._series.items())]
+            snapshot = {'since': self.started, 'uptime': round(time.time() - self.started, 3),
+                        'throttle_wait_seconds': round(self.throttle_wait, 3),
+                        'backoff_wait_seconds': round(self.backoff_wait, 3), 'endpoints': []}
+        for (method, template), count, statuses, buckets, latency_sum, bytes_in, bytes_out, retries, p50, p95, p99 in items:
+            snapshot['endpoints'].append({
+                'method': method, 'endpoint': template, 'count': count, 'statuses': statuses,
+                'latency_mean': round(latency_sum / count, 6) if count else None,
+                'latency_p50': round(p50, 6) if p50 is not None else None,
+                'latency_p95': round(p95, 6) if p95 is not None else None,
+                'latency_p99': round(p99, 6) if p99 is not None else None,
+                'latency_sum': round(latency_sum, 6), 'buckets': buckets,
+                'bytes_in': bytes_in, 'bytes_out': bytes_out, 'retries': retries,
+            })
+        return snapshot
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix='fivetran_api'):
+        snapshot = self.snapshot()
+        families = {
+            'requests_total': ('counter', []), 'request_duration_seconds': ('histogram', []),
+            'bytes_in_total': ('counter', []), 'bytes_out_total': ('counter', []), 'retries_total': ('counter', []),
+        }
+        for e in snapshot['endpoints']:
+            labels = f'method="{e["method"]}",endpoint="{e["endpoint"]}"'
+            for status, count in sorted(e['statuses'].items()):
+                families['requests_total'][1].append(f'{prefix}_requests_total{{{labels},status="{status}"}} {count}')
+            histogram = families['request_duration_seconds'][1]
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), e['buckets']):
+                cumulative += count
+                histogram.append(f'{prefix}_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            histogram.append(f'{prefix}_request_duration_seconds_sum{{{labels}}} {e["latency_sum"]}')
+            histogram.append(f'{prefix}_request_duration_seconds_count{{{labels}}} {e["count"]}')
+            families['bytes_in_total'][1].append(f'{prefix}_bytes_in_total{{{labels}}} {e["bytes_in"]}')
+            families['bytes_out_total'][1].append(f'{prefix}_bytes_out_total{{{labels}}} {e["bytes_out"]}')
+            families['retries_total'][1].append(f'{prefix}_retries_total{{{labels}}} {e["retries"]}')
+        families['throttle_wait_seconds_total'] = ('counter', [f'{prefix}_throttle_wait_seconds_total {snapshot["throttle_wait_seconds"]}'])
+        families['backoff_wait_seconds_total'] = ('counter', [f'{prefix}_backoff_wait_seconds_total {snapshot["backoff_wait_seconds"]}'])
+        lines = []
+        for name, (kind, samples) in families.items():
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path, format='prometheus'):
+        text = self.to_prometheus() if format == 'prometheus' else self.to_json()
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        # atomic so a scraper or tail never sees a half written file
+        os.replace(tmp, path)
+
+    def dump_periodically(self, path, interval=60.0, format='prometheus'):
+        """Dumps in a daemon thread every interval seconds until the returned event is set."""
+        stop = threading.Event()
+        def run():
+            while not stop.wait(interval):
+                self.dump(path, format)
+            self.dump(path, format)
+        threading.Thread(target=run, name='fivetran-metrics', daemon=True).start()
+        return stop
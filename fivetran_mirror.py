@@ -0,0 +1,227 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import fivetranapi
+
+# Local SQLite mirror of a Fivetran account.
+# Each resource is a table keyed by id holding the item json plus indexed columns for the fields
+# reports and planners filter on. refresh() re-lists a resource through the lazy iterators and only
+# writes rows whose change token moved (for connections succeeded_at, failed_at, status and the
+# schedule fields), deleting rows that disappeared from the account. attach() registers the mirror
+# as a listener on a fivetranapi.connect so mutations made through it are written through.
+
+def _status(key):
+    def get(item):
+        status = item.get('status')
+        return status.get(key) if isinstance(status, dict) else None
+    return get
+
+def _field(key):
+    return lambda item: item.get(key)
+
+def _paused(item):
+    paused = item.get('paused')
+    return None if paused is None else int(bool(paused))
+
+RESOURCES = {
+    'groups': {
+        'endpoint': 'groups', 'model': fivetranapi.group,
+        'columns': {'name': _field('name')},
+    },
+    'destinations': {
+        'endpoint': 'destinations', 'model': fivetranapi.destination,
+        'columns': {'group_id': _field('group_id'), 'service': _field('service'), 'setup_status': _field('setup_status')},
+    },
+    'connections': {
+        'endpoint': 'connections', 'model': fivetranapi.connection,
+        'columns': {
+            'group_id': _field('group_id'), 'service': _field('service'), 'schema': _field('schema'),
+            'connected_by': _field('connected_by'), 'paused': _paused, 'schedule_type': _field('schedule_type'),
+            'sync_state': _status('sync_state'), 'setup_state': _status('setup_state'),
+            'succeeded_at': _field('succeeded_at'), 'failed_at': _field('failed_at'),
+        },
+        'change_fields': ('succeeded_at', 'failed_at', 'status', 'paused', 'schedule_type', 'sync_frequency',
+                          'daily_sync_time', 'config', 'setup_tests'),
+    },
+    'users': {
+        'endpoint': 'users', 'model': fivetranapi.user,
+        'columns': {'email': _field('email'), 'role': _field('role'), 'active': _field('active')},
+    },
+    'private_links': {
+        'endpoint': 'private-links', 'model': fivetranapi.privatelink,
+        'columns': {'service': _field('service'), 'region': _field('region'), 'state': _field('state')},
+    },
+    'hybrid_deployment_agents': {
+        'endpoint': 'hybrid-deployment-agents', 'model': fivetranapi.hybrid_deployment_agent,
+        'columns': {'group_id': _field('group_id'), 'display_name': _field('display_name')},
+    },
+}
+
+# first endpoint segment of a mutating call -> mirrored table
+_MUTATIONS = {
+    'connectors': 'connections',
+    'connections': 'connections',
+    'groups': 'groups',
+    'destinations': 'destinations',
+    'users': 'users',
+    'private-links': 'private_links',
+    'hybrid-deployment-agents': 'hybrid_deployment_agents',
+}
+
+def change_token(resource, item):
+    fields = RESOURCES[resource].get('change_fields')
+    if fields is not None:
+        item = {field: item.get(field) for field in fields}
+    return hashlib.sha1(json.dumps(item, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class FivetranMirror:
+    def __init__(self, path='fivetran_mirror.db', ft=None):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self._lock = threading.RLock()
+        self._create_schema()
+        self.ft = None
+        if ft is not None:
+            self.attach(ft)
+
+    def _create_schema(self):
+        with self._lock, self.db:
+            for resource, spec in RESOURCES.items():
+                columns = ''.join(f', "{column}"' for column in spec['columns'])
+                self.db.execute(f'CREATE TABLE IF NOT EXISTS {resource} (id TEXT PRIMARY KEY, token TEXT NOT NULL, '
+                                f'refreshed_at REAL NOT NULL, json TEXT NOT NULL{columns})')
+                for column in spec['columns']:
+                    self.db.execute(f'CREATE INDEX IF NOT EXISTS ix_{resource}_{column} ON {resource} ("{column}")')
+            self.db.execute('CREATE TABLE IF NOT EXISTS refresh_log (resource TEXT, refreshed_at REAL, '
+                            'items INTEGER, changed INTEGER, removed INTEGER, seconds REAL)')
+
+    def close(self):
+        if self.ft is not None:
+            self.detach()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def attach(self, ft):
+        self.ft = ft
+        ft.listeners.append(self.on_mutation)
+
+    def detach(self):
+        if self.on_mutation in self.ft.listeners:
+            self.ft.listeners.remove(self.on_mutation)
+        self.ft = None
+
+    def _row(self, resource, item, now):
+        columns = RESOURCES[resource]['columns']
+        return (item['id'], change_token(resource, item), now, json.dumps(item, default=str),
+                *(get(item) for get in columns.values()))
+
+    def _upsert_sql(self, resource):
+        columns = ['id', 'token', 'refreshed_at', 'json', *RESOURCES[resource]['columns']]
+        names = ', '.join(f'"{column}"' for column in columns)
+        marks = ', '.join('?' for _ in columns)
+        return f'INSERT OR REPLACE INTO {resource} ({names}) VALUES ({marks})'
+
+    def upsert(self, resource, items):
+        now = time.time()
+        rows = [self._row(resource, item, now) for item in items]
+        with self._lock, self.db:
+            self.db.executemany(self._upsert_sql(resource), rows)
+        return len(rows)
+
+    def delete(self, resource, ids):
+        with self._lock, self.db:
+            self.db.executemany(f'DELETE FROM {resource} WHERE id = ?', [(i,) for i in ids])
+
+    def refresh(self, resource, batch_size=1000, limit=1000, stream=False):
+        """Re-lists one resource and writes only new or changed items, removing vanished ones.
+        Returns a dict with the number of items seen, changed and removed."""
+        if self.ft is None:
+            raise ValueError('Mirror is not attached to a fivetranapi.connect')
+        start = time.perf_counter()
+        with self._lock:
+            tokens = dict(self.db.execute(f'SELECT id, token FROM {resource}'))
+        endpoint = RESOURCES[resource]['endpoint']
+        items = self.ft.iter_stream(endpoint, limit) if stream else \
+            (item for page in self.ft.iter_pages(endpoint, limit, prefetch=True) for item in page)
+        seen = 0
+        changed = []
+        changed_count = 0
+        for item in items:
+            seen += 1
+            if tokens.pop(item['id'], None) != change_token(resource, item):
+                changed.append(item)
+                if len(changed) >= batch_size:
+                    changed_count += self.upsert(resource, changed)
+                    changed = []
+        changed_count += self.upsert(resource, changed)
+        # whatever was not listed any more has been deleted from the account
+        self.delete(resource, tokens)
+        result = {'resource': resource, 'items': seen, 'changed': changed_count, 'removed': len(tokens),
+                  'seconds': round(time.perf_counter() - start, 3)}
+        with self._lock, self.db:
+            self.db.execute('INSERT INTO refresh_log VALUES (?, ?, ?, ?, ?, ?)',
+                            (resource, time.time(), seen, changed_count, len(tokens), result['seconds']))
+        return result
+
+    def refresh_all(self, **kwargs):
+        return [self.refresh(resource, **kwargs) for resource in RESOURCES]
+
+    def refresh_connection(self, connection_id):
+        """Refetches a single connection, e.g. after a sync was triggered outside of this process."""
+        resp = self.ft.call_api('GET', f'connections/{connection_id}')
+        if resp is not None:
+            self.upsert('connections', [resp['data']])
+
+    def on_mutation(self, method, endpoint, payload, response):
+        """fivetranapi.connect listener keeping the mirror in step with mutations made through it."""
+        parts = endpoint.split('/')
+        resource = _MUTATIONS.get(parts[0])
+        if resource is None:
+            return
+        if len(parts) == 1:
+            if method == 'POST' and response and isinstance(response.get('data'), dict) and 'id' in response['data']:
+                self.upsert(resource, [response['data']])
+            return
+        item_id = parts[1]
+        if method == 'DELETE' and len(parts) == 2:
+            self.delete(resource, [item_id])
+        elif response and isinstance(response.get('data'), dict) and response['data'].get('id') == item_id:
+            self.upsert(resource, [response['data']])
+        elif self.ft is not None and resource == 'connections':
+            # e.g. sync/resync calls answer without the connection, read it back
+            self.refresh_connection(item_id)
+
+    def query(self, sql, params=()):
+        with self._lock:
+            cur = self.db.execute(sql, params)
+            columns = [column[0] for column in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    def _where(self, resource, criteria):
+        columns = RESOURCES[resource]['columns']
+        for column in criteria:
+            if column != 'id' and column not in columns:
+                raise ValueError(f'No column {column} on {resource}, available: {", ".join(columns)}')
+        return ' AND '.join(f'"{column}" = ?' for column in criteria) or '1 = 1'
+
+    def find(self, resource, **criteria):
+        """Models of a resource filtered on its indexed columns, e.g. find('connections', group_id='g', paused=1)."""
+        where = self._where(resource, criteria)
+        with self._lock:
+            rows = self.db.execute(f'SELECT json FROM {resource} WHERE {where}', tuple(criteria.values())).fetchall()
+        model = RESOURCES[resource]['model']
+        return [model(json.loads(row[0])) for row in rows]
+
+    def count(self, resource, **criteria):
+        where = self._where(resource, criteria)
+        with self._lock:
+            return self.db.execute(f'SELECT COUNT(*) FROM {resource} WHERE {where}', tuple(criteria.values())).fetchone()[0]
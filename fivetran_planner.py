@@ -0,0 +1,291 @@
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+from fivetran_templates import BLOB_FIELDS, DATABASE_FIELDS, PayloadTemplate
+from logger import _logger
+
+# Desired-state provisioning of connectors in a destination group.
+# The desired connectors are rendered from a payload template (fivetran_templates, one per blob
+# file or facility database) and matched against the current connections of the group through a
+# key hashed from service, schema and table. A second hash over the fields the template manages (file pattern,
+# schedule, pause state, non secret config) tells whether a matched connector needs an update.
+# The plan lists the creates, updates and deletes (deletes only with prune=True, and only of
+# connections in scope of the template), apply() runs them concurrently and a re-run of an
+# applied plan is empty. The diff is dictionary lookups and only changed connectors cost API calls.
+
+# fields never compared or patched: secrets are not returned by the API, the rest are create-only
+SECRET_FIELDS = frozenset(('password', 'connection_string', 'pgp_pass_phrase', 'pgp_secret_key', 'secret_key',
+                           'private_key', 'client_secret', 'tenant_id'))
+CREATE_ONLY_FIELDS = frozenset(('group_id', 'service', 'trust_certificates', 'trust_fingerprints', 'run_setup_tests',
+                                'schema', 'table', 'schema_prefix', 'database'))
+MANAGED_FIELDS = ('paused', 'pause_after_trial', 'sync_frequency', 'data_delay_sensitivity', 'data_delay_threshold',
+                  'daily_sync_time', 'schedule_type')
+
+def destination_schema(payload):
+    """Name of the destination schema (or schema.table for file connectors) a payload creates,
+    as the API reports it in the schema field of a connection."""
+    config = payload.get('config', {})
+    if config.get('schema_prefix'):
+        return config['schema_prefix'].lower()
+    if config.get('table'):
+        return f"{config.get('schema')}.{config['table']}".lower()
+    return (config.get('schema') or '').lower()
+
+def connector_key(service, schema):
+    return hashlib.sha1(f'{service}\x00{schema.lower()}'.encode('utf-8')).hexdigest()
+
+def _normalize(value):
+    # payload templates carry 'True'/'False' strings where the API answers booleans
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return value.lower()
+    return value if isinstance(value, (dict, list)) else str(value)
+
+def managed_state(payload):
+    """The fields of a payload that an update can change, normalized for comparison."""
+    state = {field: _normalize(payload[field]) for field in MANAGED_FIELDS if field in payload}
+    config = payload.get('config', {})
+    state['config'] = {key: _normalize(value) for key, value in config.items()
+                       if key not in SECRET_FIELDS and key not in CREATE_ONLY_FIELDS}
+    return state
+
+def state_hash(state):
+    return hashlib.sha1(json.dumps(state, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def _template(template, varying):
+    # plain payload dicts are accepted as well as precompiled templates
+    return template if isinstance(template, PayloadTemplate) else PayloadTemplate(template, varying)
+
+_BLOB_NAME = re.compile(r'^FL_[A-Z0-9]+_(?P<system>[A-Z0-9]+_[A-Z0-9]+)_FILE_(?P<table>.+?)(?:_MD|_TD)?$', re.IGNORECASE)
+
+def blob_table_name(file_name):
+    """Destination table of a blob file: FL_GSCSCM_NLC_ECC_FILE_A581_TD.tsv -> nlc_ecc_a581."""
+    base = os.path.splitext(os.path.basename(file_name))[0]
+    match = _BLOB_NAME.match(base)
+    name = f"{match.group('system')}_{match.group('table')}" if match else base
+    return name.lower()
+
+class DesiredConnector:
+    def __init__(self, payload, source=None):
+        self.payload = payload
+        self.source = source
+        self.service = payload.get('service')
+        self.schema = destination_schema(payload)
+        self.key = connector_key(self.service, self.schema)
+        self.state = managed_state(payload)
+        self.hash = state_hash(self.state)
+
+    def __repr__(self):
+        return f"DesiredConnector({self.schema!r}, source={self.source!r})"
+
+def desired_from_blobs(file_names, template, table_name=blob_table_name):
+    """One blob connector per file (e.g. AzureStorageReader.list_files_in_folder()), folder
+    entries without an extension are skipped. The file name becomes the pattern."""
+    template = _template(template, BLOB_FIELDS)
+    files = [name for name in file_names if os.path.splitext(os.path.basename(name.rstrip('/')))[1]]
+    payloads = template.render_many({'table': table_name(name), 'pattern': os.path.basename(name)} for name in files)
+    return [DesiredConnector(payload, name) for name, payload in zip(files, payloads)]
+
+def desired_from_facilities(active_facilities, template):
+    """One database connector per active facility (facilities_helper.fetch_active_facilities())."""
+    template = _template(template, DATABASE_FIELDS)
+    facilities = [(key, facility['dbname']) for key, facility in active_facilities.items() if facility.get('dbname')]
+    payloads = template.render_many({'database': dbname, 'schema_prefix': key.lower()} for key, dbname in facilities)
+    return [DesiredConnector(payload, dbname) for (key, dbname), payload in zip(facilities, payloads)]
+
+class PlanAction:
+    """One step of a plan: action is create, update or delete; status is planned, succeeded or failed."""
+    def __init__(self, action, schema, connector_id=None, payload=None, source=None, changes=None):
+        self.action = action
+        self.schema = schema
+        self.connector_id = connector_id
+        self.payload = payload
+        self.source = source
+        self.changes = changes
+        self.status = 'planned'
+        self.latency = 0.0
+        self.error = None
+
+    def describe(self):
+        if self.action == 'create':
+            return f"+ create {self.schema} ({self.source})"
+        if self.action == 'update':
+            return f"~ update {self.schema} ({self.connector_id}): {json.dumps(self.changes, sort_keys=True, default=str)}"
+        return f"- delete {self.schema} ({self.connector_id})"
+
+    def __repr__(self):
+        return f"PlanAction({self.action!r}, {self.schema!r}, {self.status!r})"
+
+class Plan:
+    def __init__(self, group_id, actions, unchanged):
+        self.group_id = group_id
+        self.actions = actions
+        self.unchanged = unchanged
+
+    def by_action(self, action):
+        return [step for step in self.actions if step.action == action]
+
+    @property
+    def creates(self):
+        return self.by_action('create')
+
+    @property
+    def updates(self):
+        return self.by_action('update')
+
+    @property
+    def deletes(self):
+        return self.by_action('delete')
+
+    def __len__(self):
+        return len(self.actions)
+
+    def describe(self):
+        lines = [f"Plan for group {self.group_id}: {len(self.creates)} to create, {len(self.updates)} to update, "
+                 f"{len(self.deletes)} to delete, {self.unchanged} unchanged"]
+        lines.extend(step.describe() for step in self.actions)
+        return '\n'.join(lines)
+
+    def summary(self):
+        return {'group_id': self.group_id, 'create': len(self.creates), 'update': len(self.updates),
+                'delete': len(self.deletes), 'unchanged': self.unchanged,
+                'succeeded': sum(step.status == 'succeeded' for step in self.actions),
+                'failed': sum(step.status == 'failed' for step in self.actions)}
+
+def _project(item, desired_state):
+    """The current item reduced to the fields the desired state manages, normalized alike."""
+    state = {field: _normalize(item.get(field)) for field in desired_state if field != 'config'}
+    config = item.get('config') or {}
+    state['config'] = {key: _normalize(config.get(key)) for key in desired_state['config']}
+    return state
+
+def _patch(desired_state, current_state, desired_payload):
+    """Only the managed fields that differ, with the values as the template has them."""
+    patch = {field: desired_payload[field] for field in MANAGED_FIELDS
+             if field in desired_state and desired_state[field] != current_state.get(field)}
+    current_config = current_state.get('config', {})
+    config = {key: desired_payload['config'][key] for key, value in desired_state['config'].items()
+              if value != current_config.get(key)}
+    if config:
+        patch['config'] = config
+    return patch
+
+class ConnectorPlanner:
+    def __init__(self, ft, group_id, page_size=1000):
+        self.ft = ft
+        self.group_id = group_id
+        self.page_size = page_size
+        self.logger = _logger('DEBUG', 'ConnectorPlanner')
+
+    def current(self):
+        """Raw items of the connections in the group, one listing."""
+        return (item for items in self.ft.iter_pages(f'groups/{self.group_id}/connections', self.page_size, prefetch=True)
+                for item in items)
+
+    def plan(self, desired, current=None, prune=False, in_scope=None):
+        """Diff of desired connectors against the current ones (raw dicts or models of the group,
+        listed from the API when not given). With prune, current connections of the same
+        services that are in scope and not desired are deleted; in_scope(item) defaults to the
+        destination schema of file connectors and the schema prefix of database ones."""
+        desired = {spec.key: spec for spec in desired}
+        if current is None:
+            current = self.current()
+        services = {spec.service for spec in desired.values()}
+        if in_scope is None:
+            in_scope = self._default_scope(desired.values())
+        actions, unchanged, seen = [], 0, set()
+        for item in current:
+            if not isinstance(item, dict):
+                item = item._json
+            if item.get('group_id', self.group_id) != self.group_id:
+                continue
+            key = connector_key(item.get('service'), item.get('schema') or '')
+            spec = desired.get(key)
+            if spec is None:
+                if prune and item.get('service') in services and in_scope(item):
+                    actions.append(PlanAction('delete', item.get('schema'), item['id']))
+                continue
+            seen.add(key)
+            current_state = _project(item, spec.state)
+            if state_hash(current_state) == spec.hash:
+                unchanged += 1
+                continue
+            changes = _patch(spec.state, current_state, spec.payload)
+            actions.append(PlanAction('update', spec.schema, item['id'], changes, spec.source, changes))
+        for key, spec in desired.items():
+            if key not in seen:
+                actions.append(PlanAction('create', spec.schema, payload=spec.payload, source=spec.source))
+        return Plan(self.group_id, actions, unchanged)
+
+    @staticmethod
+    def _default_scope(desired):
+        schemas, prefixes = set(), set()
+        for spec in desired:
+            config = spec.payload.get('config', {})
+            if config.get('table'):
+                schemas.add((config.get('schema') or '').lower())
+            elif config.get('schema_prefix'):
+                # cip_prd_sql_0000000039_system -> cip_prd_sql_
+                prefixes.add(re.sub(r'[0-9].*$', '', config['schema_prefix'].lower()))
+        def in_scope(item):
+            schema = (item.get('schema') or '').lower()
+            if '.' in schema:
+                return schema.split('.', 1)[0] in schemas
+            return any(prefix and schema.startswith(prefix) for prefix in prefixes)
+        return in_scope
+
+    def _run(self, step):
+        start = time.perf_counter()
+        try:
+            if step.action == 'create':
+                response = self.ft.create_connector(step.payload)
+                step.connector_id = response['data']['id'] if response else None
+            elif step.action == 'update':
+                self.ft.update_connector(step.connector_id, step.payload)
+            else:
+                try:
+                    self.ft.delete_connector(step.connector_id)
+                except requests.exceptions.HTTPError as e:
+                    # already gone, the delete is done
+                    if e.response is None or e.response.status_code != 404:
+                        raise
+            step.status = 'succeeded'
+        except Exception as e:
+            step.status, step.error = 'failed', e
+        step.latency = time.perf_counter() - start
+        return step
+
+    def apply(self, plan, max_workers=8, dry_run=False, progress=None):
+        """Runs the planned steps concurrently, or with dry_run only logs the plan. Steps already
+        succeeded (a re-applied plan) are skipped. Returns the plan with statuses filled in."""
+        self.logger.info('%s', plan.describe())
+        if dry_run:
+            return plan
+        steps = [step for step in plan.actions if step.status != 'succeeded']
+        # a deadline of the calling thread covers the workers too
+        deadline = self.ft.current_deadline()
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='plan') as executor:
+            pending = set()
+            for step in steps:
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._finished(future.result(), progress)
+                pending.add(executor.submit(self.ft.within_deadline, deadline, self._run, step))
+            for future in wait(pending).done:
+                self._finished(future.result(), progress)
+        self.logger.info('Plan applied: %s', plan.summary())
+        return plan
+
+    def _finished(self, step, progress):
+        if step.status == 'failed':
+            self.logger.error('%s failed: %s', step.describe(), step.error)
+        else:
+            self.logger.info('%s done in %.2fs', step.describe(), step.latency)
+        if progress is not None:
+            progress(step)
@@ -0,0 +1,153 @@
+import random
+import threading
+import time
+from collections import Counter
+import requests
+
+# Retry, circuit breaker and deadline handling for the Fivetran API client.
+# GET, PATCH and DELETE are idempotent and retried on transient failures. POST is only retried
+# when the API cannot have processed the request (connect timeout, 429) unless the caller passes a
+# dedupe guard that finds the result of an earlier attempt. A per-host circuit breaker fails fast
+# once the API looks down, and a Deadline bounds the total time of a bulk operation.
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without calling the API while the circuit breaker of the host is open."""
+
+class DeadlineExceeded(requests.exceptions.RequestException):
+    """Raised when the deadline budget of a bulk operation is used up."""
+
+class Deadline:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def cap(self, timeout):
+        """Shrinks a (connect, read) timeout so a single attempt cannot outlive the deadline."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f'Deadline of {self.seconds}s exceeded')
+        if isinstance(timeout, tuple):
+            return tuple(min(t, remaining) for t in timeout)
+        return min(timeout, remaining)
+
+class CircuitBreaker:
+    def __init__(self, host, failure_threshold=5, recovery_timeout=30.0, probe_timeout=60.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        # a probe without an outcome after probe_timeout is given up and another one let through
+        self.probe_timeout = probe_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpenError while the circuit is open. Returns True when this call is the
+        probe of a half open circuit, its caller then owes an outcome or release_probe()."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'open':
+                if now - self.opened_at < self.recovery_timeout:
+                    raise CircuitOpenError(f'Circuit open for {self.host} after {self.failures} consecutive failures')
+                # let a single probe through, its outcome closes or re-opens the circuit
+                self.state = 'half_open'
+            elif self.state == 'half_open':
+                if now - self.probe_started < self.probe_timeout:
+                    raise CircuitOpenError(f'Circuit half open for {self.host}, waiting for probe request')
+                # the probe was lost (its caller hung or died), let another one through
+            else:
+                return False
+            self.probe_started = now
+            return True
+
+    def release_probe(self):
+        """Gives up the probe slot without an outcome, the next call probes again."""
+        with self._lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+                self.opened_at = time.monotonic() - self.recovery_timeout
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures}
+
+def _status(exc):
+    response = getattr(exc, 'response', None)
+    return response.status_code if response is not None else None
+
+def is_server_failure(exc):
+    """Failures that say something about the health of the host, as opposed to a bad request."""
+    status = _status(exc)
+    if status is not None:
+        return status >= 500
+    return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+def was_not_processed(exc):
+    """True when the API cannot have acted on the request, so even a POST is safe to resend."""
+    return _status(exc) == 429 or isinstance(exc, requests.exceptions.ConnectTimeout)
+
+class RetryPolicy:
+    def __init__(self, max_retries=4, backoff_base=0.5, backoff_max=30.0,
+                 retry_statuses=(429, 500, 502, 503, 504), idempotent_methods=('GET', 'PATCH', 'DELETE'),
+                 failure_threshold=5, recovery_timeout=30.0, probe_timeout=60.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = set(retry_statuses)
+        self.idempotent_methods = set(idempotent_methods)
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.probe_timeout = probe_timeout
+        self._breakers = {}
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def breaker(self, host):
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(host, self.failure_threshold, self.recovery_timeout, self.probe_timeout)
+            return self._breakers[host]
+
+    def is_retryable(self, method, exc, has_dedupe=False):
+        if isinstance(exc, (CircuitOpenError, DeadlineExceeded)):
+            return False
+        status = _status(exc)
+        if status is not None and status not in self.retry_statuses:
+            return False
+        if status is None and not isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return False
+        return method in self.idempotent_methods or has_dedupe or was_not_processed(exc)
+
+    def backoff(self, attempt):
+        # full jitter: uniform in [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def record(self, method, outcome):
+        with self._lock:
+            self._counts[(method, outcome)] += 1
+
+    def stats(self):
+        with self._lock:
+            counts = {f'{method} {outcome}': count for (method, outcome), count in sorted(self._counts.items())}
+            breakers = list(self._breakers.values())
+        return {'counts': counts, 'breakers': {b.host: b.stats() for b in breakers}}
@@ -0,0 +1,409 @@
+import argparse
+import bisect
+import itertools
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Fivetran REST API, used to measure and regression-test the client without
+# hitting production. Implements the endpoints used by fivetranapi.connect over an in-memory
+# synthetic account of any size: account info, connections (also per group), groups, destinations,
+# users, private links, hybrid deployment agents, connector metadata and connector create, update,
+# delete, sync and resync. Lists are cursor paginated, every response can be delayed by a fixed
+# latency plus jitter, and a share of requests can be answered with 429 (with Retry-After) or 5xx.
+# Triggered syncs run for sync_duration seconds before succeeded_at moves.
+# Speaks HTTP/1.1 so keep-alive connections from a pooled session are actually reused.
+#
+# In-process:  with stub_server(connections_count=10000, latency=0.02) as server: server.base_url
+# Subprocess:  python fivetran_stub_server.py --port 8765 --connections 10000 --latency 0.02
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def synthetic_connection(i, group_id='stub_group'):
+    """A connection item shaped like the list-connections response of the API."""
+    return {
+        'id': f'connection_{i:07d}', 'group_id': group_id, 'service': 'azure_sql_db',
+        'service_version': 1, 'schema': f'cip_prd_sql_{i:010d}_system', 'connected_by': 'stub_user',
+        'created_at': '2024-01-01T00:00:00.000000Z', 'succeeded_at': '2024-06-01T14:05:00.000000Z',
+        'failed_at': None, 'paused': False, 'pause_after_trial': False, 'sync_frequency': 1440,
+        'data_delay_threshold': 0, 'data_delay_sensitivity': 'NORMAL', 'daily_sync_time': '14:00',
+        'schedule_type': 'auto', 'networking_method': 'PrivateLink', 'private_link_id': None, 'proxy_agent_id': None,
+        'status': {'setup_state': 'connected', 'sync_state': 'scheduled', 'update_state': 'on_schedule',
+                   'is_historical_sync': False, 'tasks': [], 'warnings': []},
+        'setup_tests': [{'title': 'Connecting to database', 'status': 'PASSED', 'message': ''}],
+        'config': {'database': f'{i:010d}_System', 'host': 'windowssqlserver.privatelink.database.windows.net',
+                   'port': 1433, 'user': 'test_user', 'update_method': 'NATIVE_UPDATE',
+                   'connection_type': 'PrivateLink', 'always_encrypted': True, 'auth_method': 'Password',
+                   'schema_prefix': f'cip_prd_sql_{i:010d}_system'},
+        'source_sync_details': {'last_synced_change_tracking_version': i},
+    }
+
+def synthetic_group(i):
+    return {'id': f'group_{i:05d}', 'name': f'STUB_GROUP_{i:05d}', 'created_at': '2024-01-01T00:00:00.000000Z'}
+
+def synthetic_destination(i):
+    return {'id': f'group_{i:05d}', 'group_id': f'group_{i:05d}', 'service': 'big_query', 'region': 'AZURE_EASTUS2',
+            'networking_method': 'Directly', 'setup_status': 'connected', 'daylight_saving_time_enabled': True,
+            'private_link_id': None, 'time_zone_offset': '-5'}
+
+def synthetic_user(i):
+    return {'id': f'user_{i:05d}', 'email': f'user{i}@example.com', 'verified': True, 'invited': False,
+            'picture': None, 'phone': None, 'role': 'Account Reviewer' if i % 2 else None, 'active': True,
+            'given_name': f'Given{i}', 'created_at': '2024-01-01T00:00:00.000000Z', 'family_name': f'Family{i}',
+            'logged_in_at': '2024-06-01T00:00:00.000000Z'}
+
+def synthetic_private_link(i):
+    return {'id': f'private_link_{i:04d}', 'name': f'stub_link_{i}', 'region': 'AZURE_EASTUS2', 'service': 'SOURCE_AZURE',
+            'state': 'CREATED', 'account_id': 'stub_account', 'created_at': '2024-01-01T00:00:00.000000Z',
+            'created_by': 'stub_user', 'cloud_provider': 'AZURE', 'state_summary': 'ok',
+            'config': {'connection_service_id': f'/subscriptions/stub/{i}'}}
+
+def synthetic_agent(i):
+    return {'id': f'agent_{i:04d}', 'display_name': f'stub_agent_{i}', 'group_id': f'group_{i:05d}',
+            'registered_at': '2024-01-01T00:00:00.000000Z', 'usage': []}
+
+def _copy(data):
+    # responses are serialized from a copy, items may be mutated by concurrent requests
+    return json.loads(json.dumps(data))
+
+class stub_account():
+    """In-memory state of a synthetic account. Connections are spread round robin over the groups."""
+    def __init__(self, connections_count=0, groups_count=1, users_count=10, private_links_count=2,
+                 agents_count=1, sync_duration=1.0):
+        self.lock = threading.Lock()
+        self.sync_duration = sync_duration
+        self.collections = {
+            'groups': {item['id']: item for item in map(synthetic_group, range(max(1, groups_count)))},
+            'users': {item['id']: item for item in map(synthetic_user, range(users_count))},
+            'private-links': {item['id']: item for item in map(synthetic_private_link, range(private_links_count))},
+            'hybrid-deployment-agents': {item['id']: item for item in map(synthetic_agent, range(agents_count))},
+        }
+        self.collections['destinations'] = {
+            item['id']: item for item in map(synthetic_destination, range(len(self.collections['groups'])))}
+        group_ids = sorted(self.collections['groups'])
+        self.collections['connections'] = {
+            item['id']: item for item in (synthetic_connection(i, group_ids[i % len(group_ids)]) for i in range(connections_count))}
+        # sorted ids per collection, the cursor is the last id returned so paging survives creates and deletes
+        self.order = {name: sorted(items) for name, items in self.collections.items()}
+        self.next_id = itertools.count(connections_count)
+        # connection id -> monotonic time its running sync finishes
+        self.syncing = {}
+
+    def page(self, name, limit, cursor, predicate=None):
+        with self.lock:
+            self._finish_syncs()
+            order = self.order[name]
+            position = bisect.bisect_right(order, cursor) if cursor else 0
+            items = []
+            while position < len(order) and len(items) < limit:
+                item = self.collections[name][order[position]]
+                if predicate is None or predicate(item):
+                    items.append(item)
+                position += 1
+            data = {'items': items}
+            if position < len(order):
+                data['next_cursor'] = order[position - 1]
+            return _copy(data)
+
+    def get(self, name, item_id):
+        with self.lock:
+            self._finish_syncs()
+            item = self.collections[name].get(item_id)
+            return _copy(item) if item is not None else None
+
+    def create(self, name, item):
+        with self.lock:
+            self.collections[name][item['id']] = item
+            bisect.insort(self.order[name], item['id'])
+            return _copy(item)
+
+    def update(self, name, item_id, payload):
+        with self.lock:
+            item = self.collections[name].get(item_id)
+            if item is None:
+                return None
+            for key, value in payload.items():
+                if key == 'config' and isinstance(value, dict):
+                    item.setdefault('config', {}).update(value)
+                else:
+                    item[key] = value
+            return _copy(item)
+
+    def delete(self, name, item_id):
+        with self.lock:
+            if self.collections[name].pop(item_id, None) is None:
+                return False
+            order = self.order[name]
+            del order[bisect.bisect_left(order, item_id)]
+            self.syncing.pop(item_id, None)
+            return True
+
+    def start_sync(self, connection_id):
+        with self.lock:
+            item = self.collections['connections'].get(connection_id)
+            if item is None:
+                return False
+            item['status']['sync_state'] = 'syncing'
+            self.syncing[connection_id] = time.monotonic() + self.sync_duration
+            return True
+
+    def _finish_syncs(self):
+        now = time.monotonic()
+        for connection_id, finishes in list(self.syncing.items()):
+            if finishes <= now:
+                item = self.collections['connections'][connection_id]
+                item['status']['sync_state'] = 'scheduled'
+                item['succeeded_at'] = _now()
+                del self.syncing[connection_id]
+
+class _handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, without this Nagle + delayed ACK adds ~40ms per reused connection
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # keep benchmark output clean
+        pass
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _ok(self, data, status=200):
+        self._send(status, {'code': 'Success', 'data': data})
+
+    def _not_found(self, path):
+        self._send(404, {'code': 'NotFound', 'message': f'No stub for {path}'})
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _inject(self):
+        """Applies the configured latency and faults, True when the request has been answered."""
+        server = self.server
+        with server.counter_lock:
+            server.requests += 1
+        delay = server.latency + (random.uniform(0, server.jitter) if server.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        roll = random.random()
+        if roll < server.error_429 + server.error_5xx:
+            # read the unused body, on a keep-alive connection it would be parsed as the next request
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                self.rfile.read(length)
+        if roll < server.error_429:
+            self._send(429, {'code': 'TooManyRequests', 'message': 'Rate limit exceeded'},
+                       {'Retry-After': str(server.retry_after)})
+            return True
+        if roll < server.error_429 + server.error_5xx:
+            self._send(random.choice((500, 502, 503)), {'code': 'ServerError', 'message': 'Injected failure'})
+            return True
+        return False
+
+    def _route(self):
+        parts = urlsplit(self.path)
+        segments = [s for s in parts.path.split('/') if s]
+        if segments and segments[0] == 'v1':
+            segments = segments[1:]
+        # connectors is the older name of the connections resource
+        if segments and segments[0] == 'connectors':
+            segments[0] = 'connections'
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        return parts.path, segments, query
+
+    def do_GET(self):
+        if self._inject():
+            return
+        path, segments, query = self._route()
+        account = self.server.account
+        limit = min(int(query.get('limit', 100)), 1000)
+        cursor = query.get('cursor')
+        if segments == ['account', 'info']:
+            self._ok({'account_id': 'stub_account', 'account_name': 'Stub Account',
+                      'system_key_id': 'stub_key', 'user_id': 'stub_user'})
+        elif len(segments) == 1 and segments[0] in account.collections:
+            predicate = None
+            if segments[0] == 'connections' and 'group_id' in query:
+                group_id = query['group_id']
+                predicate = lambda item: item['group_id'] == group_id
+            self._ok(account.page(segments[0], limit, cursor, predicate))
+        elif len(segments) == 3 and segments[0] == 'groups' and segments[2] == 'connections':
+            group_id = segments[1]
+            if account.get('groups', group_id) is None:
+                return self._not_found(path)
+            self._ok(account.page('connections', limit, cursor, lambda item: item['group_id'] == group_id))
+        elif len(segments) == 2 and segments[0] in account.collections:
+            item = account.get(segments[0], segments[1])
+            if item is None:
+                return self._not_found(path)
+            self._ok(item)
+        elif segments == ['metadata', 'connector-types']:
+            self._ok({'items': [{'id': service, 'name': service, 'type': 'Database'}
+                                for service in ('azure_sql_db', 'azure_blob_storage', 'sql_server')]})
+        elif len(segments) == 3 and segments[:2] == ['metadata', 'connector-types']:
+            self._ok({'id': segments[2], 'config': {'properties': {
+                'host': {'type': 'string'}, 'port': {'type': 'integer'},
+                'database': {'type': 'string'}, 'table': {'type': 'string'}}}})
+        else:
+            self._not_found(path)
+
+    def do_POST(self):
+        if self._inject():
+            return
+        path, segments, query = self._route()
+        account = self.server.account
+        payload = self._read_json()
+        if segments == ['connections']:
+            item = synthetic_connection(next(account.next_id), payload.get('group_id', 'group_00000'))
+            config = payload.get('config', {})
+            item.update({key: value for key, value in payload.items()
+                         if key not in ('config', 'trust_certificates', 'trust_fingerprints', 'run_setup_tests')})
+            item['config'] = config
+            if config.get('schema_prefix'):
+                item['schema'] = config['schema_prefix']
+            elif config.get('table'):
+                item['schema'] = f"{config.get('schema')}.{config['table']}"
+            item['created_at'] = _now()
+            self._ok(account.create('connections', item), 201)
+        elif len(segments) == 3 and segments[0] == 'connections' and segments[2] in ('sync', 'resync'):
+            if not account.start_sync(segments[1]):
+                return self._not_found(path)
+            self._send(200, {'code': 'Success', 'message': f'Sync has been triggered for connection {segments[1]}'})
+        elif segments == ['private-links']:
+            item = synthetic_private_link(next(account.next_id))
+            item.update(payload)
+            self._ok(account.create('private-links', item), 201)
+        else:
+            self._not_found(path)
+
+    def do_PATCH(self):
+        if self._inject():
+            return
+        path, segments, query = self._route()
+        if len(segments) != 2 or segments[0] not in self.server.account.collections:
+            return self._not_found(path)
+        item = self.server.account.update(segments[0], segments[1], self._read_json())
+        if item is None:
+            return self._not_found(path)
+        self._ok(item)
+
+    def do_DELETE(self):
+        if self._inject():
+            return
+        path, segments, query = self._route()
+        if len(segments) != 2 or segments[0] not in self.server.account.collections:
+            return self._not_found(path)
+        if not self.server.account.delete(segments[0], segments[1]):
+            return self._not_found(path)
+        self._send(200, {'code': 'Success', 'message': f'{segments[0]} {segments[1]} has been deleted'})
+
+class stub_server():
+    def __init__(self, host='127.0.0.1', port=0, connections_count=0, groups_count=1, users_count=10,
+                 private_links_count=2, agents_count=1, latency=0.0, jitter=0.0, error_429=0.0, error_5xx=0.0,
+                 retry_after=1, sync_duration=1.0):
+        self.httpd = ThreadingHTTPServer((host, port), _handler)
+        self.httpd.daemon_threads = True
+        self.httpd.account = stub_account(connections_count, groups_count, users_count, private_links_count,
+                                          agents_count, sync_duration)
+        self.httpd.latency = latency
+        self.httpd.jitter = jitter
+        self.httpd.error_429 = error_429
+        self.httpd.error_5xx = error_5xx
+        self.httpd.retry_after = retry_after
+        self.httpd.requests = 0
+        self.httpd.counter_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    @property
+    def account(self):
+        return self.httpd.account
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+class subprocess_stub_server():
+    """Runs the stand-in in its own interpreter so it does not compete with the measured client for
+    the GIL. Takes the keyword arguments of stub_server, except host."""
+    def __init__(self, **kwargs):
+        self.args = [sys.executable, __file__, '--port', '0']
+        for key, value in kwargs.items():
+            self.args += ['--' + key.replace('_count', '').replace('_', '-'), str(value)]
+        self.process = None
+        self.base_url = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.args, stdout=subprocess.PIPE, text=True)
+        # the child prints its base url once it is listening
+        self.base_url = self.process.stdout.readline().strip()
+        if not self.base_url:
+            self.process.wait()
+            raise RuntimeError(f'Stub server exited with {self.process.returncode}')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.process.terminate()
+        self.process.wait()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in for the Fivetran REST API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=1)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--private-links', type=int, default=2)
+    parser.add_argument('--agents', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra seconds, up to this value')
+    parser.add_argument('--error-429', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--error-5xx', type=float, default=0.0, help='share of requests answered with 5xx')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--sync-duration', type=float, default=1.0)
+    args = parser.parse_args(argv)
+    server = stub_server(args.host, args.port, args.connections, args.groups, args.users, args.private_links,
+                         args.agents, args.latency, args.jitter, args.error_429, args.error_5xx,
+                         args.retry_after, args.sync_duration)
+    print(server.base_url, flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
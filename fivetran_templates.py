@@ -0,0 +1,114 @@
+import copy
+import threading
+import config_helper
+from logger import _logger
+
+# Precompiled connector payload templates.
+# A template file (config_fivetran_payload.json, config_fivetran_blob_payload.json, ...) is
+# compiled once and again only when config_helper reads the file again (its modification time or
+# size changed). Compiling validates the template against the connector schema of its service,
+# fetched through the client when one is given or stored from an earlier validate(), and logs the
+# problems. render() builds each payload by overlaying only the varying config fields: the result
+# is a new top level dict and a new config dict, every other value is shared with the template, so
+# rendering costs two small dict copies instead of re-reading and re-parsing the file. Rendered
+# payloads share nested values and must be treated as read-only.
+
+# the fields that differ per connector for the two template kinds of this repo
+BLOB_FIELDS = ('table', 'pattern')
+DATABASE_FIELDS = ('database', 'schema_prefix')
+
+class PayloadTemplate:
+    def __init__(self, payload, varying, name=None):
+        if 'config' not in payload:
+            raise ValueError(f'Payload template {name or ""} has no config section')
+        # private copy, renders share its values
+        self.payload = copy.deepcopy(dict(payload))
+        self.config = self.payload['config']
+        self.varying = frozenset(varying)
+        self.name = name
+        self.service = self.payload.get('service')
+        self.group_id = self.payload.get('group_id')
+
+    def render(self, **values):
+        """Payload with the varying config fields set, e.g. render(table='konp', pattern='KONP.tsv')."""
+        unknown = values.keys() - self.varying
+        if unknown:
+            raise ValueError(f'{", ".join(sorted(unknown))} not varying in template {self.name}, '
+                             f'expected {", ".join(sorted(self.varying))}')
+        payload = dict(self.payload)
+        payload['config'] = {**self.config, **values}
+        return payload
+
+    def render_many(self, rows):
+        """Payloads for an iterable of value dicts, checked once against the varying fields."""
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return
+        yield self.render(**first)
+        base, config, varying = self.payload, self.config, self.varying
+        for values in rows:
+            if values.keys() - varying:
+                yield self.render(**values)
+                continue
+            payload = dict(base)
+            payload['config'] = {**config, **values}
+            yield payload
+
+    def validate(self, ft=None, schema=None):
+        """Problems of the template against the connector schema of its service, from
+        metadata/connector-types/{service} (cached by the client's response cache) unless given.
+        Returns a list of messages, empty when the template is valid."""
+        if schema is None:
+            schema = ft.get_connector_schema(self.service)['data']
+            with _lock:
+                _schemas[self.service] = schema
+        properties = schema.get('config', {}).get('properties', {})
+        problems = []
+        if not properties:
+            return problems
+        for key in sorted(self.config.keys() | self.varying):
+            if key not in properties:
+                problems.append(f'config.{key} is not a field of {self.service}')
+        for key in schema.get('config', {}).get('required', ()):
+            if key not in self.config and key not in self.varying:
+                problems.append(f'config.{key} is required by {self.service}')
+        for key, value in self.config.items():
+            expected = properties.get(key, {}).get('type')
+            if expected == 'integer' and not isinstance(value, int) and not (isinstance(value, str) and value.isdigit()):
+                problems.append(f'config.{key} should be an integer, got {value!r}')
+        return problems
+
+logger = _logger('DEBUG', 'fivetran_templates')
+# (filename, varying) -> (parsed file it was compiled from, template)
+_templates = {}
+# service -> connector schema of the last validate() that fetched one
+_schemas = {}
+_lock = threading.RLock()
+
+def _check(template, ft=None):
+    schema = _schemas.get(template.service)
+    if schema is None and ft is None:
+        return
+    try:
+        problems = template.validate(ft, schema)
+    except Exception as e:
+        logger.warning('Payload template %s not validated: %s', template.name, e)
+        return
+    for problem in problems:
+        logger.warning('Payload template %s: %s', template.name, problem)
+
+def load_template(filename, varying, reload=False, ft=None):
+    """The template of a payload file (home directory values overlaid by the working directory
+    and environment ones, as config_helper.config does), compiled and validated again only when
+    the file changed or with reload. ft is the client to fetch the connector schema with."""
+    payload, _ = config_helper.load(filename)
+    key = (filename, tuple(varying))
+    with _lock:
+        cached = _templates.get(key)
+        if cached is not None and cached[0] is payload and not reload:
+            return cached[1]
+        template = PayloadTemplate(payload, varying, filename)
+        _templates[key] = (payload, template)
+        _check(template, ft)
+        return template
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+# Rate limiting for the Fivetran API client.
+# A token bucket whose refill rate is tuned by AIMD: every healthy response raises the rate a little,
+# a 429 cuts it multiplicatively and Retry-After / rate-limit headers pause all callers until the
+# server says it is safe again. One instance can be shared by several connect objects, threads and
+# asyncio tasks.
+
+def _parse_retry_after(value):
+    """Seconds to wait from a Retry-After header, either delta-seconds or an HTTP date."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _parse_reset(value):
+    """Seconds until a rate-limit window resets, accepting delta-seconds or an epoch timestamp."""
+    try:
+        reset = float(value)
+    except (TypeError, ValueError):
+        return None
+    if reset > 1e9:
+        reset -= time.time()
+    return max(0.0, reset)
+
+class AdaptiveThrottler:
+    def __init__(self, rate=10.0, min_rate=0.5, max_rate=50.0, burst=None,
+                 additive_increase=1.0, multiplicative_decrease=0.5, window=60.0):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        # bucket capacity, defaults to one second worth of requests at the current rate
+        self.burst = burst
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        self.window = window
+        self._tokens = self._capacity()
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._sent = deque()
+        self._throttled = 0
+        self._lock = threading.Lock()
+
+    def _capacity(self):
+        return float(self.burst) if self.burst is not None else max(1.0, self.rate)
+
+    def _reserve(self):
+        """Takes a token, possibly going into debt, and returns how long the caller must wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity(), self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1.0
+            wait = max(0.0, -self._tokens / self.rate, self._blocked_until - now)
+            self._sent.append(now + wait)
+            while self._sent and self._sent[0] < now - self.window:
+                self._sent.popleft()
+            return wait
+
+    def acquire(self):
+        """Blocks until the request may be sent, returns the seconds waited."""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def on_response(self, status_code, headers=None):
+        """Feeds a response back into the throttler, headers is any mapping (case-insensitive for requests)."""
+        headers = headers or {}
+        with self._lock:
+            now = time.monotonic()
+            pause = None
+            if status_code == 429:
+                self._throttled += 1
+                self.rate = max(self.min_rate, self.rate * self.multiplicative_decrease)
+                pause = _parse_retry_after(headers.get('Retry-After'))
+                if pause is None:
+                    pause = 1.0 / self.rate
+            else:
+                if status_code < 500:
+                    # additive increase of roughly additive_increase req/s per second of healthy traffic
+                    self.rate = min(self.max_rate, self.rate + self.additive_increase / self.rate)
+                remaining = headers.get('X-RateLimit-Remaining', headers.get('RateLimit-Remaining'))
+                reset = headers.get('X-RateLimit-Reset', headers.get('RateLimit-Reset'))
+                if remaining is not None and reset is not None:
+                    try:
+                        if int(remaining) <= 0:
+                            pause = _parse_reset(reset)
+                    except ValueError:
+                        pass
+            if pause:
+                self._blocked_until = max(self._blocked_until, now + pause)
+                self._tokens = min(self._tokens, 0.0)
+
+    def effective_rate(self):
+        """Requests per second actually released over the last window seconds."""
+        with self._lock:
+            now = time.monotonic()
+            while self._sent and self._sent[0] < now - self.window:
+                self._sent.popleft()
+            if not self._sent:
+                return 0.0
+            elapsed = max(now - self._sent[0], 1.0)
+            return len(self._sent) / elapsed
+
+    def stats(self):
+        effective_rate = self.effective_rate()
+        with self._lock:
+            return {
+                'rate': round(self.rate, 3),
+                'effective_rate': round(effective_rate, 3),
+                'throttled': self._throttled,
+                'blocked_for': round(max(0.0, self._blocked_until - time.monotonic()), 3),
+            }
@@ -1,20 +1,88 @@
 import re
+import time
+from datetime import datetime, timezone
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from config_helper import config
 from facilities_helper import facilities_helper
 import fivetranapi
 import colorama
 from colorama import Fore, Back, Style
-import time
-import random
 from logger import _logger
 from readfiles_container import AzureStorageReader
+from fivetran_watcher import SyncWatcher
+from fivetran_templates import BLOB_FIELDS, DATABASE_FIELDS, load_template
+from fivetran_planner import ConnectorPlanner, desired_from_blobs, desired_from_facilities
+
+class BulkItemResult:
+    """Outcome of a bulk action on one connector: status is succeeded, failed or skipped."""
+    def __init__(self, connector_id, schema, status, latency=0.0, response=None, error=None):
+        self.connector_id = connector_id
+        self.schema = schema
+        self.status = status
+        self.latency = latency
+        self.response = response
+        self.error = error
+
+    def __repr__(self):
+        return f"BulkItemResult({self.connector_id!r}, {self.status!r}, latency={self.latency:.3f})"
+
+class BulkReport:
+    def __init__(self, action):
+        self.action = action
+        self.results = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, result):
+        self.results.append(result)
+
+    def by_status(self, status):
+        return [result for result in self.results if result.status == status]
+
+    @property
+    def succeeded(self):
+        return self.by_status('succeeded')
+
+    @property
+    def failed(self):
+        return self.by_status('failed')
+
+    @property
+    def skipped(self):
+        return self.by_status('skipped')
+
+    def summary(self):
+        latencies = sorted(result.latency for result in self.results if result.status != 'skipped')
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3) if latencies else None
+        return {
+            'action': self.action, 'total': len(self.results), 'succeeded': len(self.succeeded),
+            'failed': len(self.failed), 'skipped': len(self.skipped), 'seconds': round(self.elapsed, 3),
+            'latency_p50': pct(0.5), 'latency_p95': pct(0.95),
+        }
+
+def _is_paused(conn):
+    return str(conn.paused).lower() == 'true'
+
+# action name -> (reason to skip a connector or None, call performing the action)
+BULK_ACTIONS = {
+    'pause': (lambda conn: 'already paused' if _is_paused(conn) else None,
+              lambda ft, conn: ft.update_connector(conn.id, {'paused': True})),
+    'resume': (lambda conn: 'not paused' if not _is_paused(conn) else None,
+               lambda ft, conn: ft.update_connector(conn.id, {'paused': False})),
+    'delete': (lambda conn: None,
+               lambda ft, conn: ft.delete_connector(conn.id)),
+    'resync': (lambda conn: 'paused' if _is_paused(conn) else None,
+               lambda ft, conn: ft.resync_connector(conn.id)),
+}
 
 class FivetranUtils:    
-    def __init__(self):
+    # ftapiconnxn replaces the default client, e.g. one pointed at the local stub server
+    def __init__(self, ftapiconnxn=None):
         self.logger = _logger('DEBUG', 'FivetranUtils')
         self.api_key = 'key'
         self.api_secret = 'secret'
-        self.ftapiconnxn = fivetranapi.connect(self.api_key, self.api_secret)
+        self.ftapiconnxn = ftapiconnxn if ftapiconnxn is not None else fivetranapi.connect(self.api_key, self.api_secret)
 
     # function to create fivetran connectors for all facilities
     # replaces the values of the database and schema_prefix in the config_fivetran_payload.json file
@@ -35,7 +103,6 @@ class FivetranUtils:
             for key, facility in active_facilities.items():
                 
                 dbname = facility.get('dbname')
-                time.sleep(random.uniform(2, 3))
                 if not dbname:
                     self.logger.info(f"Skipping database {dbname}. No database name found for facility {key}. Skipping.")
                     continue
@@ -45,57 +112,127 @@ class FivetranUtils:
             self.logger.error(f"Error: {e}")
     
     
-    def disable_enable_connectors_by_destination(self, group_id, status):
+    # pause (status "True") or resume (status "False") every connector of a destination
+    def disable_enable_connectors_by_destination(self, group_id, status, max_workers=8):
+        action = 'pause' if str(status).lower() == 'true' else 'resume'
         try:
-            response = self.ftapiconnxn.get_connections_of_group(group_id)
-            if response is not None and len(response) > 0:
-                for conn in response:
-                    t: fivetranapi.connection  = conn
-                    self.enable_disable_connector(t.schema, t.id, {'paused': 'True'})
-            else:
-                self.logger.info("No response or empty response")
+            return self.bulk_apply(action, group_id=group_id, max_workers=max_workers)
         except Exception as e:
             self.logger.error(e)
             
-    def delete_connectors_by_destination(self, group_id):
+    def delete_connectors_by_destination(self, group_id, max_workers=8):
         try:
-            response = self.ftapiconnxn.get_connections_of_group(group_id)
-            if response is not None and len(response) > 0:
-                for conn in response:
-                    t: fivetranapi.connection  = conn
-                    self.delete_connector(t.id)
-            else:
-                self.logger.info("No response or empty response")
+            return self.bulk_apply('delete', group_id=group_id, max_workers=max_workers)
         except Exception as e:
             self.logger.error(e)
+
+    # connectors selected by destination (group), service, schema prefix and/or an arbitrary predicate
+    def select_connections(self, group_id=None, service=None, schema_prefix=None, predicate=None):
+        if group_id is not None:
+            connections = self.ftapiconnxn.iter_connections_of_group(group_id, limit=1000, prefetch=True)
+        else:
+            connections = self.ftapiconnxn.iter_connections(limit=1000, prefetch=True)
+        for conn in connections:
+            if service is not None and conn.service != service:
+                continue
+            if schema_prefix is not None and not conn.schema.startswith(schema_prefix):
+                continue
+            if predicate is not None and not predicate(conn):
+                continue
+            yield conn
+
+    def _bulk_item(self, skip, run, conn):
+        reason = skip(conn) if skip is not None else None
+        if reason is not None:
+            return BulkItemResult(conn.id, conn.schema, 'skipped', error=reason)
+        start = time.perf_counter()
+        try:
+            response = run(self.ftapiconnxn, conn)
+            return BulkItemResult(conn.id, conn.schema, 'succeeded', time.perf_counter() - start, response)
+        except Exception as e:
+            return BulkItemResult(conn.id, conn.schema, 'failed', time.perf_counter() - start, error=e)
+
+    # runs an action ('pause', 'resume', 'delete', 'resync' or a callable(ftapiconnxn, connection))
+    # concurrently over the selected connectors and yields each result as it completes;
+    # connectors, e.g. a list or ConnectionInventory.find(...), replaces the selector
+    def iter_bulk(self, action, max_workers=8, connectors=None, **selector):
+        if callable(action):
+            skip, run = None, action
+        else:
+            skip, run = BULK_ACTIONS[action]
+        if connectors is None:
+            connectors = self.select_connections(**selector)
+        # a deadline of the calling thread covers the workers too
+        deadline = self.ftapiconnxn.current_deadline()
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bulk') as executor:
+            pending = set()
+            for conn in connectors:
+                # bound the queue so huge selections stream instead of being submitted at once
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(executor.submit(self.ftapiconnxn.within_deadline, deadline, self._bulk_item, skip, run, conn))
+            for future in wait(pending).done:
+                yield future.result()
+
+    def bulk_apply(self, action, max_workers=8, progress=None, connectors=None, **selector):
+        name = action if isinstance(action, str) else getattr(action, '__name__', 'action')
+        report = BulkReport(name)
+        for result in self.iter_bulk(action, max_workers, connectors, **selector):
+            report.add(result)
+            if result.status == 'failed':
+                self.logger.error("%d). %s failed for connector %s (%s): %s", len(report.results), name, result.schema, result.connector_id, result.error)
+            else:
+                self.logger.info("%d). %s %s for connector %s (%s) in %.2fs", len(report.results), name, result.status, result.schema, result.connector_id, result.latency)
+            if progress is not None:
+                progress(result, report)
+        report.elapsed = time.perf_counter() - report.started
+        self.logger.info("Bulk %s finished: %s", name, report.summary())
+        return report
             
     # function to create fivetran connectors for all facilities
     # replaces the values of the database and schema_prefix in the config_fivetran_payload.json file
     # and creates a connector for each facility
-    def blobs_create_connectors(self,files, config_file):
+    # with watch=True waits for the triggered syncs to finish and returns the SyncSummary
+    def blobs_create_connectors(self,files, config_file, watch=False, timeout=None):
         try:
             if files:
                 self.logger.info(f"Total Active Files: {len(files)}")         
             else:
                 self.logger.error("No Files found.")
             counter = 0
+            started_at = datetime.now(timezone.utc)
+            # request pacing is handled by the adaptive throttler of the fivetranapi client
             for file in files:
-                time.sleep(random.uniform(2, 3))
                 file['connector_id'] = self.create_connector_for_blob(file['table_name'].lower(), file['file_name'], config_file,counter)
                 self.resync_connetor(file['connector_id'])
+            if watch:
+                connector_ids = [file['connector_id'] for file in files if file.get('connector_id')]
+                return self.watch_syncs(connector_ids, started_at, timeout=timeout)
         except Exception as e:
             self.logger.error(f"Error: {e}")
 
+    # blocks until the syncs of the given connector ids or models finish, logging each outcome
+    def watch_syncs(self, connectors, started_at=None, **kwargs):
+        def completed(result):
+            duration = f"{result.duration:.0f}s" if result.duration is not None else "n/a"
+            if result.status == 'succeeded':
+                self.logger.info("Sync of %s (%s) succeeded in %s", result.schema, result.connector_id, duration)
+            else:
+                self.logger.error("Sync of %s (%s) %s: %s", result.schema, result.connector_id, result.status, result.error)
+        watcher = SyncWatcher(self.ftapiconnxn, on_complete=completed, **kwargs).watch(connectors, started_at)
+        summary = watcher.wait()
+        self.logger.info("Syncs finished: %s", {k: v for k, v in summary.summary().items() if k != 'durations'})
+        return summary
+
 
 
     # function to create a single fivetran azure blob connector overriding the values present in the config_fivetran_payload.json
     def create_connector_for_blob(self, table_name, file_name, config_file,counter):
         try:
-            cfg = config(config_file)      
-            cfg.config["config"]["table"] = table_name
-            cfg.config["config"]["pattern"] = file_name
-            payload = cfg.config
-            self.logger.info(f"Payload: {payload}")
+            payload = load_template(config_file, BLOB_FIELDS, ft=self.ftapiconnxn).render(table=table_name, pattern=file_name)
+            self.logger.debug("Payload: %s", payload)
             response = self.ftapiconnxn.create_connector(payload)
             if response is not None:
                 counter += 1
@@ -105,42 +242,41 @@ class FivetranUtils:
             self.logger.error(f"{counter}). {table_name} Connector setup failure for database {file_name}.")
             self.logger.error(e)
             
-    def blobs_to_connectors_compare(self, files_in_container):
+    # blob files of the container that have no connector yet in the group of the payload template
+    def blobs_to_connectors_compare(self, files_in_container, config_file='config_fivetran_blob_qa_payload.json'):
         try:
-            files_wo_container=[]
             if files_in_container:
-                self.logger.info(f"Total Active Files: {len(files_in_container)}")         
+                self.logger.info(f"Total Active Files: {len(files_in_container)}")
             else:
                 self.logger.error("No Files found.")
-            counter = 0
-            try:
-                # response = self.ftapiconnxn.get_connections_of_group('neatness_whoops') #SRC_DEV_NSAP_DB
-                response = self.ftapiconnxn.get_connections_of_group('state_exceptional') #SRC_TST_NSAP_DB
-                if response is not None and len(response) > 0:
-                    # TODO: put up the logic to setup comparision
-                    print()
-                else:
-                    self.logger.info("No response or empty response")                
-                return files_wo_container
-            except Exception as e:
-                self.logger.error(e)
-            
-            
-                
+            plan = self.plan_blob_connectors(files_in_container, config_file)
+            return [step.source for step in plan.creates]
         except Exception as e:
             self.logger.error(f"Error: {e}")
-    
+
+    # create/update(/delete with prune) plan of blob connectors for the files against the group of the template
+    def plan_blob_connectors(self, files_in_container, config_file, prune=False, current=None):
+        template = load_template(config_file, BLOB_FIELDS, ft=self.ftapiconnxn)
+        planner = ConnectorPlanner(self.ftapiconnxn, template.group_id)
+        return planner.plan(desired_from_blobs(files_in_container, template), current, prune)
+
+    # same for database connectors of the active facilities
+    def plan_facility_connectors(self, active_facilities, config_file='config_fivetran_payload.json', prune=False, current=None):
+        template = load_template(config_file, DATABASE_FIELDS, ft=self.ftapiconnxn)
+        planner = ConnectorPlanner(self.ftapiconnxn, template.group_id)
+        return planner.plan(desired_from_facilities(active_facilities, template), current, prune)
+
+    # applies a plan concurrently, dry_run only logs it
+    def apply_plan(self, plan, dry_run=True, max_workers=8):
+        return ConnectorPlanner(self.ftapiconnxn, plan.group_id).apply(plan, max_workers, dry_run)
+
     # function to create a single fivetran azure sql db connector 
     # function sets up the connector by reading the values present in the config_fivetran_payload.json
     # ensure to have the right values for the database and schema_prefix in the config_fivetran_payload.json
     def create_connector_for_database(self, database, schema, counter):
         try:
-            cfg = config('config_fivetran_payload.json')
-            cfg.config["config"]["database"] = database
-            cfg.config["config"]["schema_prefix"] = schema.lower()
-
-            payload = cfg.config
-            self.logger.info(f"Payload: {payload}")
+            payload = load_template('config_fivetran_payload.json', DATABASE_FIELDS, ft=self.ftapiconnxn).render(database=database, schema_prefix=schema.lower())
+            self.logger.debug("Payload: %s", payload)
             response = self.ftapiconnxn.create_connector(payload)
             if response is not None:
                 counter += 1
@@ -228,7 +364,7 @@ if __name__ == "__main__":
         
     ]
     # connectors.blobs_create_connectors(files)
-    connectors.blobs_create_connectors(files, 'config_fivetran_blob_qa_payload.json')
+    connectors.blobs_create_connectors(files, 'config_fivetran_blob_qa_payload.json', watch=True)
     
     # enab
     # connectors.enable_disable_connector("previously_cheer","")
@@ -261,6 +397,8 @@ if __name__ == "__main__":
     # files_in_container = reader.list_files_in_folder()
     
     # get_files_wo_connector = connectors.blobs_to_connectors_compare(files_in_container)
+    # plan = connectors.plan_blob_connectors(files_in_container, 'config_fivetran_blob_qa_payload.json')
+    # connectors.apply_plan(plan, dry_run=True)
     
     # print(f"Files without connectors: {get_files_wo_connector}")
 
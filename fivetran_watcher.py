@@ -0,0 +1,284 @@
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+import requests
+from logger import _logger
+
+# Tracks connector syncs through to completion or failure.
+# A sync counts as finished once succeeded_at (or failed_at) moves past the time it was started,
+# with the connector no longer syncing. Status is read in batches: every poll lists the connections
+# of a group once and updates all watched connectors of that group, unless the group is so large
+# that detail calls for the due connectors are cheaper. Each connector is polled on its own
+# interval, reset to min_interval when its state changes, stretched by backoff while nothing
+# happens, and while syncing aimed at the expected finish taken from earlier syncs of the same
+# service in this watcher.
+
+def parse_time(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (TypeError, ValueError):
+        return None
+
+class SyncResult:
+    """Watch state and outcome of one connector: status is watching, succeeded, failed or timeout."""
+    def __init__(self, connector_id, group_id=None, started_at=None):
+        self.connector_id = connector_id
+        self.group_id = group_id
+        self.schema = None
+        self.service = None
+        self.started_at = started_at
+        self.finished_at = None
+        self.status = 'watching'
+        self.sync_state = None
+        self.error = None
+        self.polls = 0
+        self.interval = None
+        self.next_poll = 0.0
+
+    @property
+    def duration(self):
+        if self.finished_at is None or self.started_at is None:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
+
+    def __repr__(self):
+        return f"SyncResult({self.connector_id!r}, {self.status!r}, duration={self.duration})"
+
+class SyncSummary:
+    def __init__(self, results, elapsed, requests):
+        self.results = results
+        self.elapsed = elapsed
+        self.requests = requests
+
+    def by_status(self, status):
+        return [result for result in self.results if result.status == status]
+
+    @property
+    def succeeded(self):
+        return self.by_status('succeeded')
+
+    @property
+    def failed(self):
+        return self.by_status('failed')
+
+    @property
+    def timed_out(self):
+        return self.by_status('timeout')
+
+    def summary(self):
+        durations = sorted(result.duration for result in self.results if result.duration is not None)
+        def pct(p):
+            return round(durations[min(len(durations) - 1, int(len(durations) * p))], 1) if durations else None
+        return {
+            'total': len(self.results), 'succeeded': len(self.succeeded), 'failed': len(self.failed),
+            'timeout': len(self.timed_out), 'seconds': round(self.elapsed, 1), 'requests': self.requests,
+            'duration_p50': pct(0.5), 'duration_max': pct(1.0),
+            'durations': {result.connector_id: result.duration for result in self.results},
+        }
+
+class SyncWatcher:
+    def __init__(self, ft, min_interval=5.0, max_interval=300.0, backoff=1.5, timeout=None,
+                 on_update=None, on_complete=None, page_size=1000):
+        self.ft = ft
+        self.logger = _logger('DEBUG', 'SyncWatcher')
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        # on_update(result) on every state change, on_complete(result) once a connector finished
+        self.on_update = on_update
+        self.on_complete = on_complete
+        self.page_size = page_size
+        self.results = {}
+        self.requests = 0
+        # service -> moving average of sync durations seen so far
+        self._expected = {}
+        # group id -> number of connections in it, learned from listings
+        self._group_sizes = {}
+        self._lock = threading.RLock()
+        self._started = time.monotonic()
+
+    def watch(self, connectors, started_at=None):
+        """Adds connector ids or connection models (their group_id saves a lookup). started_at
+        is when the syncs were triggered, a datetime or ISO string, default now; pass the time
+        from before the resync calls so a very fast sync is not missed."""
+        if isinstance(started_at, str):
+            started_at = parse_time(started_at)
+        started_at = started_at or datetime.now(timezone.utc)
+        with self._lock:
+            for conn in connectors:
+                if isinstance(conn, str):
+                    result = SyncResult(conn, None, started_at)
+                else:
+                    result = SyncResult(conn.id, conn.group_id, started_at)
+                    result.schema = conn.schema
+                    result.service = conn.service
+                self.results[result.connector_id] = result
+        return self
+
+    @property
+    def pending(self):
+        with self._lock:
+            return [result for result in self.results.values() if result.status == 'watching']
+
+    @property
+    def done(self):
+        return not self.pending
+
+    def _observe(self, result, item, now):
+        result.polls += 1
+        result.group_id = item.get('group_id', result.group_id)
+        result.schema = item.get('schema', result.schema)
+        result.service = item.get('service', result.service)
+        status = item.get('status') or {}
+        state = status.get('sync_state')
+        changed = state != result.sync_state
+        result.sync_state = state
+        succeeded_at = parse_time(item.get('succeeded_at'))
+        failed_at = parse_time(item.get('failed_at'))
+        started = result.started_at
+        if state != 'syncing':
+            if failed_at and failed_at > started and (not succeeded_at or failed_at >= succeeded_at):
+                result.status, result.finished_at = 'failed', failed_at
+                result.error = status.get('tasks') or status.get('warnings') or None
+            elif succeeded_at and succeeded_at > started:
+                result.status, result.finished_at = 'succeeded', succeeded_at
+        if status.get('setup_state') == 'broken' and result.status == 'watching':
+            result.status, result.finished_at, result.error = 'failed', datetime.now(timezone.utc), 'setup broken'
+        if result.status != 'watching':
+            if result.status == 'succeeded' and result.service is not None:
+                previous = self._expected.get(result.service)
+                self._expected[result.service] = result.duration if previous is None else 0.7 * previous + 0.3 * result.duration
+            self._notify(self.on_update, result)
+            self._notify(self.on_complete, result)
+            return
+        result.interval = self._interval(result, changed)
+        result.next_poll = now + result.interval
+        if changed:
+            self._notify(self.on_update, result)
+
+    def _interval(self, result, changed):
+        if changed or result.interval is None:
+            interval = self.min_interval
+        else:
+            interval = result.interval * self.backoff
+        expected = self._expected.get(result.service)
+        if result.sync_state == 'syncing' and expected is not None:
+            # poll around the expected finish instead of steadily backing off
+            elapsed = (datetime.now(timezone.utc) - result.started_at).total_seconds()
+            remaining = expected - elapsed
+            if remaining > 0:
+                interval = remaining / 2
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def _notify(self, callback, result):
+        if callback is None:
+            return
+        try:
+            callback(result)
+        except Exception as e:
+            self.logger.error('Sync watcher callback %s failed for %s: %s', callback, result.connector_id, e)
+
+    def _detail(self, result, now):
+        self.requests += 1
+        try:
+            resp = self.ft.call_api('GET', f'connections/{result.connector_id}')
+        except Exception as e:
+            if isinstance(e, requests.exceptions.HTTPError) and e.response is not None and e.response.status_code == 404:
+                result.status, result.error = 'failed', 'connector not found'
+                self._notify(self.on_complete, result)
+                return
+            self.logger.warning('Status of %s not read: %s', result.connector_id, e)
+            result.next_poll = now + (result.interval or self.min_interval)
+            return
+        self._observe(result, resp['data'], now)
+
+    def _list_group(self, group_id, watched, now):
+        """One listing of the group updates every watched connector in it."""
+        seen = set()
+        for items in self.ft.iter_pages(f'groups/{group_id}/connections', self.page_size):
+            self.requests += 1
+            for item in items:
+                seen.add(item['id'])
+                result = watched.get(item['id'])
+                if result is not None and result.status == 'watching':
+                    self._observe(result, item, now)
+        self._group_sizes[group_id] = len(seen)
+        for connector_id, result in watched.items():
+            if result.status == 'watching' and connector_id not in seen:
+                # not listed any more, it was deleted
+                result.status, result.error = 'failed', 'connector not found'
+                self._notify(self.on_complete, result)
+
+    def poll(self):
+        """Reads the status of every due connector and returns seconds until the next one is due."""
+        now = time.monotonic()
+        with self._lock:
+            pending = self.pending
+            if self.timeout is not None and now - self._started > self.timeout:
+                for result in pending:
+                    result.status = 'timeout'
+                    self._notify(self.on_complete, result)
+                return 0.0
+            due = [result for result in pending if result.next_poll <= now]
+            by_group = {}
+            for result in due:
+                if result.group_id is None:
+                    # first sight of a bare id, its detail call tells the group
+                    self._detail(result, now)
+                else:
+                    by_group.setdefault(result.group_id, []).append(result)
+            for group_id, results in by_group.items():
+                pages = math.ceil(self._group_sizes.get(group_id, 0) / self.page_size)
+                if pages > len(results):
+                    for result in results:
+                        self._detail(result, now)
+                else:
+                    watched = {result.connector_id: result for result in pending if result.group_id == group_id}
+                    try:
+                        self._list_group(group_id, watched, now)
+                    except Exception as e:
+                        self.logger.warning('Listing of group %s failed: %s', group_id, e)
+                        for result in results:
+                            result.next_poll = now + (result.interval or self.min_interval)
+            pending = self.pending
+            if not pending:
+                return 0.0
+            return max(0.0, min(result.next_poll for result in pending) - time.monotonic())
+
+    def wait(self):
+        """Blocks until every watched connector finished (or the timeout passed) and returns the summary."""
+        while True:
+            delay = self.poll()
+            if self.done:
+                return self.summary()
+            time.sleep(delay)
+
+    async def wait_async(self):
+        """Awaitable wait(): polls run on the default executor, the event loop stays free."""
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = await loop.run_in_executor(None, self.poll)
+            if self.done:
+                return self.summary()
+            await asyncio.sleep(delay)
+
+    def start(self):
+        """Runs wait() in a daemon thread and returns a concurrent.futures.Future of the summary."""
+        future = Future()
+        def run():
+            try:
+                future.set_result(self.wait())
+            except Exception as e:
+                future.set_exception(e)
+        threading.Thread(target=run, name='sync-watcher', daemon=True).start()
+        return future
+
+    def summary(self):
+        with self._lock:
+            return SyncSummary(list(self.results.values()), time.monotonic() - self._started, self.requests)
@@ -1,197 +1,412 @@
+import asyncio
+import contextvars
+import functools
 import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from fivetran_cache import ResponseCache
+from fivetran_json import item_stream, loads
+from fivetran_metrics import ApiMetrics
+from fivetran_retry import CircuitOpenError, Deadline, DeadlineExceeded, RetryPolicy, is_server_failure, was_not_processed
+from fivetran_throttle import AdaptiveThrottler
+from logger import _logger
 
-class _logger():
-    def __init__(self, level, name=__file__):
-        logger = logging.getLogger(name)
-        logger.setLevel(getattr(logging, level))
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-        ch = logging.StreamHandler()
-        ch.setFormatter(formatter)
-        logger.addHandler(ch)
-        self.logger = logger
-
-    def info(self, message):
-        self.logger.info(message)
-
-    def debug(self, message):
-        self.logger.debug(message)
-
-    def warning(self, message):
-        self.logger.warning(message)
-
-    def error(self, message):
-        self.logger.error(message)
-
-class account():
-    def __init__(self, account):
-        self._json = account
-        self.account_id = account['account_id']
-        self.system_key_id = str(account['system_key_id'])
-        self.account_name = account['account_name']
-        self.user_id = account['user_id']
-
-class connection():
-    def __init__(self, connection):
-        self._json = connection
-        self.id = connection['id']
-        self.service = connection['service']
-        self.schema = connection['schema']
-        self.paused = str(connection['paused'])
-        self.status = connection['status']  
-        self.config = str(connection['config'])
-        self.daily_sync_time = str(connection['daily_sync_time'])
-        self.succeeded_at = str(connection['succeeded_at'])
-        self.sync_frequency = str(connection['sync_frequency'])
-        self.group_id = connection['group_id']
-        self.connected_by = connection['connected_by']
-        self.setup_tests = str(connection['setup_tests'])
-        if 'source_sync_details' in connection:
-            self.source_sync_details = str(connection['source_sync_details'])
-        else: 
-            self.source_sync_details = str(None)
-        self.service_version = str(connection['service_version'])
-        self.created_at = connection['created_at']
-        self.failed_at = str(connection['failed_at'])
-        self.private_link_id = str(connection['private_link_id'])
-        self.proxy_agent_id = str(connection['proxy_agent_id'])
-        self.networking_method = str(connection['networking_method'])
-        if 'connect_card' in connection:
-            self.connect_card = str(connection['connect_card'])
-        else:
-            self.connect_card = str(None)
-        self.pause_after_trial = str(connection['pause_after_trial'])
-        self.data_delay_threshold = str(connection['data_delay_threshold'])
-        self.data_delay_sensitivity = connection['data_delay_sensitivity']
-        self.schedule_type = connection['schedule_type']
-        if 'local_proccesing_agent_id' in connection:
-            self.local_proccesing_agent_id = str(connection['local_proccesing_agent_id'])
-        else:
-            self.local_proccesing_agent_id = str(None)
-        if 'connect_card_config' in connection:
-            self.connect_card_config = str(connection['connect_card_config'])
-        else:
-            self.connect_card_config = str(None)
-        if 'hybrid_deployment_agent_id' in connection:
-            self.hybrid_deployment_agent_id = str(connection['hybrid_deployment_agent_id'])
-        else:
-            self.hybrid_deployment_agent_id = str(None)
-
-class destination():
-    def __init__(self, destination):
-        self._json = destination
-        self.id = destination['id']
-        self.service = destination['service']
-        self.region = destination['region']
-        self.networking_method = str(destination['networking_method'])
-        self.setup_status = destination['setup_status']
-        self.daylight_saving_time_enabled = str(destination['daylight_saving_time_enabled'])
-        self.private_link_id = str(destination['private_link_id'])
-        self.group_id = destination['group_id']
-        self.time_zone_offset = destination['time_zone_offset']
-        if 'hybrid_deployment_agent_id' in destination:
-            self.hybrid_deployment_agent_id = str(destination['hybrid_deployment_agent_id'])
-        else:
-            self.hybrid_deployment_agent_id = str(None)
-
-class group():
-    def __init__(self, group):
-        self._json = group
-        self.id = group['id']
-        self.name = group['name']
-        self.created_at = group['created_at']
-
-class hybrid_deployment_agent():
-    def __init__(self, hybrid_deployment_agent):
-        self._json = hybrid_deployment_agent
-        self.id = hybrid_deployment_agent['id']
-        self.usage = str(hybrid_deployment_agent['usage'])
-        self.registered_at = hybrid_deployment_agent['registered_at']
-        self.display_name = hybrid_deployment_agent['display_name']
-        self.group_id = hybrid_deployment_agent['group_id']
-
-class privatelink():
-    def __init__(self, privatelink):
-        self._json = privatelink
-        self.id = privatelink['id']
-        self.name = privatelink['name']
-        self.region = privatelink['region']
-        self.service = privatelink['service']
-        self.state = privatelink['state']
-        self.account_id = privatelink['account_id']
-        self.created_at = privatelink['created_at']
-        self.created_by = privatelink['created_by']
-        self.cloud_provider = privatelink['cloud_provider']
-        self.state_summary = privatelink['state_summary']
-        self.config = str(privatelink['config'])
-
-class user():
-    def __init__(self, user):
-        self._json = user
-        self.id = user['id']
-        self.email = user['email']
-        self.verified = str(user['verified'])
-        self.invited = str(user['invited'])
-        self.picture = str(user['picture'])
-        self.phone = str(user['phone'])
-        if 'role' in user:
-            if user['role'] is None:
-                self.role = str(None)
-            else:
-                self.role = user['role']
+class _field():
+    """Attribute of a model decoded from the underlying json on first access and cached in a slot.
+    convert is applied to the raw value (str for the fields the api wrappers always exposed as
+    strings), optional fields that are missing from the json decode as convert(None), and intern
+    shares a single copy of repeated enum-like strings across all models.
+    """
+    def __init__(self, key=None, convert=None, optional=False, intern=False):
+        self.key = key
+        self.convert = convert
+        self.optional = optional
+        self.intern = intern
+
+    def __set_name__(self, owner, name):
+        if self.key is None:
+            self.key = name
+        self.name = name
+
+    def decode(self, json):
+        if self.optional and self.key not in json:
+            value = None
         else:
-            self.role = str(None)
-        self.active = str(user['active'])
-        self.given_name = str(user['given_name'])
-        self.created_at = user['created_at']
-        self.family_name = str(user['family_name'])
-        self.logged_in_at = str(user['logged_in_at'])
+            value = json[self.key]
+        if self.convert is not None:
+            value = self.convert(value)
+        if self.intern and isinstance(value, str):
+            value = sys.intern(value)
+        return value
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        try:
+            return self.slot.__get__(obj, owner)
+        except AttributeError:
+            # slot still empty, first access
+            value = self.decode(obj._json)
+            self.slot.__set__(obj, value)
+            return value
+
+    def __set__(self, obj, value):
+        self.slot.__set__(obj, value)
+
+class _model_meta(type):
+    # gives every _field a private slot, so models carry no per-instance __dict__
+    def __new__(mcs, name, bases, namespace):
+        fields = tuple(key for key, value in namespace.items() if isinstance(value, _field))
+        namespace['__slots__'] = tuple(namespace.get('__slots__', ())) + tuple(f'_f_{key}' for key in fields)
+        cls = super().__new__(mcs, name, bases, namespace)
+        for key in fields:
+            namespace[key].slot = cls.__dict__[f'_f_{key}']
+        cls._fields = tuple(field for base in bases for field in getattr(base, '_fields', ())) + fields
+        return cls
+
+class _model(metaclass=_model_meta):
+    __slots__ = ('_json',)
+
+    def __init__(self, json):
+        self._json = json
+
+    def __repr__(self):
+        return f"{type(self).__name__}(id={self._json.get('id')!r})"
+
+def _role(value):
+    return str(None) if value is None else value
+
+class account(_model):
+    account_id = _field()
+    system_key_id = _field(convert=str)
+    account_name = _field()
+    user_id = _field()
+
+class connection(_model):
+    id = _field()
+    service = _field(intern=True)
+    schema = _field()
+    paused = _field(convert=str, intern=True)
+    status = _field()
+    config = _field(convert=str)
+    daily_sync_time = _field(convert=str, intern=True)
+    succeeded_at = _field(convert=str)
+    sync_frequency = _field(convert=str, intern=True)
+    group_id = _field(intern=True)
+    connected_by = _field(intern=True)
+    setup_tests = _field(convert=str)
+    source_sync_details = _field(convert=str, optional=True)
+    service_version = _field(convert=str, intern=True)
+    created_at = _field()
+    failed_at = _field(convert=str)
+    private_link_id = _field(convert=str, intern=True)
+    proxy_agent_id = _field(convert=str, intern=True)
+    networking_method = _field(convert=str, intern=True)
+    connect_card = _field(convert=str, optional=True)
+    pause_after_trial = _field(convert=str, intern=True)
+    data_delay_threshold = _field(convert=str, intern=True)
+    data_delay_sensitivity = _field(intern=True)
+    schedule_type = _field(intern=True)
+    local_proccesing_agent_id = _field(convert=str, optional=True, intern=True)
+    connect_card_config = _field(convert=str, optional=True)
+    hybrid_deployment_agent_id = _field(convert=str, optional=True, intern=True)
+
+class destination(_model):
+    id = _field()
+    service = _field(intern=True)
+    region = _field(intern=True)
+    networking_method = _field(convert=str, intern=True)
+    setup_status = _field(intern=True)
+    daylight_saving_time_enabled = _field(convert=str, intern=True)
+    private_link_id = _field(convert=str, intern=True)
+    group_id = _field(intern=True)
+    time_zone_offset = _field(intern=True)
+    hybrid_deployment_agent_id = _field(convert=str, optional=True, intern=True)
+
+class group(_model):
+    id = _field()
+    name = _field()
+    created_at = _field()
+
+class hybrid_deployment_agent(_model):
+    id = _field()
+    usage = _field(convert=str)
+    registered_at = _field()
+    display_name = _field()
+    group_id = _field(intern=True)
+
+class privatelink(_model):
+    id = _field()
+    name = _field()
+    region = _field(intern=True)
+    service = _field(intern=True)
+    state = _field(intern=True)
+    account_id = _field(intern=True)
+    created_at = _field()
+    created_by = _field(intern=True)
+    cloud_provider = _field(intern=True)
+    state_summary = _field()
+    config = _field(convert=str)
+
+class user(_model):
+    id = _field()
+    email = _field()
+    verified = _field(convert=str, intern=True)
+    invited = _field(convert=str, intern=True)
+    picture = _field(convert=str)
+    phone = _field(convert=str)
+    role = _field(convert=_role, optional=True, intern=True)
+    active = _field(convert=str, intern=True)
+    given_name = _field(convert=str)
+    created_at = _field()
+    family_name = _field(convert=str)
+    logged_in_at = _field(convert=str)
 
 class connect():
-    def __init__(self, api_key, api_secret, base_url='https://api.fivetran.com/v1'):
+    def __init__(self, api_key, api_secret, base_url='https://api.fivetran.com/v1',
+                 pool_connections=4, pool_maxsize=16, connect_timeout=5, read_timeout=60, throttler=None,
+                 retry_policy=None, cache=None, metrics=None):
         self.api_key    = api_key
         self.api_secret = api_secret
         self.base_url   = base_url
         self.auth = HTTPBasicAuth(api_key, api_secret)
         self.logger = _logger('DEBUG', 'fivetran')
-
-    def call_api(self, method, endpoint, payload=None): # {'limit': 100}
-        url = f'{self.base_url}/{endpoint}'
-        self.logger.debug(f"call_api using (method='{method}', endpoint='{url}', payload={str(payload)})")
-        # handle cursor - should be part of h
-        #    while "next_cursor" in response["data"]:
-        #        print("paged")
-        #        params = {"limit": limit, "cursor": response["data"]["next_cursor"]}
-        #        url = "https://api.fivetran.com/v1/groups/{}/connectors".format(group_id)
-        #        response_paged = requests.get(url=url, auth=a, params=params).json()
-        #        if any(response_paged["data"]["items"]) == True:
-        #            conn_list.extend(response_paged["data"]['items'])
-        #    response = response_paged
-        headers = {
+        # (connect, read) timeout in seconds applied to every call unless overridden per call
+        self.timeout = (connect_timeout, read_timeout)
+        # one long-lived session so TCP/TLS connections to the API are kept alive and reused,
+        # the urllib3 pool behind the adapter is thread-safe and blocks when all pool_maxsize
+        # connections are checked out instead of opening throwaway ones
+        self.session = requests.Session()
+        self.session.auth = self.auth
+        self.session.headers.update({
             'Accept': 'application/json',
             'Authorization': f'Bearer {self.api_key}:{self.api_secret}'
-        }
+        })
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # pass the same throttler to several clients to share one request budget
+        self.throttler = throttler if throttler is not None else AdaptiveThrottler()
+        # retries with backoff and the per-host circuit breakers, share a policy to share breakers
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self._host = urlsplit(base_url).netloc
+        # the active deadline is per thread and asyncio task, worker threads get it explicitly
+        # through within_deadline
+        self._deadline = contextvars.ContextVar(f'fivetran_deadline_{id(self)}', default=None)
+        # GET responses of endpoints with a TTL (metadata by default), pass ResponseCache(directory=...) to persist
+        self.cache = cache if cache is not None else ResponseCache()
+        self._cache_scope = ResponseCache.scope(base_url, api_key, api_secret)
+        # per method/endpoint template counters and latency histograms, see metrics.snapshot()
+        self.metrics = metrics if metrics is not None else ApiMetrics()
+        # callables(method, endpoint, payload, response) notified after every successful mutating call
+        self.listeners = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        # releases all pooled connections, the object should not be used afterwards
+        self.session.close()
+
+    @contextmanager
+    def deadline(self, seconds):
+        """Bounds the total time, retries and backoff included, of every call the current thread
+        (or asyncio task) makes inside the block. seconds may be a Deadline to share."""
+        deadline = seconds if isinstance(seconds, Deadline) else Deadline(seconds)
+        token = self._deadline.set(deadline)
         try:
-            if method == 'GET':
-                # only place we need to handle cursors for retrieval
-                response = requests.get(url, headers=headers, auth=self.auth)
-            elif method == 'POST':
-                response = requests.post(url, headers=headers, json=payload, auth=self.auth)
-            elif method == 'PATCH':
-                response = requests.patch(url, headers=headers, json=payload, auth=self.auth)
-            elif method == 'DELETE':
-                response = requests.delete(url, headers=headers, auth=self.auth)
-            else:
-                raise ValueError('Invalid request method.')
-            if response is not None:
+            yield deadline
+        finally:
+            self._deadline.reset(token)
+
+    def current_deadline(self):
+        return self._deadline.get()
+
+    def within_deadline(self, deadline, func, *args, **kwargs):
+        """Runs func under a deadline taken from another thread, e.g. in a worker of a pool."""
+        if deadline is None:
+            return func(*args, **kwargs)
+        with self.deadline(deadline):
+            return func(*args, **kwargs)
+
+    def retry_stats(self):
+        return self.retry_policy.stats()
+
+    def _notify(self, method, endpoint, payload, data):
+        for listener in self.listeners:
+            try:
+                listener(method, endpoint, payload, data)
+            except Exception as e:
+                # the api call itself succeeded, a broken listener must not turn it into a failure
+                self.logger.error('Listener %s failed for %s %s: %s', listener, method, endpoint, e)
+
+    def _send(self, method, url, payload, timeout, headers=None, stream=False):
+        if method == 'GET':
+            # cursors are followed by iter_pages, a single call returns a single page
+            return self.session.get(url, params=payload, timeout=timeout, headers=headers, stream=stream)
+        elif method == 'POST':
+            return self.session.post(url, json=payload, timeout=timeout)
+        elif method == 'PATCH':
+            return self.session.patch(url, json=payload, timeout=timeout)
+        elif method == 'DELETE':
+            return self.session.delete(url, timeout=timeout)
+
+    def call_api(self, method, endpoint, payload=None, timeout=None, dedupe=None, stream=False): # {'limit': 100}
+        # for GET the payload is sent as query parameters (limit, cursor), otherwise as the json body
+        # dedupe is an optional callable returning the response of an earlier POST attempt that did
+        # go through (or None), it allows POSTs to be retried after ambiguous failures
+        # stream=True returns the unread requests response of a GET instead of the decoded json,
+        # the caller has to consume and close it
+        if method not in ('GET', 'POST', 'PATCH', 'DELETE'):
+            raise ValueError('Invalid request method.')
+        url = f'{self.base_url}/{endpoint}'
+        self.logger.debug("call_api using (method='%s', endpoint='%s', payload=%s)", method, url, payload)
+        if timeout is None:
+            timeout = self.timeout
+        cache_key, cached, headers = None, None, None
+        if method == 'GET' and not stream:
+            cache_key, cached, fresh = self.cache.lookup(endpoint, payload, self._cache_scope)
+            if fresh:
+                return cached.data
+            if cached is not None and cached.etag:
+                headers = {'If-None-Match': cached.etag}
+        breaker = self.retry_policy.breaker(self._host)
+        attempt = 0
+        while True:
+            sent = None
+            probe = outcome = False
+            try:
+                # an expired deadline must not take the probe slot of a half open circuit
+                deadline = self._deadline.get()
+                attempt_timeout = deadline.cap(timeout) if deadline is not None else timeout
+                probe = breaker.before_call()
+                waited = self.throttler.acquire()
+                if waited:
+                    self.metrics.throttled(waited)
+                sent = time.perf_counter()
+                response = self._send(method, url, payload, attempt_timeout, headers, stream)
+                latency = time.perf_counter() - sent
+                body = response.request.body
+                bytes_in = int(response.headers.get('Content-Length', 0)) if stream else len(response.content)
+                self.metrics.observe(method, endpoint, response.status_code, latency, bytes_in, len(body) if body else 0)
+                self.throttler.on_response(response.status_code, response.headers)
                 response.raise_for_status()  # Raise exception for 4xx or 5xx responses
-                # this is where we need to handle cursors
-                return response.json()
-        except requests.exceptions.RequestException as e:
-            self.logger.error(f'Request failed: {e}')
-            raise(e)
+                breaker.record_success()
+                outcome = True
+                self.retry_policy.record(method, 'success' if attempt == 0 else 'success_after_retry')
+                if stream:
+                    return response
+                if response.status_code == 304 and cached is not None:
+                    self.cache.revalidated(cache_key, cached)
+                    return cached.data
+                data = loads(response.content)
+                if cache_key is not None:
+                    self.cache.store(cache_key, endpoint, data, response.headers.get('ETag'))
+                elif method != 'GET':
+                    self.cache.invalidate(endpoint)
+                    self._notify(method, endpoint, payload, data)
+                return data
+            except requests.exceptions.RequestException as e:
+                if sent is not None and getattr(e, 'response', None) is None:
+                    # no response at all, connection error or timeout
+                    self.metrics.observe(method, endpoint, None, time.perf_counter() - sent)
+                if not isinstance(e, (CircuitOpenError, DeadlineExceeded)):
+                    if is_server_failure(e):
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                    outcome = True
+                retryable = attempt < self.retry_policy.max_retries and self.retry_policy.is_retryable(method, e, dedupe is not None)
+                delay = self.retry_policy.backoff(attempt) if retryable else 0
+                deadline = self._deadline.get()
+                if retryable and deadline is not None and deadline.remaining() <= delay:
+                    retryable = False
+                if not retryable:
+                    self.retry_policy.record(method, 'failure')
+                    self.logger.error('Request failed: %s', e)
+                    raise(e)
+                self.retry_policy.record(method, 'retry')
+                self.metrics.retry(method, endpoint, delay)
+                attempt += 1
+                self.logger.warning("Retrying %s %s in %.2fs (attempt %d of %d) after: %s", method, url, delay, attempt, self.retry_policy.max_retries, e)
+                time.sleep(delay)
+                if method == 'POST' and dedupe is not None and not was_not_processed(e):
+                    existing = dedupe()
+                    if existing is not None:
+                        self.logger.info("POST %s already applied by an earlier attempt, not resending.", url)
+                        self.retry_policy.record(method, 'deduplicated')
+                        return existing
+            finally:
+                if probe and not outcome:
+                    # the probe never got an answer (e.g. KeyboardInterrupt), free the slot
+                    breaker.release_probe()
         
+    def iter_pages(self, endpoint, limit=100, prefetch=False):
+        """Lazily yields the items list of every page of a list endpoint, following next_cursor
+        until the API stops returning one. Only one page (two with prefetch) is held in memory.
+        With prefetch=True the next page is requested in a background thread while the caller
+        consumes the current one.
+        """
+        params = {'limit': limit}
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        deadline = self._deadline.get()
+        try:
+            future = executor.submit(self.within_deadline, deadline, self.call_api, 'GET', endpoint, params) if prefetch else None
+            while True:
+                resp = future.result() if prefetch else self.call_api('GET', endpoint, params)
+                if resp is None:
+                    return
+                data = resp['data']
+                cursor = data.get('next_cursor')
+                params = {'limit': limit, 'cursor': cursor}
+                if prefetch and cursor:
+                    future = executor.submit(self.within_deadline, deadline, self.call_api, 'GET', endpoint, params)
+                yield data['items']
+                if not cursor:
+                    return
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_stream(self, endpoint, limit=100, chunk_size=65536):
+        """Like iter_pages but yields single items decoded incrementally from the response body,
+        so memory stays per item whatever the page size. Failures in the middle of a page are not
+        retried.
+        """
+        params = {'limit': limit}
+        while True:
+            response = self.call_api('GET', endpoint, params, stream=True)
+            with response:
+                items = item_stream(response.iter_content(chunk_size))
+                yield from items
+            if not items.next_cursor:
+                return
+            params = {'limit': limit, 'cursor': items.next_cursor}
+
+    def iter_items(self, endpoint, model, limit=100, prefetch=False, stream=False):
+        if stream:
+            for item in self.iter_stream(endpoint, limit):
+                yield model(item)
+            return
+        for items in self.iter_pages(endpoint, limit, prefetch):
+            for item in items:
+                yield model(item)
+
+    def export(self, resource, path, columns=None, format=None, compress=None, group_id=None, stream=True):
+        """Streams a resource ('connections', 'users', ...) to an NDJSON, CSV, Parquet or Arrow file,
+        see fivetran_export.InventoryExporter. Preferred over the print_* methods for inventories."""
+        from fivetran_export import InventoryExporter
+        return InventoryExporter(self, stream=stream).export(resource, path, format, columns, compress, group_id)
+
     def get_account_info(self):
         resp = self.call_api('GET', 'account/info')
         if resp is not None:
@@ -199,24 +414,31 @@ class connect():
         return None
 
     def print_account_info(self, account=None):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
         if account is None:
             account = self.get_account_info()
-        self.logger.info('Account Id: ' + account.account_id + ' Account Name: ' + account.account_name + ' User Id: ' + account.user_id + ' System Key Id: ' + account.system_key_id)
+        self.logger.info('Account Id: %s Account Name: %s User Id: %s System Key Id: %s', account.account_id, account.account_name, account.user_id, account.system_key_id)
+
+    def iter_connections(self, limit=100, prefetch=False, stream=False):
+        return self.iter_items('connections', connection, limit, prefetch, stream)
 
     def get_connections(self, limit=100):
-        resp = self.call_api('GET', 'connections', {'limit': limit})
-        if resp is not None:
-            connections = []
-            for item in resp['data']['items']:
-                connections.append(connection(item))
-            return connections
-        return None
+        return list(self.iter_connections(limit))
+
+    def iter_connections_of_group(self, group_id, limit=100, prefetch=False, stream=False):
+        return self.iter_items(f'groups/{group_id}/connections', connection, limit, prefetch, stream)
+
+    def get_connections_of_group(self, group_id, limit=100):
+        return list(self.iter_connections_of_group(group_id, limit))
 
     def print_connections(self, connections=None):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
         if connections is None:
-            connections = self.get_connections()
+            connections = self.iter_connections()
         for connection in connections:
-            self.logger.info('Connection Id: ' + connection.id + ' Group Id: ' + connection.group_id + ' Service: ' + connection.service + ' Schema: ' + connection.schema + ' Connected By: ' + connection.connected_by + ' Created At: ' + connection.created_at + ' Succeeded At: ' + connection.succeeded_at + ' Failed At: ' + connection.failed_at + ' Paused: ' + connection.paused + ' Pause After Trial: ' + connection.pause_after_trial + ' Sync Frequency: ' + connection.sync_frequency + ' Data Delay Threshold: ' + connection.data_delay_threshold + ' Data Delay Sensitivity: ' + connection.data_delay_sensitivity + ' Daily Sync Time: ' + connection.daily_sync_time + ' Schedule Type: ' + connection.schedule_type + ' Networking Method: ' + connection.networking_method + ' Proxy Agent Id: ' + connection.proxy_agent_id)
+            self.logger.info('Connection Id: %s Group Id: %s Service: %s Schema: %s Connected By: %s Created At: %s Succeeded At: %s Failed At: %s Paused: %s Pause After Trial: %s Sync Frequency: %s Data Delay Threshold: %s Data Delay Sensitivity: %s Daily Sync Time: %s Schedule Type: %s Networking Method: %s Proxy Agent Id: %s', connection.id, connection.group_id, connection.service, connection.schema, connection.connected_by, connection.created_at, connection.succeeded_at, connection.failed_at, connection.paused, connection.pause_after_trial, connection.sync_frequency, connection.data_delay_threshold, connection.data_delay_sensitivity, connection.daily_sync_time, connection.schedule_type, connection.networking_method, connection.proxy_agent_id)
 
     def get_connectors(self):
         connectors = self.call_api('GET', 'metadata/connector-types')
@@ -230,8 +452,26 @@ class connect():
             return schema
         return None
 
+    def _find_created_connector(self, payload):
+        # dedupe guard for create_connector: the connection an earlier attempt created for this payload
+        group_id = payload.get('group_id')
+        cfg = payload.get('config', {})
+        if cfg.get('schema_prefix'):
+            schema = cfg['schema_prefix']
+        elif cfg.get('table'):
+            schema = f"{cfg.get('schema')}.{cfg['table']}"
+        else:
+            schema = cfg.get('schema')
+        if not group_id or not schema:
+            return None
+        for items in self.iter_pages(f'groups/{group_id}/connections', 1000):
+            for item in items:
+                if item.get('schema') == schema and item.get('service') == payload.get('service'):
+                    return {'code': 'Success', 'data': item}
+        return None
+
     def create_connector(self, payload):
-        resp = self.call_api('POST', 'connectors', payload)
+        resp = self.call_api('POST', 'connectors', payload, dedupe=lambda: self._find_created_connector(payload))
         # Should return a proper object representing the response of creating a connector
         if resp is not None:
             return resp
@@ -243,68 +483,77 @@ class connect():
             return resp
         return None
 
+    def update_connector(self, connector_id, payload):
+        resp = self.call_api('PATCH', 'connectors/' + connector_id, payload)
+        if resp is not None:
+            return resp
+        return None
+
+    def resync_connector(self, connector_id, scope=None):
+        # historical re-sync of the whole connector, or only the tables in scope {'schema': ['table', ...]}
+        payload = {'scope': scope} if scope is not None else None
+        resp = self.call_api('POST', f'connectors/{connector_id}/resync', payload)
+        if resp is not None:
+            return resp
+        return None
+
     def copy_connector(self, connector_id):
         # implement
         return None
 
-    def get_destinations(self):
-        # this has potential for cursor
-        dests = self.call_api('GET', 'destinations')
-        if dests is not None:
-            destinations = []
-            for _destination in dests['data']['items']:
-                destinations.append(destination(_destination))
-            return destinations
-        return None
+    def iter_destinations(self, limit=100, prefetch=False, stream=False):
+        return self.iter_items('destinations', destination, limit, prefetch, stream)
+
+    def get_destinations(self, limit=100):
+        return list(self.iter_destinations(limit))
     
     def get_destination_detail(self, destination_id):
-        destination = self.call_api('GET', 'destinations/' + destination_id)
-        if destination is not None:
-            return destination(destination['data'])
+        dest = self.call_api('GET', 'destinations/' + destination_id)
+        if dest is not None:
+            return destination(dest['data'])
         return None
     
     def print_destinations(self):
-        destinations = self.get_destinations()
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        destinations = self.iter_destinations()
         if destinations is not None:
             for destination in destinations:
-                self.logger.info('Destination Id: ' + destination.id + ' Group Id: ' + destination.group_id + ' Networking Method: ' + destination.networking_method + ' Service: ' + destination.service + ' Private Link Id: ' + destination.private_link_id + ' Region: ' + destination.region + ' Timezone Offset: ' + destination.time_zone_offset + ' Setup Status: ' + destination.setup_status + ' Daylight Saving Time Enabled: ' + destination.daylight_saving_time_enabled + ' Hybrid Deployment Agent Id: ' + destination.hybrid_deployment_agent_id)
+                self.logger.info('Destination Id: %s Group Id: %s Networking Method: %s Service: %s Private Link Id: %s Region: %s Timezone Offset: %s Setup Status: %s Daylight Saving Time Enabled: %s Hybrid Deployment Agent Id: %s', destination.id, destination.group_id, destination.networking_method, destination.service, destination.private_link_id, destination.region, destination.time_zone_offset, destination.setup_status, destination.daylight_saving_time_enabled, destination.hybrid_deployment_agent_id)
 
-    def get_groups(self):
-        # this has potential for cursor
-        resp = self.call_api('GET', 'groups')
-        if resp is not None:
-            groups = []
-            for item in resp['data']['items']:
-                groups.append(group(item))
-            return groups
-        return None
+    def iter_groups(self, limit=100, prefetch=False, stream=False):
+        return self.iter_items('groups', group, limit, prefetch, stream)
+
+    def get_groups(self, limit=100):
+        return list(self.iter_groups(limit))
     
     def get_group_detail(self, group_id):
-        group = self.call_api('GET', 'groups/' + group_id)
-        if group is not None:
-            return group(group['data'])
+        grp = self.call_api('GET', 'groups/' + group_id)
+        if grp is not None:
+            return group(grp['data'])
         return None
     
     def print_groups(self):
-        groups = self.get_groups()
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        groups = self.iter_groups()
         if groups is not None:
             for group in groups:
-                self.logger.info('Group Id: ' + group.id + ' Name: ' + group.name + ' Created At: ' + group.created_at)
+                self.logger.info('Group Id: %s Name: %s Created At: %s', group.id, group.name, group.created_at)
 
-    def get_hybrid_deployment_agents(self):
-        resp = self.call_api('GET', 'hybrid-deployment-agents', {'limit': 100})
-        if resp is not None:
-            hybrid_deployment_agents = []
-            for item in resp['data']['items']:
-                hybrid_deployment_agents.append(hybrid_deployment_agent(item))
-            return hybrid_deployment_agents
-        return None
+    def iter_hybrid_deployment_agents(self, limit=100, prefetch=False, stream=False):
+        return self.iter_items('hybrid-deployment-agents', hybrid_deployment_agent, limit, prefetch, stream)
+
+    def get_hybrid_deployment_agents(self, limit=100):
+        return list(self.iter_hybrid_deployment_agents(limit))
     
     def print_hybrid_deployment_agents(self, hybrid_deployment_agents=None):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
         if hybrid_deployment_agents is None:
-            hybrid_deployment_agents = self.get_hybrid_deployment_agents()
+            hybrid_deployment_agents = self.iter_hybrid_deployment_agents()
         for hybrid_deployment_agent in hybrid_deployment_agents:
-            self.logger.info('Hybrid Deployment Agent Id: ' + hybrid_deployment_agent.id + ' Display Name: ' + hybrid_deployment_agent.display_name + ' Group Id: ' + hybrid_deployment_agent.group_id + ' Registered At: ' + hybrid_deployment_agent.registered_at + ' Usage: ' + hybrid_deployment_agent.usage)
+            self.logger.info('Hybrid Deployment Agent Id: %s Display Name: %s Group Id: %s Registered At: %s Usage: %s', hybrid_deployment_agent.id, hybrid_deployment_agent.display_name, hybrid_deployment_agent.group_id, hybrid_deployment_agent.registered_at, hybrid_deployment_agent.usage)
 
     def get_private_link_detail(self, private_link_id):
         prvtlnk = self.call_api('GET', 'private-links/' + private_link_id)
@@ -312,20 +561,19 @@ class connect():
             return privatelink(prvtlnk['data'])
         return None
 
-    def get_private_links(self):
-        prvtlnks = self.call_api('GET', 'private-links', {'limit': 100})
-        if prvtlnks is not None:
-            privatelinks = []
-            for _privatelink in prvtlnks['data']['items']:
-                privatelinks.append(privatelink(_privatelink))
-            return privatelinks
-        return None
+    def iter_private_links(self, limit=100, prefetch=False, stream=False):
+        return self.iter_items('private-links', privatelink, limit, prefetch, stream)
+
+    def get_private_links(self, limit=100):
+        return list(self.iter_private_links(limit))
     
     def print_private_links(self):
-        privatelinks = self.get_private_links()
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        privatelinks = self.iter_private_links()
         if privatelinks is not None:
             for privatelink in privatelinks:
-                self.logger.info('Private Link Id: ' + privatelink.id + ' Name: ' + privatelink.name + ' Region: ' + privatelink.region + ' Service: ' + privatelink.service + ' State: ' + privatelink.state + ' Account Id: ' + privatelink.account_id + ' Created At: ' + privatelink.created_at + ' Created By: ' + privatelink.created_by + ' Cloud Provider: ' + privatelink.cloud_provider + ' State Summary: ' + privatelink.state_summary + ' Config: ' + privatelink.config)
+                self.logger.info('Private Link Id: %s Name: %s Region: %s Service: %s State: %s Account Id: %s Created At: %s Created By: %s Cloud Provider: %s State Summary: %s Config: %s', privatelink.id, privatelink.name, privatelink.region, privatelink.service, privatelink.state, privatelink.account_id, privatelink.created_at, privatelink.created_by, privatelink.cloud_provider, privatelink.state_summary, privatelink.config)
 
     def create_private_link(self, payload):
         prvtlnk = self.call_api('POST', 'private-links', payload)
@@ -351,18 +599,178 @@ class connect():
             return user(usr['data'])
         return None
 
-    def get_users(self):
-        usrs = self.call_api('GET', 'users')
-        if usrs is not None:
-            users = []
-            for _user in usrs['data']['items']:
-                users.append(user(_user))
-            return users
-        return None
+    def iter_users(self, limit=100, prefetch=False, stream=False):
+        return self.iter_items('users', user, limit, prefetch, stream)
+
+    def get_users(self, limit=100):
+        return list(self.iter_users(limit))
     
     def print_users(self):
-        users = self.get_users()
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        users = self.iter_users()
         if users is not None:
             for user in users:
-                self.logger.info('User Id: ' + user.id + ' Email: ' + user.email + ' Verified: ' + user.verified + ' Invited: ' + user.invited + ' Picture: ' + user.picture + ' Phone: ' + user.phone + ' Role: ' + user.role + ' Active: ' + user.active + ' Given Name: ' + user.given_name + ' Created At: ' + user.created_at + ' Family Name: ' + user.family_name + ' Logged In At: ' + user.logged_in_at)
+                self.logger.info('User Id: %s Email: %s Verified: %s Invited: %s Picture: %s Phone: %s Role: %s Active: %s Given Name: %s Created At: %s Family Name: %s Logged In At: %s', user.id, user.email, user.verified, user.invited, user.picture, user.phone, user.role, user.active, user.given_name, user.created_at, user.family_name, user.logged_in_at)
     
+
+class AsyncConnect():
+    """Asyncio counterpart of connect exposing the same endpoints as coroutines and returning the
+    same model classes. Requests run on a thread pool over the pooled session of a wrapped connect,
+    so no additional HTTP dependency is needed. At most max_concurrency requests are in flight
+    overall and endpoint_limits (e.g. {'connectors': 8}) caps individual resources, keyed by the
+    first segment of the endpoint path.
+    """
+    def __init__(self, api_key, api_secret, base_url='https://api.fivetran.com/v1',
+                 max_concurrency=16, endpoint_limits=None, **kwargs):
+        # the session pool matches the concurrency unless the caller tunes it
+        kwargs.setdefault('pool_maxsize', max_concurrency)
+        self.ft = connect(api_key, api_secret, base_url, **kwargs)
+        self.logger = self.ft.logger
+        self.max_concurrency = max_concurrency
+        self.endpoint_limits = endpoint_limits or {}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='fivetran')
+        # semaphores belong to an event loop, they are created inside the running one
+        self._loop = None
+        self._semaphore = None
+        self._endpoint_semaphores = {}
+
+    async def __aenter__(self):
+        self._bind()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        # waiting for the executor threads would block the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.ft.close()
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._endpoint_semaphores = {}
+
+    def _endpoint_semaphore(self, endpoint):
+        resource = endpoint.split('/', 1)[0]
+        if resource not in self._endpoint_semaphores:
+            self._endpoint_semaphores[resource] = asyncio.Semaphore(self.endpoint_limits.get(resource, self.max_concurrency))
+        return self._endpoint_semaphores[resource]
+
+    async def _run(self, endpoint, func, *args):
+        self._bind()
+        # take the endpoint slot first so callers queued on one busy resource do not hold global slots
+        async with self._endpoint_semaphore(endpoint):
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                # the deadline of the calling task does not cross into the executor thread by itself
+                return await loop.run_in_executor(self._executor, functools.partial(
+                    self.ft.within_deadline, self.ft.current_deadline(), func, *args))
+
+    async def call_api(self, method, endpoint, payload=None, timeout=None, dedupe=None):
+        return await self._run(endpoint, self.ft.call_api, method, endpoint, payload, timeout, dedupe)
+
+    async def iter_pages(self, endpoint, limit=100):
+        params = {'limit': limit}
+        while True:
+            resp = await self.call_api('GET', endpoint, params)
+            if resp is None:
+                return
+            data = resp['data']
+            yield data['items']
+            cursor = data.get('next_cursor')
+            if not cursor:
+                return
+            params = {'limit': limit, 'cursor': cursor}
+
+    async def iter_items(self, endpoint, model, limit=100):
+        async for items in self.iter_pages(endpoint, limit):
+            for item in items:
+                yield model(item)
+
+    async def get_account_info(self):
+        return await self._run('account', self.ft.get_account_info)
+
+    def iter_connections(self, limit=100):
+        return self.iter_items('connections', connection, limit)
+
+    async def get_connections(self, limit=100):
+        return [item async for item in self.iter_connections(limit)]
+
+    def iter_connections_of_group(self, group_id, limit=100):
+        return self.iter_items(f'groups/{group_id}/connections', connection, limit)
+
+    async def get_connections_of_group(self, group_id, limit=100):
+        return [item async for item in self.iter_connections_of_group(group_id, limit)]
+
+    async def get_connectors(self):
+        return await self._run('metadata', self.ft.get_connectors)
+
+    async def get_connector_schema(self, connector):
+        return await self._run('metadata', self.ft.get_connector_schema, connector)
+
+    async def create_connector(self, payload):
+        return await self._run('connectors', self.ft.create_connector, payload)
+
+    async def delete_connector(self, connector_id):
+        return await self._run('connectors', self.ft.delete_connector, connector_id)
+
+    async def update_connector(self, connector_id, payload):
+        return await self._run('connectors', self.ft.update_connector, connector_id, payload)
+
+    async def resync_connector(self, connector_id, scope=None):
+        return await self._run('connectors', self.ft.resync_connector, connector_id, scope)
+
+    def iter_destinations(self, limit=100):
+        return self.iter_items('destinations', destination, limit)
+
+    async def get_destinations(self, limit=100):
+        return [item async for item in self.iter_destinations(limit)]
+
+    async def get_destination_detail(self, destination_id):
+        return await self._run('destinations', self.ft.get_destination_detail, destination_id)
+
+    def iter_groups(self, limit=100):
+        return self.iter_items('groups', group, limit)
+
+    async def get_groups(self, limit=100):
+        return [item async for item in self.iter_groups(limit)]
+
+    async def get_group_detail(self, group_id):
+        return await self._run('groups', self.ft.get_group_detail, group_id)
+
+    def iter_hybrid_deployment_agents(self, limit=100):
+        return self.iter_items('hybrid-deployment-agents', hybrid_deployment_agent, limit)
+
+    async def get_hybrid_deployment_agents(self, limit=100):
+        return [item async for item in self.iter_hybrid_deployment_agents(limit)]
+
+    async def get_private_link_detail(self, private_link_id):
+        return await self._run('private-links', self.ft.get_private_link_detail, private_link_id)
+
+    def iter_private_links(self, limit=100):
+        return self.iter_items('private-links', privatelink, limit)
+
+    async def get_private_links(self, limit=100):
+        return [item async for item in self.iter_private_links(limit)]
+
+    async def create_private_link(self, payload):
+        return await self._run('private-links', self.ft.create_private_link, payload)
+
+    async def delete_private_link(self, private_link_id):
+        return await self._run('private-links', self.ft.delete_private_link, private_link_id)
+
+    async def update_private_link(self, private_link_id, payload):
+        return await self._run('private-links', self.ft.update_private_link, private_link_id, payload)
+
+    async def get_user_detail(self, user_id):
+        return await self._run('users', self.ft.get_user_detail, user_id)
+
+    def iter_users(self, limit=100):
+        return self.iter_items('users', user, limit)
+
+    async def get_users(self, limit=100):
+        return [item async for item in self.iter_users(limit)]
@@ -1,27 +1,112 @@
-
+import atexit
+import json
 import logging
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# Shared logging for the scripts and the API client.
+# Every _logger hands its records to one QueueHandler per logger name, and a single background
+# QueueListener thread formats and writes them, so stream I/O never blocks API or database work.
+# Messages use lazy %-style arguments, logger.info('Paused %s', schema) is only interpolated when
+# INFO is enabled, and the timestamp and line formatting happen on the listener thread.
+# configure() switches the shared output stream, level or to one json object per line.
+
+_TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+class JsonFormatter(logging.Formatter):
+    """One json object per line with time, level, logger name and message."""
+    def format(self, record):
+        entry = {'time': self.formatTime(record, _DATE_FORMAT), 'level': record.levelname,
+                 'logger': record.name, 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class _LazyQueueHandler(QueueHandler):
+    # QueueHandler.prepare formats the whole line in the calling thread, only merge the
+    # arguments here (they may change after the call) and leave formatting to the listener
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+_lock = threading.Lock()
+_queue = queue.SimpleQueue()
+_handler = logging.StreamHandler(sys.stderr)
+_handler.setFormatter(logging.Formatter(_TEXT_FORMAT, datefmt=_DATE_FORMAT))
+_listener = None
+
+def _start():
+    global _listener
+    with _lock:
+        if _listener is None:
+            _listener = QueueListener(_queue, _handler, respect_handler_level=True)
+            _listener.start()
+
+def _stop():
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        # processes everything queued so far before returning
+        listener.stop()
+    return listener is not None
+
+def flush():
+    """Blocks until every record logged so far has been written."""
+    if _stop():
+        _start()
+
+# write out what is still queued when the interpreter exits
+atexit.register(_stop)
+
+def configure(json_output=None, stream=None, level=None):
+    """Changes the shared output: json_output=True for one json object per line, stream for
+    another file object than stderr, level to filter on the handler for every logger."""
+    flush()
+    if stream is not None:
+        _handler.setStream(stream)
+    if json_output is not None:
+        _handler.setFormatter(JsonFormatter() if json_output else logging.Formatter(_TEXT_FORMAT, datefmt=_DATE_FORMAT))
+    if level is not None:
+        _handler.setLevel(getattr(logging, level) if isinstance(level, str) else level)
+
+def get_logger(name, level=None):
+    """The named logging.Logger wired to the shared queue, attached only once per name."""
+    logger = logging.getLogger(name)
+    if level is not None:
+        logger.setLevel(getattr(logging, level) if isinstance(level, str) else level)
+    if not any(isinstance(h, _LazyQueueHandler) for h in logger.handlers):
+        with _lock:
+            if not any(isinstance(h, _LazyQueueHandler) for h in logger.handlers):
+                logger.addHandler(_LazyQueueHandler(_queue))
+    _start()
+    return logger
 
 class _logger():
     def __init__(self, level, name=__file__):
-        logger = logging.getLogger(name)
-        logger.setLevel(getattr(logging, level))
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-        ch = logging.StreamHandler()
-        ch.setFormatter(formatter)
-        logger.addHandler(ch)
-        self.logger = logger
-
-    def info(self, message):
-        self.logger.info(message)
-
-    def debug(self, message):
-        self.logger.debug(message)
-
-    def warning(self, message):
-        self.logger.warning(message)
-
-    def error(self, message):
-        self.logger.error(message)
-    
+        self.logger = get_logger(name, level)
+
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def info(self, message, *args):
+        self.logger.info(message, *args)
+
+    def debug(self, message, *args):
+        self.logger.debug(message, *args)
+
+    def warning(self, message, *args):
+        self.logger.warning(message, *args)
+
+    def error(self, message, *args):
+        self.logger.error(message, *args)
+
+    def exception(self, message, *args):
+        self.logger.exception(message, *args)
+
     def newline(self):
-        self.logger.info("\n")
\ No newline at end of file
+        self.logger.info("\n")
@@ -8,6 +8,7 @@ import time
 import random
 from logger import _logger
 from fivetranapi import connection  # Import the Connection class if available
+from fivetran_inventory import ConnectionInventory
 
 
 api_key = 'fivetran_api_key'
@@ -15,28 +16,24 @@ api_secret = 'fivetran_api_secret'
 
 # cfg = config('fivetran_sql_server_payload.json')
 # group_id = next((item['group_id'] for item in cfg['payload'] if 'group_id' in item), 'default_group_id')
+logger = _logger('DEBUG', 'pause_sql_connector')
 try:
     ft = fivetranapi.connect(api_key, api_secret)
-    response = ft.get_connections()
+    inventory = ConnectionInventory.from_api(ft)
     
-    if response is not None and len(response) > 0:
-        # test: connection=response[0]
-        # first_connection: connection = response[0]  # Assuming response[0] is already a Connection object
-        
+    if len(inventory) > 0:
         # Filter connections where connected_by matches a specific value
         connected_by_value = "pug_persist"  # Replace with the value you want to match
-        filtered_connections = [
-            connection for c in response if connection.connected_by == connected_by_value
-        ]
+        filtered_connections = inventory.find(connected_by=connected_by_value)
         
         # # Print the filtered connections
         # for connection in filtered_connections:
-        #     _logger.info(f"Connection ID: {connection.id}")
-        #     _logger.info(f"Connection Name: {connection.name}")
-        #     _logger.info(f"Connected By: {connection.connected_by}")
+        #     logger.info(f"Connection ID: {connection.id}")
+        #     logger.info(f"Connection Schema: {connection.schema}")
+        #     logger.info(f"Connected By: {connection.connected_by}")
     else:
-        _logger.info("No response or empty response")
+        logger.info("No response or empty response")
 except Exception as e:
-    _logger.error(e)
+    logger.error(e)
         
 